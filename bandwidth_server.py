@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+bandwidth_server.py - 本地带宽测试服务，可代替 speed.cloudflare.com 和 httpbin.org 离线测速
+
+接口:
+    GET  /__down?bytes=<n>: 下载n字节 (与 speed.cloudflare.com 相同)，数据来自预先生成的随机文件，
+                            经 sendfile 零拷贝发送
+    POST /post, /__up:      上传接收端，支持 Content-Length 和分块编码，数据读入固定缓冲区后丢弃
+
+--download-mbps / --upload-mbps 大于0时按连接限速
+
+用法:
+    python bandwidth_server.py [--host <ip>] [--port <n>] [--download-mbps <n>] [--upload-mbps <n>]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8089
+# 预生成的随机数据大小，下载更多字节时循环发送
+DEFAULT_BLOB_SIZE = 16 * 1024 * 1024
+DEFAULT_DOWNLOAD_BYTES = 10 * 1024 * 1024
+# 单次读写的最大字节数，以及限速时每次发送的时间片(秒)
+IO_CHUNK_SIZE = 256 * 1024
+SHAPING_INTERVAL = 0.05
+
+
+def create_blob(size: int = DEFAULT_BLOB_SIZE, directory: str = None) -> str:
+    """生成不可压缩的随机数据文件，返回文件路径"""
+    fd, path = tempfile.mkstemp(prefix='bandwidth_', suffix='.bin', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        for offset in range(0, size, IO_CHUNK_SIZE):
+            f.write(os.urandom(min(IO_CHUNK_SIZE, size - offset)))
+    return path
+
+
+class Pacer:
+    """按 rate (字节/秒) 限速，rate 为0时不限速"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.start = time.monotonic()
+        self.sent = 0
+
+    def chunk_size(self) -> int:
+        return max(16 * 1024, int(self.rate * SHAPING_INTERVAL)) if self.rate else IO_CHUNK_SIZE
+
+    def wait(self, size: int):
+        if not self.rate:
+            return
+        self.sent += size
+        delay = self.sent / self.rate - (time.monotonic() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class BandwidthHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'BandwidthServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        if parsed.path != '/__down':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            size = int(urllib.parse.parse_qs(parsed.query).get('bytes', [DEFAULT_DOWNLOAD_BYTES])[0])
+        except ValueError:
+            self.send_json(400, {'error': 'invalid bytes'})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(max(0, size)))
+        self.end_headers()
+
+        pacer = Pacer(self.server.download_rate)
+        remaining = size
+        try:
+            with open(self.server.blob_path, 'rb') as blob:
+                while remaining > 0:
+                    offset = (size - remaining) % self.server.blob_size
+                    count = min(remaining, pacer.chunk_size(), self.server.blob_size - offset)
+                    sent = self.connection.sendfile(blob, offset, count)
+                    if not sent:
+                        break
+                    remaining -= sent
+                    pacer.wait(sent)
+        except OSError:
+            # 客户端提前断开(自适应测速达到上限后即关闭连接)
+            self.close_connection = True
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path not in ('/post', '/__up'):
+            self.send_json(404, {'error': 'not found'})
+            return
+        buffer = memoryview(bytearray(IO_CHUNK_SIZE))
+        pacer = Pacer(self.server.upload_rate)
+        received = 0
+        try:
+            if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0], 16)
+                    if size == 0:
+                        # 跳过可能存在的 trailer
+                        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                            pass
+                        break
+                    received += self.discard(size, buffer, pacer)
+                    self.rfile.readline()
+            else:
+                received = self.discard(int(self.headers.get('Content-Length', 0)), buffer, pacer)
+        except (OSError, ValueError):
+            self.close_connection = True
+            return
+        self.send_json(200, {'bytes': received})
+
+    def discard(self, size: int, buffer: memoryview, pacer: Pacer) -> int:
+        """读取并丢弃size字节，返回实际读到的字节数"""
+        remaining = size
+        while remaining > 0:
+            count = self.rfile.readinto(buffer[:min(remaining, len(buffer), pacer.chunk_size())])
+            if not count:
+                break
+            remaining -= count
+            pacer.wait(count)
+        return size - remaining
+
+
+class BandwidthServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], download_mbps: float = 0, upload_mbps: float = 0,
+                 blob_size: int = DEFAULT_BLOB_SIZE):
+        super().__init__(address, BandwidthHandler)
+        self.download_rate = download_mbps * 1000000 / 8
+        self.upload_rate = upload_mbps * 1000000 / 8
+        self.blob_size = blob_size
+        self.blob_path = create_blob(blob_size)
+
+    def url(self, path: str) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{path}'
+
+    def download_url(self, size: int = DEFAULT_DOWNLOAD_BYTES) -> str:
+        return self.url(f'/__down?bytes={size}')
+
+    def upload_url(self) -> str:
+        return self.url('/post')
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.remove(self.blob_path)
+        except OSError:
+            pass
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, download_mbps: float = 0,
+                 upload_mbps: float = 0) -> BandwidthServer:
+    """在后台线程启动服务，port为0时自动选择空闲端口；用完后调用 shutdown() 和 server_close()"""
+    server = BandwidthServer((host, port), download_mbps, upload_mbps)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地带宽测试服务")
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址, 默认127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'监听端口, 默认{DEFAULT_PORT}')
+    parser.add_argument('--download-mbps', type=float, default=0, help='每个连接的下载限速(Mbps), 默认0不限速')
+    parser.add_argument('--upload-mbps', type=float, default=0, help='每个连接的上传限速(Mbps), 默认0不限速')
+    parser.add_argument('--blob-size', type=int, default=DEFAULT_BLOB_SIZE,
+                        help=f'预生成随机数据的字节数, 默认{DEFAULT_BLOB_SIZE}')
+    args = parser.parse_args()
+
+    server = BandwidthServer((args.host, args.port), args.download_mbps, args.upload_mbps, args.blob_size)
+    print(f'bandwidth server listening at {server.url("")}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+carry_forward.py - 增量测试: 沿用上一次运行中已验证的节点
+
+verified_nodes.json 记录 node_fingerprint -> 最近验证通过的时间，按距今时长把节点分为三类:
+    trusted: 在 trust_ttl 内验证过，直接视为通过
+    recheck: 在 recheck_ttl 内验证过，只做一次延迟测试
+    fresh:   新节点或配置有变化的节点，走完整的测试流程
+
+用法:
+    python carry_forward.py <previous_dir> <target_dir> [--recheck-ttl <sec>]
+    把上一次合并输出中仍在有效期内的节点写入 target_dir/previous_proxies_N.yaml，与本次订阅节点一起测试
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+import yaml
+
+from fingerprint import node_fingerprint
+
+VERIFIED_STATE_FILE = 'verified_nodes.json'
+# 工作流每6小时运行一次: 12小时内验证过的节点直接沿用，3天内的只做一次复测
+DEFAULT_TRUST_TTL = 12 * 3600
+DEFAULT_RECHECK_TTL = 72 * 3600
+PREVIOUS_PREFIX = 'previous_proxies_'
+CHUNK_SIZE = 200
+
+
+def load_verified_state(path: str) -> Dict[str, float]:
+    """读取验证状态，文件不存在或损坏时返回空字典"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {fp: float(ts) for fp, ts in state.items()} if isinstance(state, dict) else {}
+
+
+def save_verified_state(path: str, state: Dict[str, float]):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, sort_keys=True, indent=0)
+    os.replace(tmp_file, path)
+
+
+class CarryForward:
+    """
+    上一次运行的验证状态，以及本次运行新验证的节点，可在多个线程间共享
+    """
+
+    def __init__(self, state: Dict[str, float], trust_ttl: float = DEFAULT_TRUST_TTL,
+                 recheck_ttl: float = DEFAULT_RECHECK_TTL):
+        self.previous = state
+        self.trust_ttl = trust_ttl
+        self.recheck_ttl = recheck_ttl
+        self.verified = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_directory(cls, directory: str, **kwargs) -> 'CarryForward':
+        return cls(load_verified_state(os.path.join(directory, VERIFIED_STATE_FILE)), **kwargs)
+
+    def age(self, proxy: Dict[str, Any]) -> float:
+        """距上次验证通过的秒数，从未验证过时为无穷大"""
+        verified_at = self.previous.get(node_fingerprint(proxy))
+        return time.time() - verified_at if verified_at is not None else float('inf')
+
+    def partition(self, proxies: List[Dict[str, Any]]) -> tuple[List[int], List[int], List[int]]:
+        """
+        按验证时间把节点分为 trusted / recheck / fresh 三类
+
+        返回: 三个序号列表，序号对应 proxies 中的位置
+        """
+        trusted, recheck, fresh = [], [], []
+        for i, proxy in enumerate(proxies):
+            age = self.age(proxy)
+            if age < self.trust_ttl:
+                trusted.append(i)
+            elif age < self.recheck_ttl:
+                recheck.append(i)
+            else:
+                fresh.append(i)
+        return trusted, recheck, fresh
+
+    def mark_verified(self, proxy: Dict[str, Any], verified_at: float = None):
+        """记录验证通过的节点；沿用的节点保留原验证时间，避免有效期被无限延长"""
+        fingerprint = node_fingerprint(proxy)
+        with self.lock:
+            if verified_at is None:
+                verified_at = time.time()
+            self.verified[fingerprint] = max(verified_at, self.verified.get(fingerprint, 0))
+
+    def mark_trusted(self, proxy: Dict[str, Any]):
+        self.mark_verified(proxy, self.previous[node_fingerprint(proxy)])
+
+    def save(self, path: str):
+        with self.lock:
+            save_verified_state(path, dict(self.verified))
+
+
+def carry_forward_proxies(previous_dir: str, target_dir: str, recheck_ttl: float = DEFAULT_RECHECK_TTL) -> int:
+    """
+    读取上一次合并输出的节点，把仍在 recheck_ttl 内验证过的节点分块写入 target_dir
+    返回写入的节点数
+    """
+    carry = CarryForward.from_directory(previous_dir, recheck_ttl=recheck_ttl)
+    proxies = []
+    seen = set()
+    for filename in sorted(os.listdir(previous_dir)):
+        if not filename.endswith('.yaml'):
+            continue
+        try:
+            with open(os.path.join(previous_dir, filename), 'r', encoding='utf-8') as f:
+                data = yaml.safe_load(f) or {}
+        except (OSError, yaml.YAMLError) as e:
+            print(f"跳过无法读取的文件 {filename}: {e}")
+            continue
+        for proxy in data.get('proxies', []) or []:
+            fingerprint = node_fingerprint(proxy)
+            if fingerprint not in seen and carry.age(proxy) < recheck_ttl:
+                seen.add(fingerprint)
+                proxies.append(proxy)
+
+    os.makedirs(target_dir, exist_ok=True)
+    for i in range(0, len(proxies), CHUNK_SIZE):
+        path = os.path.join(target_dir, f'{PREVIOUS_PREFIX}{i // CHUNK_SIZE + 1}.yaml')
+        with open(path, 'w', encoding='utf-8') as f:
+            yaml.safe_dump({'proxies': proxies[i:i + CHUNK_SIZE]}, f, allow_unicode=True)
+    return len(proxies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把上一次运行中已验证的节点加入本次测试")
+    parser.add_argument('previous_dir', help='上一次合并输出所在目录 (含 verified_nodes.json)')
+    parser.add_argument('target_dir', help='本次待测试的节点目录')
+    parser.add_argument('--recheck-ttl', type=int, default=DEFAULT_RECHECK_TTL,
+                        help=f'超过该时长(秒)未验证的节点不再沿用, 默认{DEFAULT_RECHECK_TTL}')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.previous_dir):
+        print(f"没有上一次运行的结果: {args.previous_dir}")
+        return
+    count = carry_forward_proxies(args.previous_dir, args.target_dir, args.recheck_ttl)
+    print(f"沿用上一次运行的节点: {count} 个")
+
+
+if __name__ == '__main__':
+    main()
@@ -638,9 +638,18 @@ def decode_url_to_nodes(url):
             # Fetch content from URL
             response = requests.get(url)
             response.raise_for_status()  # Raise an exception for bad status codes
-            
-            # Get content and decode if it's base64 encoded
-        content = response.text.strip()
+
+        return decode_content_to_nodes(response.text)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error fetching URL: {e}")
+        return []
+
+
+def decode_content_to_nodes(text):
+    """Parse subscription content (base64 / YAML / share links) into Clash nodes"""
+    try:
+        # Get content and decode if it's base64 encoded
+        content = text.strip()
         try:
             decoded_content = base64.b64decode(content).decode('utf-8')
         except:
@@ -696,9 +705,6 @@ def decode_url_to_nodes(url):
                     logging.error(f"Error parsing line '{line[:50]}...': {e}")
                     continue
         return nodes
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching URL: {e}")
-        return []
     except Exception as e:
         logging.error(f"Error processing nodes: {e}")
         return []
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+fake_mihomo.py - 模拟mihomo控制器，用于离线测试 mihomo_test 的调度逻辑
+
+读取与mihomo相同的配置文件，实现 /version、/proxies/{name}/delay、/group/{name}/delay、
+PUT /configs 接口，延迟按指定分布生成，不建立任何真实的代理连接。
+配置中的 listeners (mixed/socks) 以本地SOCKS5服务模拟，存活节点的连接直接转发到目标地址，
+失效节点拒绝连接，可用于离线测试吞吐量模式。
+
+用法:
+    python fake_mihomo.py -f <config.yaml> [options]
+    MIHOMO_BIN="python3 fake_mihomo.py --delay-dist lognormal:300,0.6" python mihomo_test.py --parallel ./sub
+
+选项:
+    --delay-dist <spec>: 节点基础延迟分布, fixed:<ms> | uniform:<low>,<high> | normal:<mean>,<std> |
+                         lognormal:<median>,<sigma>, 默认lognormal:300,0.6
+    --jitter <ratio>: 每次测试相对基础延迟的抖动, 默认0.1
+    --dead-ratio <ratio>: 失效节点比例, 默认0.3
+    --loss <ratio>: 存活节点单次测试的丢失概率, 默认0.05
+    --block-ratio <ratio>: 存活节点对某个测试URL不可达的概率(按节点和URL固定), 默认0
+    --time-scale <k>: 实际等待时间 = 模拟延迟 * k，0 表示立即返回, 默认1
+    --crash-after <n>: 处理n个延迟测试请求后进程退出，用于测试崩溃恢复, 默认0(不退出)
+    --seed <n>: 随机种子，相同种子下各节点的存活情况和基础延迟一致, 默认0
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+import yaml
+
+DEFAULT_DELAY_DIST = 'lognormal:300,0.6'
+DEFAULT_TIMEOUT_MS = 5000
+
+
+def parse_distribution(spec: str):
+    """解析延迟分布，返回以 random.Random 生成毫秒延迟的函数"""
+    kind, _, params = spec.partition(':')
+    try:
+        values = [float(v) for v in params.split(',')] if params else []
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'无效的延迟分布: {spec}')
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal' and len(values) == 2:
+        return lambda rng: rng.gauss(values[0], values[1])
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise argparse.ArgumentTypeError(f'无效的延迟分布: {spec}')
+
+
+class FakeController:
+    """保存当前配置和各节点的模拟状态"""
+
+    def __init__(self, args: argparse.Namespace, config: Dict[str, Any]):
+        self.args = args
+        self.distribution = parse_distribution(args.delay_dist)
+        self.lock = threading.Lock()
+        self.rng = random.Random(args.seed)
+        self.counters = {'delay_requests': 0, 'group_requests': 0, 'reloads': 0, 'active': 0, 'max_active': 0}
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.listeners = []
+        self.apply(config)
+
+    def apply(self, config: Dict[str, Any]):
+        proxies = config.get('proxies', []) or []
+        groups = {g.get('name'): g.get('proxies', []) or [] for g in config.get('proxy-groups', []) or []}
+        with self.lock:
+            self.proxies = {p.get('name'): p for p in proxies}
+            self.groups = groups
+        asyncio.run_coroutine_threadsafe(self.start_listeners(config.get('listeners', []) or []), self.loop).result()
+
+    async def start_listeners(self, listeners: List[Dict[str, Any]]):
+        """按配置重建本地监听端口"""
+        for server in self.listeners:
+            server.close()
+            await server.wait_closed()
+        self.listeners = []
+        for listener in listeners:
+            if listener.get('type') not in ('mixed', 'socks'):
+                continue
+            handler = lambda reader, writer, name=listener.get('proxy'): self.relay(name, reader, writer)
+            self.listeners.append(await asyncio.start_server(handler, listener.get('listen', '127.0.0.1'),
+                                                             int(listener['port'])))
+
+    async def relay(self, name: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """最简SOCKS5服务: 存活节点直接连接目标地址并双向转发，失效节点返回连接失败"""
+        try:
+            methods = (await reader.readexactly(2))[1]
+            await reader.readexactly(methods)
+            writer.write(b'\x05\x00')
+            _, _, _, address_type = await reader.readexactly(4)
+            if address_type == 1:
+                host = socket_address(await reader.readexactly(4))
+            elif address_type == 4:
+                host = socket_address(await reader.readexactly(16))
+            else:
+                host = (await reader.readexactly((await reader.readexactly(1))[0])).decode('idna')
+            port = int.from_bytes(await reader.readexactly(2), 'big')
+            alive, base = self.node(name)
+            if name not in self.proxies or not alive:
+                writer.write(b'\x05\x05\x00\x01' + bytes(6))
+                writer.close()
+                return
+            await asyncio.sleep(base * self.args.time_scale / 1000)
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, port)
+        except (OSError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+        writer.write(b'\x05\x00\x00\x01' + bytes(6))
+        await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer))
+
+    def node(self, name: str) -> tuple[bool, float]:
+        """节点的存活情况和基础延迟，只由种子、节点名决定"""
+        digest = hashlib.sha1(f'{self.args.seed}|{name}'.encode('utf-8')).digest()
+        rng = random.Random(digest)
+        alive = rng.random() >= self.args.dead_ratio
+        return alive, max(1.0, self.distribution(rng))
+
+    def blocked(self, name: str, url: str) -> bool:
+        """节点对该目标是否被屏蔽，只由种子、节点名和URL决定"""
+        digest = hashlib.sha1(f'{self.args.seed}|{name}|{url}'.encode('utf-8')).digest()
+        return int.from_bytes(digest[:4], 'big') / 2 ** 32 < self.args.block_ratio
+
+    def sample(self, name: str, timeout_ms: int, url: str = '') -> int:
+        """模拟一次延迟测试，返回毫秒延迟，失败时返回0"""
+        alive, base = self.node(name)
+        if self.blocked(name, url):
+            return 0
+        with self.lock:
+            lost = self.rng.random() < self.args.loss
+            delay = base * (1 + self.rng.gauss(0, self.args.jitter))
+        if not alive or lost or delay > timeout_ms:
+            return 0
+        return max(1, round(delay))
+
+    def wait(self, delay_ms: float):
+        if self.args.time_scale > 0 and delay_ms > 0:
+            time.sleep(delay_ms * self.args.time_scale / 1000)
+
+    def count_delay_request(self):
+        with self.lock:
+            self.counters['delay_requests'] += 1
+            if self.args.crash_after and self.counters['delay_requests'] > self.args.crash_after:
+                print('fake mihomo: crash_after reached, exiting', flush=True)
+                os._exit(1)
+
+
+def socket_address(packed: bytes) -> str:
+    import ipaddress
+    return str(ipaddress.ip_address(packed))
+
+
+async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+def make_handler(controller: FakeController, secret: str):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, code: int, body: Any = None):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8') if body is not None else b''
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def authorized(self) -> bool:
+            if secret and self.headers.get('Authorization') != f'Bearer {secret}':
+                self.send_json(401, {'message': 'Unauthorized'})
+                return False
+            return True
+
+        def test_url(self, query: Dict[str, List[str]]) -> str:
+            return query.get('url', [''])[0]
+
+        def timeout_ms(self, query: Dict[str, List[str]]) -> int:
+            try:
+                return int(query.get('timeout', [DEFAULT_TIMEOUT_MS])[0])
+            except ValueError:
+                return DEFAULT_TIMEOUT_MS
+
+        def do_GET(self):
+            if not self.authorized():
+                return
+            url = urllib.parse.urlparse(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            parts = [urllib.parse.unquote(p) for p in url.path.strip('/').split('/')]
+            if parts == ['version']:
+                return self.send_json(200, {'meta': True, 'version': 'fake'})
+            if parts == ['fake', 'stats']:
+                with controller.lock:
+                    return self.send_json(200, dict(controller.counters))
+            if len(parts) == 3 and parts[0] == 'proxies' and parts[2] == 'delay':
+                return self.proxy_delay(parts[1], self.timeout_ms(query), self.test_url(query))
+            if len(parts) == 3 and parts[0] == 'group' and parts[2] == 'delay':
+                return self.group_delay(parts[1], self.timeout_ms(query), self.test_url(query))
+            self.send_json(404, {'message': 'resource not found'})
+
+        def proxy_delay(self, name: str, timeout_ms: int, url: str):
+            controller.count_delay_request()
+            if name not in controller.proxies:
+                return self.send_json(404, {'message': 'resource not found'})
+            self.track(1)
+            try:
+                delay = controller.sample(name, timeout_ms, url)
+                controller.wait(delay or timeout_ms)
+            finally:
+                self.track(-1)
+            if not delay:
+                return self.send_json(504, {'message': 'Timeout'})
+            self.send_json(200, {'delay': delay})
+
+        def group_delay(self, name: str, timeout_ms: int, url: str):
+            with controller.lock:
+                controller.counters['group_requests'] += 1
+                members = controller.groups.get(name)
+            if members is None:
+                return self.send_json(404, {'message': 'resource not found'})
+            # 与mihomo一致: 组内节点并发测试，只返回成功的节点
+            delays = {member: controller.sample(member, timeout_ms, url) for member in members}
+            self.track(1)
+            try:
+                controller.wait(timeout_ms if not all(delays.values()) else max(delays.values(), default=0))
+            finally:
+                self.track(-1)
+            self.send_json(200, {member: delay for member, delay in delays.items() if delay})
+
+        def do_PUT(self):
+            if not self.authorized():
+                return
+            if urllib.parse.urlparse(self.path).path != '/configs':
+                return self.send_json(404, {'message': 'resource not found'})
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}').get('payload', '')
+                config = yaml.safe_load(payload) or {}
+            except (ValueError, yaml.YAMLError) as e:
+                return self.send_json(400, {'message': f'Body invalid: {e}'})
+            controller.apply(config)
+            with controller.lock:
+                controller.counters['reloads'] += 1
+            self.send_json(204)
+
+        def track(self, delta: int):
+            with controller.lock:
+                controller.counters['active'] += delta
+                controller.counters['max_active'] = max(controller.counters['max_active'],
+                                                        controller.counters['active'])
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟mihomo控制器")
+    parser.add_argument('-f', dest='config', required=True, help='mihomo配置文件路径')
+    parser.add_argument('-d', dest='home', default=None, help='兼容mihomo参数，忽略')
+    parser.add_argument('--delay-dist', default=DEFAULT_DELAY_DIST, help=f'延迟分布, 默认{DEFAULT_DELAY_DIST}')
+    parser.add_argument('--jitter', type=float, default=0.1, help='每次测试的抖动比例, 默认0.1')
+    parser.add_argument('--dead-ratio', type=float, default=0.3, help='失效节点比例, 默认0.3')
+    parser.add_argument('--loss', type=float, default=0.05, help='单次测试丢失概率, 默认0.05')
+    parser.add_argument('--block-ratio', type=float, default=0.0, help='节点对某个URL不可达的概率, 默认0')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='实际等待时间系数, 默认1')
+    parser.add_argument('--crash-after', type=int, default=0, help='处理n个延迟请求后退出, 默认0')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子, 默认0')
+    args = parser.parse_args()
+    parse_distribution(args.delay_dist)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    host, _, port = str(config.get('external-controller', '127.0.0.1:9090')).rpartition(':')
+    controller = FakeController(args, config)
+    try:
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), make_handler(controller, str(config.get('secret') or '')))
+    except OSError as e:
+        print(f'fake mihomo: listen {host}:{port} failed: {e}', file=sys.stderr)
+        sys.exit(1)
+    server.daemon_threads = True
+    print(f'fake mihomo: {len(controller.proxies)} proxies, API listening at {host}:{port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+fingerprint.py - 节点指纹
+
+endpoint_fingerprint: 只由协议、服务器和端口决定，用于记录失效的服务端
+node_fingerprint: 由除名称外的完整配置决定，配置有任何变化指纹都会改变
+"""
+
+import hashlib
+import json
+from typing import Any, Dict
+
+# 不影响连接行为的字段，不计入节点指纹
+COSMETIC_FIELDS = {'name'}
+
+
+def canonical_server(server: Any) -> str:
+    """统一服务器地址写法: 去除空白、IPv6方括号和结尾的点，转为小写"""
+    server = str(server or '').strip().lower()
+    if server.startswith('[') and server.endswith(']'):
+        server = server[1:-1]
+    return server.rstrip('.')
+
+
+def endpoint_fingerprint(proxy: Dict[str, Any]) -> str:
+    """协议 + 服务器 + 端口的指纹"""
+    try:
+        port = int(proxy.get('port', 0))
+    except (TypeError, ValueError):
+        port = 0
+    key = f"{proxy.get('type', '')}|{canonical_server(proxy.get('server'))}|{port}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def node_fingerprint(proxy: Dict[str, Any]) -> str:
+    """除名称外完整配置的指纹"""
+    config = {key: value for key, value in proxy.items() if key not in COSMETIC_FIELDS}
+    config['server'] = canonical_server(config.get('server'))
+    key = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 
+import argparse
 import base64
+import collections
+import hashlib
+import json
 import logging
 import multiprocessing
+import os
 import random
 import socket
 import threading
@@ -24,6 +29,9 @@ reader = geoip2.database.Reader('GeoLite2-Country.mmdb')
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(lineno)d - %(message)s')
 
 url_file = "./sub/url.txt"
+metrics_file = "./gen_yaml_metrics.json"
+checkpoint_dir = "./checkpoint"
+checkpoint_ttl = 3 * 3600  # 检查点有效期(秒)
 server_host = 'http://127.0.0.1:25500'
 # server_host = 'http://192.168.100.1:25500'
 # config_url = 'https://raw.githubusercontent.com/zzcabc/Rules/master/MyConvert/MyRules.ini'
@@ -98,7 +106,311 @@ def test_connection(ip, port):
         sock.close()
 
 
-def run(index, shared_list):
+def fetch_source(url, session, timeout=30):
+    """
+    下载订阅内容并记录各阶段耗时
+    返回: (响应文本, 指标字典)
+    """
+    metrics = {'dns_ms': None, 'ttfb_ms': None, 'download_ms': None, 'bytes': 0, 'status': None}
+    parsed = urllib.parse.urlparse(url)
+    if parsed.hostname:
+        start = time.perf_counter()
+        try:
+            socket.getaddrinfo(parsed.hostname, parsed.port or (443 if parsed.scheme == 'https' else 80))
+        except socket.error:
+            pass
+        metrics['dns_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    start = time.perf_counter()
+    resp = session.get(url, timeout=timeout, stream=True)
+    # stream=True 时 get 在收到响应头后返回，即首字节时间
+    metrics['ttfb_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    metrics['status'] = resp.status_code
+    start = time.perf_counter()
+    content = resp.content
+    metrics['download_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    metrics['bytes'] = len(content)
+    return resp.text, metrics
+
+
+def percentile(values, q):
+    """线性插值计算百分位数, q 取值 0-100"""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return round(values[lower] + (values[upper] - values[lower]) * (pos - lower), 2)
+
+
+def write_metrics_report(metrics_list, report_file):
+    """将每个订阅源的指标及汇总百分位数写入JSON报告"""
+    sources = list(metrics_list)
+    summary = {}
+    for field in ('dns_ms', 'ttfb_ms', 'download_ms', 'parse_ms', 'bytes', 'nodes', 'rejected'):
+        values = [m[field] for m in sources if m.get(field) is not None]
+        summary[field] = {
+            'count': len(values),
+            'total': round(sum(values), 2),
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': max(values) if values else None,
+        }
+    rejected_by_rule = collections.Counter()
+    for m in sources:
+        rejected_by_rule.update(m.get('rejected_by_rule', {}))
+    report = {
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'source_count': len(sources),
+        'failed_sources': len([m for m in sources if m.get('error')]),
+        'summary': summary,
+        'rejected_by_rule': dict(rejected_by_rule),
+        'sources': sorted(sources, key=lambda m: m.get('total_ms') or 0, reverse=True),
+    }
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logging.info("Metrics report written to %s", report_file)
+
+
+def check_proxy(proxie, node_name):
+    """
+    按规则校验并修正单个节点
+    返回: 被拒绝的规则名, 通过时返回 None
+    """
+    server = proxie['server']
+    name = proxie['name']
+    if name not in node_name:
+        node_name.add(name)
+    else:
+        name = name + str(len(node_name))
+        proxie['name'] = name
+    # Special handling for SS nodes without obfs parameter
+    if proxie.get('type') == 'ss' and 'obfs' not in proxie:
+        # SS nodes without obfs parameter should not be removed
+        return 'ss_without_obfs'
+    # TLS must be true with h2/ grpc network
+    if "network" in proxie.keys() and "tls" in proxie.keys():
+        network = proxie['network']
+        tls = proxie['tls']
+        if network == "h2" or network == "grpc":
+            if tls is False:
+                return 'tls_required'
+    if "cipher" in proxie.keys() and proxie['cipher'] not in cipher_list:
+        return 'cipher'
+    if server in exce_url:
+        return 'excluded_server'
+    if server.startswith("127") or server.startswith("192") or server.startswith("10."):
+        return 'private_server'
+    if "uuid" in proxie.keys() and len(proxie['uuid']) != 36:
+        return 'uuid'
+    # 校验protocol-param是否正常
+    if "protocol-param" in proxie.keys():
+        try:
+            proxie['protocol-param'] = base64.b64decode(proxie['protocol-param']).decode('utf-8')
+        except Exception:
+            return 'protocol_param'
+
+    # 过滤REALITY配置不完整的节点
+    if proxie.get('type') == 'vless':
+        reality_opts = proxie.get('reality-opts', {})
+        if reality_opts:
+            # 检查REALITY必需字段
+            required_reality = ['public-key', 'short-id']
+            missing_fields = []
+            for field in required_reality:
+                if field not in reality_opts or not reality_opts[field]:
+                    missing_fields.append(field)
+
+            if missing_fields:
+                logging.warning(f"REALITY节点 {name} 缺少字段: {missing_fields}")
+                return 'reality'
+
+            # 验证public-key格式
+            public_key = reality_opts.get('public-key', '')
+            if not public_key.endswith('='):
+                logging.warning(f"REALITY节点 {name} public-key格式无效")
+                return 'reality'
+
+            # 验证short-id格式
+            short_id = reality_opts.get('short-id', '')
+            if not short_id or len(short_id) < 4:
+                logging.warning(f"REALITY节点 {name} short-id格式无效")
+                return 'reality'
+
+    # add name emoji
+    # if not has_emoji(name):
+    #     c_emoji = get_country_emoji(server)
+    #     if c_emoji is not None:
+    #         proxie['name'] = name + str(c_emoji)
+    #     else:
+    #         return 'emoji'
+    return None
+
+
+def process_source(url, session, node_name, not_proxies):
+    """
+    抓取并解析单个订阅源
+    返回: (节点列表, 指标字典)
+    """
+    metrics = {'url': url, 'via': 'direct', 'nodes': 0, 'rejected': 0, 'rejected_by_rule': {}}
+    started = time.perf_counter()
+    new_proxies = []
+    try:
+        # 直接下载并解析订阅内容
+        text, fetch_metrics = fetch_source(url, session)
+        metrics.update(fetch_metrics)
+        start = time.perf_counter()
+        nodes = decode_url.decode_content_to_nodes(text) if 200 <= fetch_metrics['status'] < 300 else []
+        metrics['parse_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        if nodes:
+            new_proxies.extend(nodes)
+            metrics['nodes'] = len(nodes)
+            logging.info(f"Successfully parsed {len(nodes)} nodes from {url}")
+            metrics['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            return new_proxies, metrics
+    except Exception as e:
+        logging.error(f"Error processing URL {url}: {str(e)}")
+        pass
+    url_quote = urllib.parse.quote(url, safe='')
+    # config_quote = urllib.parse.quote(config_url, safe='')
+    # include_quote = urllib.parse.quote(include, safe='')
+    exclude_quote = urllib.parse.quote(exclude, safe='')
+    # 转换并获取订阅链接数据
+    converted_url = server_host + '/sub?target=clash&url=' + url_quote + \
+                    '&emoji=true&list=true&tfo=true&scv=true&fdn=true&sort=false&new_name=true&exclude=' + exclude_quote
+    metrics['via'] = 'subconverter'
+    rejected = collections.Counter()
+    try:
+        # lock.acquire()
+        # 如果解析出错，将原始链接内容拷贝下来
+        text, fetch_metrics = fetch_source(converted_url, session)
+        # DNS 耗时以原始订阅域名为准
+        fetch_metrics.pop('dns_ms')
+        metrics.update(fetch_metrics)
+        start = time.perf_counter()
+        try:
+            text.encode('utf-8')
+            yaml_text = yaml.safe_load(text)
+        except Exception as err:
+            logging.error(f"{url} {err.args[0]}")
+            metrics['error'] = 'yaml'
+            return new_proxies, metrics
+        finally:
+            metrics['parse_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        if 'No nodes were found!' in text:
+            logging.error("%s No nodes were found!", url)
+            metrics['error'] = 'no_nodes'
+            return new_proxies, metrics
+        if 'The following link' in text:
+            logging.error("%s The following link!", url)
+            metrics['error'] = 'invalid_link'
+            return new_proxies, metrics
+        if '414 Request-URI Too Large' in text:
+            logging.error("%s 414 Request-URI Too Large!", url)
+            metrics['error'] = 'uri_too_large'
+            return new_proxies, metrics
+        if yaml_text is None:
+            logging.error("%s is None!", url)
+            metrics['error'] = 'empty'
+            return new_proxies, metrics
+        if yaml_text is not None and 'proxies' in yaml_text.keys():
+            proxies = yaml_text['proxies']
+            logging.info(f"{url}    {len(proxies)}")
+            random.shuffle(proxies)
+            start = time.perf_counter()
+            for proxie in proxies:
+                try:
+                    rule = check_proxy(proxie, node_name)
+                    if rule is not None:
+                        not_proxies.add(proxie['server'])
+                        rejected[rule] += 1
+                        continue
+                    new_proxies.append(proxie)
+                except Exception as e:
+                    not_proxies.add(proxie['server'])
+                    rejected['error'] += 1
+                    logging.error(f"proxie:{proxie} error:{e.args[0]}")
+                    continue
+            metrics['parse_ms'] = round(metrics['parse_ms'] + (time.perf_counter() - start) * 1000, 2)
+    except Exception as err:
+        # 链接有问题，直接返回原始错误
+        logging.error(f"url:{url}  error:{err.args[0]}")
+        metrics['error'] = type(err).__name__
+    # finally:
+    # lock.release()
+    metrics['nodes'] = len(new_proxies)
+    metrics['rejected'] = sum(rejected.values())
+    metrics['rejected_by_rule'] = dict(rejected)
+    metrics['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return new_proxies, metrics
+
+
+def load_checkpoint(checkpoint_dir, max_age):
+    """
+    读取检查点清单，返回在有效期内完成的订阅源 {url: 清单条目}
+    清单按有效条目重写，过期的结果文件一并删除，清单不会无限增长
+    """
+    manifest_file = os.path.join(checkpoint_dir, 'manifest.jsonl')
+    if not os.path.exists(manifest_file):
+        return {}
+    entries = {}
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 进程被杀时可能留下不完整的最后一行
+                continue
+            entries[entry['url']] = entry
+    now = time.time()
+    fresh = {}
+    for url, entry in entries.items():
+        if now - entry['completed_at'] > max_age:
+            continue
+        if not os.path.exists(os.path.join(checkpoint_dir, entry['file'])):
+            continue
+        fresh[url] = entry
+
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        for entry in fresh.values():
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    os.replace(tmp_file, manifest_file)
+    kept = {entry['file'] for entry in fresh.values()}
+    for file_name in os.listdir(checkpoint_dir):
+        if file_name.endswith('.json') and file_name not in kept:
+            os.remove(os.path.join(checkpoint_dir, file_name))
+    logging.info("Loaded %d fresh sources from checkpoint %s", len(fresh), checkpoint_dir)
+    return fresh
+
+
+def save_checkpoint(checkpoint_dir, url, nodes, metrics, discarded, lock):
+    """持久化单个订阅源的结果(含被丢弃节点的服务器)，并追加到清单"""
+    file_name = hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json'
+    file_path = os.path.join(checkpoint_dir, file_name)
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'nodes': nodes, 'metrics': metrics, 'discarded': sorted(discarded)}, f,
+                  ensure_ascii=False)
+    os.replace(tmp_path, file_path)
+    entry = {'url': url, 'file': file_name, 'completed_at': time.time(), 'nodes': len(nodes)}
+    with lock:
+        with open(os.path.join(checkpoint_dir, 'manifest.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def read_checkpoint(checkpoint_dir, entry):
+    """读取检查点中保存的订阅源结果，返回: (节点列表, 指标字典, 被丢弃节点的服务器集合)"""
+    with open(os.path.join(checkpoint_dir, entry['file']), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    metrics = data['metrics']
+    metrics['resumed'] = True
+    return data['nodes'], metrics, set(data.get('discarded', []))
+
+
+def run(index, shared_list, metrics_list, checkpoint_dir=None, checkpoint=None, lock=None):
     # print(threading.current_thread().getName(), "开始工作")
     # for i in range(0, length, step):
     yaml_file = "./sub/" + str(index) + ".yaml"
@@ -113,159 +425,33 @@ def run(index, shared_list):
     servers = set()
     node_list = {}
     node_name = set()
+    s = requests.Session()
+    s.mount('http://', HTTPAdapter(max_retries=5))
+    s.mount('https://', HTTPAdapter(max_retries=5))
     for url in url_lists:
-        try:
-            # 使用 lock 确保多进程调用时数据安全
-            with threading.Lock():
-                nodes = decode_url.decode_url_to_nodes(url)
-                if nodes:
-                    new_proxies.extend(nodes)
-                    logging.info(f"Successfully parsed {len(nodes)} nodes from {url}")
-                    if len(nodes) > 0:
-                        continue
-        except Exception as e:
-            logging.error(f"Error processing URL {url}: {str(e)}")
-            pass
-        url_quote = urllib.parse.quote(url, safe='')
-        # config_quote = urllib.parse.quote(config_url, safe='')
-        # include_quote = urllib.parse.quote(include, safe='')
-        exclude_quote = urllib.parse.quote(exclude, safe='')
-        # 转换并获取订阅链接数据
-        converted_url = server_host + '/sub?target=clash&url=' + url_quote + \
-                        '&emoji=true&list=true&tfo=true&scv=true&fdn=true&sort=false&new_name=true&exclude=' + exclude_quote
-        try:
-            # lock.acquire()
-            s = requests.Session()
-            s.mount('http://', HTTPAdapter(max_retries=5))
-            s.mount('https://', HTTPAdapter(max_retries=5))
-            resp = s.get(converted_url, timeout=30)
-            # 如果解析出错，将原始链接内容拷贝下来
-            text = resp.text
+        if checkpoint and url in checkpoint:
             try:
-                text.encode('utf-8')
-                yaml_text = yaml.safe_load(text)
-            except Exception as err:
-                logging.error(f"{url} {err.args[0]}")
-                continue
-            if 'No nodes were found!' in text:
-                logging.error("%s No nodes were found!", url)
-                continue
-            if 'The following link' in text:
-                logging.error("%s The following link!", url)
-                continue
-            if '414 Request-URI Too Large' in text:
-                logging.error("%s 414 Request-URI Too Large!", url)
+                nodes, metrics, discarded = read_checkpoint(checkpoint_dir, checkpoint[url])
+                node_name.update(node['name'] for node in nodes)
+                not_proxies.update(discarded)
+                new_proxies.extend(nodes)
+                metrics_list.append(metrics)
+                logging.info("Resumed %d nodes of %s from checkpoint", len(nodes), url)
                 continue
-            if yaml_text is None:
-                logging.error("%s is None!", url)
-                continue
-            if yaml_text is not None and 'proxies' in yaml_text.keys():
-                proxies = yaml_text['proxies']
-                logging.info(f"{url}    {len(proxies)}")
-                random.shuffle(proxies)
-                for proxie in proxies:
-                    try:
-                        server = proxie['server']
-                        # port = proxie['port']
-                        # sp = str(server) + ":" + str(port)
-                        # if not test_connection(server, port):
-                        #     servers.add(sp)
-                        #     not_proxies.add(proxie['server'])
-                        #     continue
-                        # if sp in servers:
-                        #     not_proxies.add(proxie['server'])
-                        #     continue
-                        # else:
-                        #     servers.add(sp)
-                        name = proxie['name']
-                        if name not in node_name:
-                            node_name.add(name)
-                        else:
-                            name = name + str(len(node_name))
-                            proxie['name'] = name
-                        # Special handling for SS nodes without obfs parameter
-                        if proxie.get('type') == 'ss' and 'obfs' not in proxie:
-                            # SS nodes without obfs parameter should not be removed
-                            not_proxies.add(proxie['server'])
-                            continue
-                        # TLS must be true with h2/ grpc network
-                        if "network" in proxie.keys() and "tls" in proxie.keys():
-                            network = proxie['network']
-                            tls = proxie['tls']
-                            if network == "h2" or network == "grpc":
-                                if tls is False:
-                                    not_proxies.add(proxie['server'])
-                                    continue
-                        if "cipher" in proxie.keys() and proxie['cipher'] not in cipher_list:
-                            not_proxies.add(proxie['server'])
-                            continue
-                        if server in exce_url:
-                            not_proxies.add(proxie['server'])
-                            continue
-                        if server.startswith("127") or server.startswith("192") or server.startswith("10."):
-                            not_proxies.add(proxie['server'])
-                            continue
-                        if "uuid" in proxie.keys() and len(proxie['uuid']) != 36:
-                            not_proxies.add(proxie['server'])
-                            continue
-                        # 校验protocol-param是否正常
-                        if "protocol-param" in proxie.keys():
-                            try:
-                                proxie['protocol-param'] = base64.b64decode(proxie['protocol-param']).decode('utf-8')
-                            except Exception as e:
-                                not_proxies.add(proxie['server'])
-                                continue
-
-                        # 过滤REALITY配置不完整的节点
-                        if proxie.get('type') == 'vless':
-                            reality_opts = proxie.get('reality-opts', {})
-                            if reality_opts:
-                                # 检查REALITY必需字段
-                                required_reality = ['public-key', 'short-id']
-                                missing_fields = []
-                                for field in required_reality:
-                                    if field not in reality_opts or not reality_opts[field]:
-                                        missing_fields.append(field)
-
-                                if missing_fields:
-                                    logging.warning(f"REALITY节点 {name} 缺少字段: {missing_fields}")
-                                    not_proxies.add(proxie['server'])
-                                    continue
-
-                                # 验证public-key格式
-                                public_key = reality_opts.get('public-key', '')
-                                if not public_key.endswith('='):
-                                    logging.warning(f"REALITY节点 {name} public-key格式无效")
-                                    not_proxies.add(proxie['server'])
-                                    continue
-
-                                # 验证short-id格式
-                                short_id = reality_opts.get('short-id', '')
-                                if not short_id or len(short_id) < 4:
-                                    logging.warning(f"REALITY节点 {name} short-id格式无效")
-                                    not_proxies.add(proxie['server'])
-                                    continue
-                        
-                        # add name emoji
-                        # if not has_emoji(name):
-                        #     c_emoji = get_country_emoji(server)
-                        #     if c_emoji is not None:
-                        #         proxie['name'] = name + str(c_emoji)
-                        #     else:
-                        #         not_proxies.add(proxie['server'])
-                        #         continue
-                        new_proxies.append(proxie)
-                    except Exception as e:
-                        not_proxies.add(proxie['server'])
-                        logging.error(f"proxie:{proxie} error:{e.args[0]}")
-                        continue
-        except Exception as err:
-            # 链接有问题，直接返回原始错误
-            logging.error(f"url:{url}  error:{err.args[0]}")
-            continue
-        # finally:
-        # lock.release()
-        continue
+            except Exception as e:
+                logging.error(f"Error reading checkpoint of {url}: {e}")
+        # 每个订阅源单独收集被丢弃的服务器，以便随检查点保存
+        discarded = set()
+        nodes, metrics = process_source(url, s, node_name, discarded)
+        not_proxies.update(discarded)
+        new_proxies.extend(nodes)
+        metrics_list.append(metrics)
+        # 出错的订阅源(抓取失败、订阅转换失败等)不记入检查点，下次重新抓取
+        if checkpoint_dir and not metrics.get('error'):
+            try:
+                save_checkpoint(checkpoint_dir, url, nodes, metrics, discarded, lock)
+            except Exception as e:
+                logging.error(f"Error saving checkpoint of {url}: {e}")
     try:
         # lock.acquire()
         if new_proxies is not None:
@@ -323,12 +509,31 @@ def split_node(n, shared_list):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="抓取订阅源并生成待测速的节点文件")
+    parser.add_argument('--checkpoint-dir', default=checkpoint_dir,
+                        help=f'检查点目录, 默认{checkpoint_dir}')
+    parser.add_argument('--checkpoint-ttl', type=int, default=checkpoint_ttl,
+                        help=f'检查点有效期(秒), 在此期间完成的订阅源不再重新抓取, 默认{checkpoint_ttl}')
+    parser.add_argument('--no-checkpoint', action='store_true',
+                        help='禁用检查点, 所有订阅源重新抓取')
+    args = parser.parse_args()
+
+    checkpoint = {}
+    if args.no_checkpoint:
+        args.checkpoint_dir = None
+    else:
+        os.makedirs(args.checkpoint_dir, exist_ok=True)
+        checkpoint = load_checkpoint(args.checkpoint_dir, args.checkpoint_ttl)
+
     # 创建多个进程
     processes = []
     manager = multiprocessing.Manager()
     shared_list = manager.list()
+    metrics_list = manager.list()
+    checkpoint_lock = manager.Lock()
     for i in range(thread_num):
-        p = multiprocessing.Process(target=run, args=(i, shared_list,))
+        p = multiprocessing.Process(target=run, args=(i, shared_list, metrics_list,
+                                                      args.checkpoint_dir, checkpoint, checkpoint_lock,))
         processes.append(p)
         p.start()
     logging.info("多进程已启动")
@@ -354,6 +559,7 @@ if __name__ == '__main__':
             p.join()
 
     logging.info("多进程已结束，当前节点数：%d", len(shared_list))
+    write_metrics_report(metrics_list, metrics_file)
     random.shuffle(shared_list)
     each_num = 1000
     thread_list = []
@@ -3,40 +3,130 @@ import os
 
 import yaml
 
+from carry_forward import VERIFIED_STATE_FILE, load_verified_state, save_verified_state
+from fingerprint import node_fingerprint
+
 # 日志输出
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(lineno)d - %(message)s')
 
+# 每个输出文件的节点数
+SHARD_SIZE = 200
+
+
+def skip_node(loader):
+    """跳过一个节点(标量、序列或映射)的全部事件，不构造对象"""
+    depth = 0
+    while True:
+        event = loader.get_event()
+        if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+            depth += 1
+        elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+            depth -= 1
+        if depth == 0:
+            return
+
+
+def iter_proxies(stream):
+    """
+    逐个读取YAML文件中 proxies 列表的节点
+    只有当前节点会构造为对象，proxy-groups、rules 等其余部分按事件跳过，内存占用与文件大小无关
+    """
+    loader = yaml.SafeLoader(stream)
+    try:
+        loader.get_event()  # StreamStart
+        if not loader.check_event(yaml.DocumentStartEvent):
+            return
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            return
+        loader.get_event()
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = loader.construct_document(loader.compose_node(None, None))
+            if key == 'proxies' and loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield loader.construct_document(loader.compose_node(None, None))
+                loader.get_event()
+            else:
+                skip_node(loader)
+    finally:
+        loader.dispose()
+
+
+class ShardWriter:
+    """节点写满 SHARD_SIZE 个即写出一个文件，内存中只保留当前分片"""
+
+    def __init__(self, directory, prefix='merged_proxies', shard_size=SHARD_SIZE):
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.chunk = []
+        self.paths = []
+        self.total = 0
+
+    def add(self, proxy):
+        self.chunk.append(proxy)
+        self.total += 1
+        if len(self.chunk) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if not self.chunk:
+            return
+        # 先写临时文件，全部输入读完后再改名，避免覆盖尚未读取的同名输入文件
+        path = os.path.join(self.directory, f'{self.prefix}_{len(self.paths) + 1}.yaml.tmp')
+        with open(path, 'w', encoding='utf-8') as file:
+            yaml.safe_dump({'proxies': self.chunk}, file, allow_unicode=True)
+        logging.info(f"Writing to {path[:-len('.tmp')]}")
+        self.paths.append(path)
+        self.chunk = []
+
+    def close(self):
+        self.flush()
+        for path in self.paths:
+            os.replace(path, path[:-len('.tmp')])
+
+
 def merge_proxies(directory, output_file):
-    all_proxies = []
+    """
+    流式合并目录下全部YAML文件的节点: 逐个读取节点，按节点指纹去重(名称同样不可重复)，
+    每 SHARD_SIZE 个写出一个 merged_proxies_N.yaml，内存只占一个分片加去重索引
+    """
     seen_names = set()  # 用于存储已经遇到的代理名称
-    seen_servers = set()
+    seen_fingerprints = set()
+    writer = ShardWriter(directory)
 
     # 遍历目录下的所有 .yaml 文件
-    for filename in os.listdir(directory):
-        if filename.endswith('.yaml'):
-            filepath = os.path.join(directory, filename)
-            with open(filepath, 'r', encoding='utf-8') as file:
-                logging.info(f"Processing {filepath}")
-                data = yaml.safe_load(file)
-                if 'proxies' in data:
-                    for proxy in data['proxies']:
-                        if proxy['name'] not in seen_names and proxy['server'] not in seen_servers:  # 检查代理名称是否已经存在
-                            all_proxies.append(proxy)
-                            seen_names.add(proxy['name'])  # 将新的代理名称添加到集合中
-                            seen_servers.add(proxy['server'])
-            os.remove(filepath)
-
-    logging.info(f"Total proxies: {len(all_proxies)}")
-    nodes_nums = 200;
-    # 每1000条生成一个yaml文件
-    for i in range(0, len(all_proxies), nodes_nums):
-        if len(all_proxies[i:]) - nodes_nums < 0:
-            chunk = all_proxies[i:]
-        else:
-            chunk = all_proxies[i:i+nodes_nums]
-        with open(f'sub/merged_proxies_{i//nodes_nums+1}.yaml', 'w', encoding='utf-8') as file:
-            yaml.safe_dump({'proxies': chunk}, file, allow_unicode=True)
-            logging.info(f"Writing to {file.name}")
-
-# 使用示例
-merge_proxies('sub', 'sub/merged_proxies.yaml')
\ No newline at end of file
+    for filename in [f for f in os.listdir(directory) if f.endswith('.yaml')]:
+        filepath = os.path.join(directory, filename)
+        with open(filepath, 'r', encoding='utf-8') as file:
+            logging.info(f"Processing {filepath}")
+            try:
+                for proxy in iter_proxies(file):
+                    if not isinstance(proxy, dict) or proxy.get('name') in seen_names:
+                        continue
+                    fingerprint = node_fingerprint(proxy)
+                    if fingerprint in seen_fingerprints:
+                        continue
+                    writer.add(proxy)
+                    seen_names.add(proxy.get('name'))  # 将新的代理名称添加到集合中
+                    seen_fingerprints.add(fingerprint)
+            except yaml.YAMLError as e:
+                logging.warning(f"Failed to parse {filepath}: {e}")
+        os.remove(filepath)
+
+    writer.close()
+    logging.info(f"Total proxies: {writer.total}")
+
+    # 验证状态只保留最终合并输出的节点，供下一次增量测试使用
+    state_file = os.path.join(directory, VERIFIED_STATE_FILE)
+    if os.path.exists(state_file):
+        state = load_verified_state(state_file)
+        state = {fp: ts for fp, ts in state.items() if fp in seen_fingerprints}
+        save_verified_state(state_file, state)
+        logging.info(f"Verified state: {len(state)}/{writer.total} proxies")
+
+
+if __name__ == '__main__':
+    # 使用示例
+    merge_proxies('sub', 'sub/merged_proxies.yaml')
@@ -14,53 +14,150 @@ mihomo_test.py - 使用mihomo API测试代理节点延迟并筛选可用节点
     --api-url <url>: mihomo API地址, 默认http://127.0.0.1:9090
     --timeout <sec>: 测试超时时间(秒), 默认10
     --test-url <url>: 测试URL, 默认https://www.gstatic.com/generate_204
+    --concurrency <n>: 同一mihomo实例上并发测试的节点数, 默认32
+    --group-test: 通过 /group/{name}/delay 按分组批量测试
+    --group-size <n>: 批量测试的分组大小, 0 表示预筛通过的节点放入同一分组(单文件模式下使用 Proxy 分组), 默认0
+    --reuse: 并行模式下每个工作线程复用一个mihomo实例，通过 PUT /configs 热加载各文件
+    --pool-size <n>: 并行模式下的mihomo实例数, 0 表示按可用内存自动确定, 默认0
+    --instance-memory <mb>: 单个mihomo实例预估占用内存(MB), 默认150
+    --prescreen: 先并发做DNS + TCP/UDP预筛，只有存活的节点才进行mihomo测试
+    --prescreen-timeout <sec>: 预筛超时(秒), 默认2
+    --prescreen-tls: 预筛时使用TLS的节点按其 sni/alpn/skip-cert-verify 完成TLS握手 (隐含 --prescreen)
+    --samples <n>: 每个节点最多测试次数，大于1时记录延迟统计并按综合评分(延迟、抖动、丢失率、可达性)排序输出, 默认1
+    --max-loss <ratio>: 多次测试时允许的最大丢失率, 默认0.5
+    --time-limit <sec>: 运行时间上限(秒)，到达后停止测试并保留已通过的节点, 默认18000
+    --node-queue: 并行模式下所有文件的节点进入同一队列，各mihomo实例按批取出测试
+    --batch-size <n>: 节点队列模式下每批加载的节点数, 默认100
+    --negative-cache <path>: 失效服务端缓存文件，退避期内的失效节点不再测试，测试结果写回缓存
+    --previous <dir>: 增量测试，读取该目录下上一次运行的 verified_nodes.json，
+                      近期验证过的节点直接沿用或只复测一次，本次验证状态写入输出目录
+    --trust-ttl <sec>: 验证后直接沿用的时长(秒), 默认43200
+    --recheck-ttl <sec>: 验证后只复测一次的时长(秒), 默认259200
+    --test-urls <url,...>: 额外的测试目标，每个完成测试的节点再并发测试各目标，
+                           各目标延迟(0为不可达)作为可达性向量写入 .stats.json，未保留的节点标记 passed: false
+    --min-targets <n>: 至少可达的额外目标数，不足的节点不保留, 默认0
+    --results-db <path>: 测试结果历史记录文件，每个节点的延迟测量追加写入 (见 result_store.py)
+    --mihomo-bin <cmd>: 启动mihomo的命令, 可带参数, 如 "python3 fake_mihomo.py --time-scale 0.1",
+                        默认取环境变量 MIHOMO_BIN, 未设置时为 mihomo
 """
 
 import argparse
-import multiprocessing
+import json
+import math
 import os
+import queue
+import shlex
 import signal
+import socket
+import statistics
 import subprocess
 import sys
+import threading
 import time
 import urllib.parse
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Union
 
 import requests
 import yaml
+from requests.adapters import HTTPAdapter
+
+import node_score
+import prescreen
+from carry_forward import (DEFAULT_RECHECK_TTL, DEFAULT_TRUST_TTL, VERIFIED_STATE_FILE,
+                           CarryForward)
+from negative_cache import NegativeCache
+from result_store import ResultStore
 
 # 全局超时标志
 timeout_occurred = False
 start_time = None
 
+# 运行时间上限(秒)，到达后停止测试并保留已通过的节点
+DEFAULT_TIME_LIMIT = 5 * 3600
+time_limit = DEFAULT_TIME_LIMIT
+
+# 启动mihomo的命令，可替换为 fake_mihomo.py 等兼容 -f 参数的程序
+DEFAULT_MIHOMO_BIN = os.environ.get('MIHOMO_BIN', 'mihomo')
+mihomo_command = shlex.split(DEFAULT_MIHOMO_BIN)
+
+# 通过的节点增量写入输出文件的最小间隔(秒)
+FLUSH_INTERVAL = 30
+
+# 默认并发测试数
+DEFAULT_CONCURRENCY = 32
+
+# mihomo实例池: 单个实例预估内存(MB)、池大小上限、控制器响应耗时上限(秒)
+DEFAULT_INSTANCE_MEMORY_MB = 150
+MAX_POOL_SIZE = 32
+DEFAULT_MAX_API_LATENCY = 0.5
+# 连续这么多次控制器响应超过上限才缩减实例池，避免偶发的慢响应永久减少实例
+API_SLOW_PINGS = 3
+
+# 并行模式下的测试参数
+PARALLEL_MAX_DELAY = 1000
+PARALLEL_TIMEOUT = 15
+DEFAULT_TEST_URL = 'https://www.gstatic.com/generate_204'
+
+# 节点级任务队列模式下每批加载到mihomo的节点数
+DEFAULT_BATCH_SIZE = 100
+# 实例失败时批次拆成两半重新入队的最多次数，仍失败的节点记为未测试
+BATCH_RETRIES = 3
+
+# 多次测试时允许的最大丢失率
+DEFAULT_MAX_LOSS = 0.5
+
+# mihomo 以这些状态码表示节点本身超时或测试出错，其余状态码和请求异常视为控制器故障
+NODE_FAILURE_STATUS = (408, 503, 504)
+# 控制器故障时 test_proxy_delay 返回的延迟值，不能据此判断节点失效
+CONTROLLER_ERROR = -1
+
+# 批量测试时使用的分组
+PROXY_GROUP_NAME = 'Proxy'
+BATCH_GROUP_PREFIX = 'Batch-'
+
 
 def timeout_handler(signum, frame):
-    """超时信号处理器"""
+    """超时信号处理器: 只设置标志，由各测试任务自行停止并保存已有结果"""
     global timeout_occurred
-    timeout_occurred = True
-    print("\n⚠️  运行时间超过5小时，强制退出程序")
-    sys.exit(0)
+    if not timeout_occurred:
+        timeout_occurred = True
+        print(f"\n⚠️  运行时间超过{time_limit / 3600:g}小时，停止测试并保存已有结果")
 
 
-def check_timeout() -> bool:
-    """检查是否超时"""
+def check_timeout(deadline: Union[float, 'ShardDeadline'] = None) -> bool:
+    """
+    检查是否超时: 全局运行时间上限，或传入的截止时间(时间戳或 ShardDeadline)
+    """
     global timeout_occurred, start_time
     if timeout_occurred:
         return True
-    
+
+    if isinstance(deadline, ShardDeadline):
+        if deadline.expired():
+            return True
+    elif deadline is not None and time.time() >= deadline:
+        return True
+
     if start_time is None:
         return False
-    
-    # 检查是否超过5小时 (5 * 3600 秒)
+
     elapsed = time.time() - start_time
-    if elapsed >= 5 * 3600:  # 5小时
-        print(f"\n⚠️  运行时间超过5小时 (已运行 {elapsed/3600:.2f} 小时)，强制退出程序")
-        sys.exit(0)
-    
+    if elapsed >= time_limit:
+        timeout_occurred = True
+        print(f"\n⚠️  运行时间超过{time_limit / 3600:g}小时 (已运行 {elapsed/3600:.2f} 小时)，停止测试并保存已有结果")
+        return True
+
     return False
 
 
+def remaining_time() -> float:
+    """距全局运行时间上限的剩余秒数，未设置开始时间时返回None"""
+    if start_time is None:
+        return None
+    return max(0.0, start_time + time_limit - time.time())
+
+
 def validate_proxy_config(proxy: Dict[str, Any]) -> bool:
     """
     验证单个代理配置是否有效
@@ -108,11 +205,23 @@ def validate_proxy_config(proxy: Dict[str, Any]) -> bool:
     return True
 
 
-def test_proxy_delay(proxy_name: str, api_url: str, test_url: str, timeout: int, api_secret: str = None) -> tuple[bool, int]:
+def create_api_session(concurrency: int) -> requests.Session:
+    """
+    创建连接池大小与并发数匹配的会话，复用到mihomo API的连接
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, concurrency))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def test_proxy_delay(proxy_name: str, api_url: str, test_url: str, timeout: int, api_secret: str = None,
+                     session: requests.Session = None) -> tuple[bool, int]:
     """
     测试单个代理的延迟
 
-    返回: (是否成功, 延迟毫秒)
+    返回: (是否成功, 延迟毫秒)，控制器请求失败(连接失败、超时、非预期状态码)时延迟为 CONTROLLER_ERROR
     """
     # 检查超时
     if check_timeout():
@@ -129,7 +238,7 @@ def test_proxy_delay(proxy_name: str, api_url: str, test_url: str, timeout: int,
 
     try:
         # 使用mihomo API进行延迟测试
-        response = requests.get(
+        response = (session or requests).get(
             api_endpoint,
             params={'timeout': timeout * 1000, 'url': test_url},
             headers=headers,
@@ -144,9 +253,11 @@ def test_proxy_delay(proxy_name: str, api_url: str, test_url: str, timeout: int,
                     return True, delay
             except Exception:
                 pass
+        elif response.status_code not in NODE_FAILURE_STATUS:
+            return False, CONTROLLER_ERROR
 
     except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, Exception):
-        pass
+        return False, CONTROLLER_ERROR
 
     return False, 0
 
@@ -177,10 +288,494 @@ def test_mihomo_api_connection(api_url: str, api_secret: str = None) -> bool:
         return False
 
 
+def test_proxies_delay(proxies: List[Dict[str, Any]], api_url: str, test_url: str, timeout: int,
+                       api_secret: str = None, concurrency: int = DEFAULT_CONCURRENCY,
+                       deadline: float = None, on_result: Callable[[int, tuple[bool, int]], None] = None
+                       ) -> List[tuple[bool, int]]:
+    """
+    并发测试一组代理的延迟，所有请求复用同一个连接池
+    到达deadline后未开始的测试直接记为失败；on_result在每个结果产生时以 (序号, 结果) 调用
+
+    返回: 与proxies顺序一致的 (是否成功, 延迟毫秒) 列表
+    """
+    results = [(False, 0)] * len(proxies)
+    if not proxies:
+        return results
+
+    def worker(proxy_name: str) -> tuple[bool, int]:
+        if check_timeout(deadline):
+            return False, 0
+        print(f"测试 {proxy_name}...")
+        return test_proxy_delay(proxy_name, api_url, test_url, timeout, api_secret, session)
+
+    with create_api_session(concurrency) as session:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = {
+                executor.submit(worker, proxy.get('name', 'Unknown')): i
+                for i, proxy in enumerate(proxies)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if on_result:
+                    on_result(futures[future], results[futures[future]])
+
+    return results
+
+
+def build_batch_groups(proxy_names: List[str], group_size: int) -> List[Dict[str, Any]]:
+    """
+    将节点按group_size切分为select分组，用于 /group/{name}/delay 批量测试
+    group_size <= 0 时返回空列表，表示直接使用 Proxy 分组
+    """
+    if group_size <= 0:
+        return []
+    return [
+        {
+            'name': f'{BATCH_GROUP_PREFIX}{i // group_size}',
+            'type': 'select',
+            'proxies': proxy_names[i:i + group_size]
+        }
+        for i in range(0, len(proxy_names), group_size)
+    ]
+
+
+def test_group_delay(group_name: str, api_url: str, test_url: str, timeout: int, api_secret: str = None,
+                     session: requests.Session = None) -> Dict[str, int]:
+    """
+    一次请求测试整个分组内所有节点的延迟
+
+    返回: {节点名: 延迟毫秒}, 失败的节点不会出现在结果中
+    """
+    if check_timeout():
+        return {}
+
+    encoded_name = urllib.parse.quote(group_name)
+    api_endpoint = f"{api_url}/group/{encoded_name}/delay"
+
+    headers = {}
+    if api_secret:
+        headers['Authorization'] = f'Bearer {api_secret}'
+
+    try:
+        # mihomo 会并发测试分组内所有节点，整体耗时受单个节点超时限制
+        response = (session or requests).get(
+            api_endpoint,
+            params={'timeout': timeout * 1000, 'url': test_url},
+            headers=headers,
+            timeout=timeout + 5
+        )
+        if response.status_code == 200:
+            data = response.json()
+            return {name: delay for name, delay in data.items() if isinstance(delay, int) and delay > 0}
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, Exception):
+        pass
+
+    return {}
+
+
+def test_proxies_group_delay(proxies: List[Dict[str, Any]], groups: List[Dict[str, Any]], api_url: str,
+                             test_url: str, timeout: int, api_secret: str = None,
+                             concurrency: int = DEFAULT_CONCURRENCY, deadline: float = None,
+                             on_result: Callable[[int, tuple[bool, int]], None] = None) -> List[tuple[bool, int]]:
+    """
+    按分组批量测试延迟，只有分组结果中缺失的节点才回退到逐个测试
+    deadline、on_result 含义同 test_proxies_delay
+
+    返回: 与proxies顺序一致的 (是否成功, 延迟毫秒) 列表
+    """
+    names = {proxy.get('name') for proxy in proxies}
+    groups = [group for group in groups if names.intersection(group['proxies'])]
+    delays = {}
+    if groups:
+        # 每个分组已在mihomo内部并发测试，这里按并发数折算同时测试的分组数
+        largest = max(len(group['proxies']) for group in groups)
+        workers = min(len(groups), max(1, concurrency // largest))
+        with create_api_session(workers) as session:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(test_group_delay, group['name'], api_url, test_url, timeout,
+                                    api_secret, session): group['name']
+                    for group in groups
+                    if not check_timeout(deadline)
+                }
+                for future in as_completed(futures):
+                    group_delays = future.result()
+                    print(f"分组 {futures[future]}: {len(group_delays)} 个节点有延迟结果")
+                    delays.update(group_delays)
+
+    results = [(True, delays[proxy.get('name')]) if proxy.get('name') in delays else None for proxy in proxies]
+    if on_result:
+        for i, result in enumerate(results):
+            if result is not None:
+                on_result(i, result)
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        print(f"回退逐个测试 {len(missing)} 个分组结果中缺失的节点...")
+
+        def on_retested(j: int, result: tuple[bool, int]):
+            if on_result:
+                on_result(missing[j], result)
+
+        retested = test_proxies_delay([proxies[i] for i in missing], api_url, test_url, timeout,
+                                      api_secret, concurrency, deadline, on_retested)
+        for i, result in zip(missing, retested):
+            results[i] = result
+    return results
+
+
+def latency_stats(delays: List[int], lost: int) -> Dict[str, Any]:
+    """
+    根据多次测试结果计算延迟统计: 最小值、中位数、抖动(相邻样本差的均值)和丢失率
+    """
+    taken = len(delays) + lost
+    stats = {
+        'samples': taken,
+        'min': min(delays) if delays else None,
+        'median': statistics.median(delays) if delays else None,
+        'jitter': None,
+        'loss': round(lost / taken, 3) if taken else 1.0,
+        'delays': delays,
+    }
+    if len(delays) > 1:
+        stats['jitter'] = round(sum(abs(a - b) for a, b in zip(delays, delays[1:])) / (len(delays) - 1), 1)
+    return stats
+
+
+def latency_passed(delays: List[int], lost: int, samples: int, max_delay: int, max_loss: float) -> bool:
+    """中位延迟不超过max_delay且丢失率不超过max_loss时判定通过"""
+    if not delays or lost > max_loss * samples:
+        return False
+    return statistics.median(delays) <= max_delay
+
+
+def latency_decided(delays: List[int], lost: int, samples: int, max_delay: int, max_loss: float) -> bool:
+    """
+    判断剩余的测试能否改变结果: 剩余样本全部丢失、全部极慢、全部极快三种情况结论一致时提前结束
+    """
+    remaining = samples - len(delays) - lost
+    if remaining <= 0:
+        return True
+    outcomes = {
+        latency_passed(delays, lost + remaining, samples, max_delay, max_loss),
+        latency_passed(delays + [max_delay + 1] * remaining, lost, samples, max_delay, max_loss),
+        latency_passed(delays + [1] * remaining, lost, samples, max_delay, max_loss),
+    }
+    return len(outcomes) == 1
+
+
+def measure_proxy_latency(proxy_name: str, api_url: str, test_url: str, timeout: int, api_secret: str = None,
+                          session: requests.Session = None, samples: int = 3, max_delay: int = 3000,
+                          max_loss: float = DEFAULT_MAX_LOSS, first: tuple[bool, int] = None,
+                          deadline: float = None) -> Dict[str, Any]:
+    """
+    对单个代理进行最多samples次延迟测试，结果已确定时提前结束
+    first 为已有的第一次测试结果 (如分组批量测试得到的延迟)
+
+    返回: 延迟统计字典，passed 表示是否通过，controller_errors 为其中控制器故障导致的丢失次数
+    """
+    delays = []
+    lost = 0
+    controller_errors = 0
+    results = [first] if first is not None else []
+    while True:
+        for success, delay in results:
+            if success and delay > 0:
+                delays.append(delay)
+            else:
+                lost += 1
+                controller_errors += delay == CONTROLLER_ERROR
+        if latency_decided(delays, lost, samples, max_delay, max_loss) or check_timeout(deadline):
+            break
+        results = [test_proxy_delay(proxy_name, api_url, test_url, timeout, api_secret, session)]
+    stats = latency_stats(delays, lost)
+    stats['passed'] = latency_passed(delays, lost, samples, max_delay, max_loss)
+    if controller_errors:
+        stats['controller_errors'] = controller_errors
+    return stats
+
+
+def test_proxies_latency(proxies: List[Dict[str, Any]], first_results: List[tuple[bool, int]], api_url: str,
+                         test_url: str, timeout: int, api_secret: str = None,
+                         concurrency: int = DEFAULT_CONCURRENCY, samples: int = 3, max_delay: int = 3000,
+                         max_loss: float = DEFAULT_MAX_LOSS, deadline: float = None,
+                         on_result: Callable[[int, Dict[str, Any]], None] = None) -> List[Dict[str, Any]]:
+    """
+    以第一轮结果为首个样本，并发补充测试直至每个代理的结果确定
+    deadline、on_result 含义同 test_proxies_delay
+
+    返回: 与proxies顺序一致的延迟统计列表
+    """
+    results = [None] * len(proxies)
+    if not proxies:
+        return results
+
+    with create_api_session(concurrency) as session:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = {
+                executor.submit(measure_proxy_latency, proxy.get('name', 'Unknown'), api_url, test_url,
+                                timeout, api_secret, session, samples, max_delay, max_loss, first, deadline): i
+                for i, (proxy, first) in enumerate(zip(proxies, first_results))
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if on_result:
+                    on_result(futures[future], results[futures[future]])
+
+    return results
+
+
+class FilteredOutput:
+    """
+    筛选结果输出: 通过的节点在测试过程中定期写入输出文件，
+    超时停止或进程被终止时已通过的节点也不会丢失
+    """
+
+    def __init__(self, output_file: str, flush_interval: float = FLUSH_INTERVAL):
+        self.output_file = output_file
+        self.stats_file = os.path.splitext(output_file)[0] + '.stats.json'
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.passed = {}
+        self.stats = {}
+        self.dirty = False
+        self.last_flush = time.time()
+
+    def add(self, index: int, proxy: Dict[str, Any], stats: Dict[str, Any] = None):
+        """记录通过的节点，index为其在输入中的序号，用于保持输出顺序"""
+        with self.lock:
+            self.passed[index] = proxy
+            if stats is not None:
+                self.stats[proxy['name']] = stats
+            self.dirty = True
+            if time.time() - self.last_flush >= self.flush_interval:
+                self._write()
+
+    def add_tested(self, proxy: Dict[str, Any], stats: Dict[str, Any]):
+        """记录未通过节点的统计(如可达性向量)，只写入统计文件，不进入输出"""
+        with self.lock:
+            self.stats[proxy['name']] = dict(stats, passed=False)
+            self.dirty = True
+
+    def proxies(self) -> List[Dict[str, Any]]:
+        """
+        按输入顺序返回通过的节点，有延迟统计时按综合评分(延迟、抖动、丢失率、可达性)排序，
+        评分写入统计，没有统计的节点排在最后
+        """
+        passed = [self.passed[i] for i in sorted(self.passed)]
+        stats_list = [self.stats.get(proxy['name'], {}) for proxy in passed]
+        if any(stats.get('median') is not None for stats in stats_list):
+            scores = node_score.score_nodes(node_score.latency_columns(stats_list))
+            for stats, score in zip(stats_list, scores):
+                if stats and not math.isnan(score):
+                    stats['score'] = float(score)
+            passed = [passed[i] for i in node_score.rank(scores)]
+        return passed
+
+    def flush(self):
+        with self.lock:
+            self._write()
+
+    def _write(self):
+        passed = self.proxies()
+        filtered_config = {
+            'proxies': passed,
+            'proxy-groups': [{
+                'name': 'Proxy',
+                'type': 'select',
+                'proxies': [p['name'] for p in passed]
+            }],
+            'rules': ['MATCH,Proxy']
+        }
+        # 先写临时文件再替换，保证输出文件始终完整
+        tmp_file = self.output_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(filtered_config, f, allow_unicode=True, default_flow_style=False)
+        os.replace(tmp_file, self.output_file)
+        if self.stats:
+            with open(self.stats_file, 'w', encoding='utf-8') as f:
+                json.dump(self.stats, f, ensure_ascii=False, indent=2)
+        self.dirty = False
+        self.last_flush = time.time()
+
+
+def skip_known_dead(proxies: List[Dict[str, Any]], negative_cache: NegativeCache = None) -> List[Dict[str, Any]]:
+    """跳过服务端仍处于失效退避期的节点"""
+    if negative_cache is None or not proxies:
+        return proxies
+    remaining = [proxy for proxy in proxies if not negative_cache.should_skip(proxy)]
+    if len(remaining) < len(proxies):
+        print(f"跳过已知失效节点: {len(proxies) - len(remaining)} 个")
+    return remaining
+
+
+def screen_proxies(proxies: List[Dict[str, Any]], prescreen_timeout: float,
+                   concurrency: int = DEFAULT_CONCURRENCY,
+                   negative_cache: NegativeCache = None, tls: bool = False) -> List[Dict[str, Any]]:
+    """
+    预筛: DNS解析失败或端口不可达的节点直接丢弃，不再占用mihomo测试
+    prescreen_timeout <= 0 时不预筛；预筛失败的节点记入 negative_cache (DNS超时除外)；
+    tls 为True时TLS节点做握手探测
+    """
+    if prescreen_timeout <= 0 or not proxies:
+        return proxies
+    screened = prescreen.prescreen_proxies(proxies, prescreen_timeout,
+                                           max(concurrency, prescreen.DEFAULT_PRESCREEN_CONCURRENCY), tls)
+    alive_proxies = []
+    for proxy, result in zip(proxies, screened):
+        if result['alive']:
+            alive_proxies.append(proxy)
+        else:
+            print(f"  ✗ {proxy.get('name', 'Unknown')}: 预筛失败 {result['reason']}")
+            if negative_cache is not None and result['reason'] != prescreen.DNS_TIMEOUT_REASON:
+                negative_cache.record_failure(proxy)
+    print(f"预筛存活: {len(alive_proxies)}/{len(proxies)} 个")
+    return alive_proxies
+
+
+def run_delay_tests(proxies: List[Dict[str, Any]], api_url: str, test_url: str, timeout: int, api_secret: str,
+                    max_delay: int, on_pass: Callable[[int, Dict[str, Any]], None],
+                    concurrency: int = DEFAULT_CONCURRENCY, groups: List[Dict[str, Any]] = None,
+                    samples: int = 1, max_loss: float = DEFAULT_MAX_LOSS, deadline: float = None,
+                    negative_cache: NegativeCache = None, targets: List[str] = None, min_targets: int = 0,
+                    result_store: ResultStore = None, controller_alive: Callable[[], bool] = None,
+                    on_tested: Callable[[int, Dict[str, Any]], None] = None):
+    """
+    测试一组代理的延迟，每个通过的节点产生时以 on_pass(序号, 延迟统计) 回调，单次测试时统计为None
+    groups 不为空时先按分组批量测试；samples > 1 时第一轮结果作为首个样本继续测试
+    negative_cache 不为空时记录每个节点是否有响应，result_store 不为空时记录每个节点的延迟，
+    因截止时间未测试的节点均不记录；控制器故障(请求失败，或 controller_alive 返回False即实例已退出)
+    导致的失败不能说明节点失效，同样不记录
+    targets 不为空时每个完成测试的节点(包括未通过的)再并发测试各额外目标，可达性向量记入 stats['reachability']，
+    可达目标少于 min_targets 的节点不回调 on_pass (截止时间后未测或控制器故障的目标记为None，不计为不可达)；
+    未通过主测试或 min_targets 的节点以 on_tested(序号, 统计) 回调，便于之后按其他策略筛选而无需重测
+    """
+    target_session = create_api_session(concurrency) if targets else None
+    target_executor = ThreadPoolExecutor(max_workers=max(1, concurrency)) if targets else None
+
+    def probe_target(name: str, url: str):
+        if check_timeout(deadline):
+            return None
+        success, delay = test_proxy_delay(name, api_url, url, timeout, api_secret, target_session)
+        if delay == CONTROLLER_ERROR:
+            return None
+        return delay if success and delay > 0 else 0
+
+    def check_targets(i: int, stats: Dict[str, Any], retained: bool):
+        """各目标作为独立任务提交，全部完成后汇总可达性向量"""
+        name = proxies[i].get('name', 'Unknown')
+        futures = [target_executor.submit(probe_target, name, url) for url in targets]
+        pending = [len(futures)]
+        pending_lock = threading.Lock()
+
+        def on_done(_):
+            with pending_lock:
+                pending[0] -= 1
+                if pending[0]:
+                    return
+            reachability = {url: future.result() for url, future in zip(targets, futures)}
+            summarize_targets(i, stats, retained, reachability)
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    def summarize_targets(i: int, stats: Dict[str, Any], retained: bool, reachability: Dict[str, int]):
+        reached = len([d for d in reachability.values() if d])
+        unknown = len([d for d in reachability.values() if d is None])
+        stats = dict(stats or {})
+        stats['reachability'] = reachability
+        if retained and reached + unknown >= min_targets:
+            on_pass(i, stats)
+            return
+        if retained:
+            print(f"  ✗ {proxies[i].get('name', 'Unknown')}: 可达目标 {reached}/{len(targets)}")
+        if on_tested is not None:
+            on_tested(i, stats)
+
+    def passed(i: int, stats: Dict[str, Any]):
+        if target_executor is None:
+            on_pass(i, stats)
+        else:
+            check_targets(i, stats, True)
+
+    def failed(i: int, stats: Dict[str, Any]):
+        if target_executor is not None:
+            check_targets(i, stats, False)
+
+    def record(i: int, reachable: bool, passed: bool, controller_error: bool = False, **metrics) -> bool:
+        """记录一次测试结果，未实际完成测试(截止时间、控制器故障)时不记录并返回False"""
+        if not reachable and (controller_error or check_timeout(deadline)
+                              or (controller_alive is not None and not controller_alive())):
+            return False
+        if negative_cache is not None:
+            if reachable:
+                negative_cache.record_success(proxies[i])
+            else:
+                negative_cache.record_failure(proxies[i])
+        if result_store is not None:
+            result_store.record(proxies[i], 'mihomo', passed, **metrics)
+        return True
+
+    def on_delay(i: int, result: tuple[bool, int]):
+        success, delay = result
+        tested = record(i, success and delay > 0, success and 0 < delay <= max_delay, delay == CONTROLLER_ERROR,
+                        delay_ms=delay if success and delay > 0 else None)
+        if success and 0 < delay <= max_delay:
+            print(f"  ✓ {proxies[i].get('name', 'Unknown')}: {delay}ms")
+            passed(i, None)
+        elif tested:
+            failed(i, None)
+
+    def on_stats(i: int, stats: Dict[str, Any]):
+        # 所有丢失都由控制器故障导致时无法判断节点是否失效
+        tested = record(i, bool(stats['delays']), stats['passed'],
+                        stats['samples'] - len(stats['delays']) <= stats.get('controller_errors', 0),
+                        delay_ms=stats['median'], loss=stats['loss'])
+        if stats['passed']:
+            print(f"  ✓ {proxies[i].get('name', 'Unknown')}: {stats['median']}ms "
+                  f"(min {stats['min']}ms, jitter {stats['jitter']}ms, loss {stats['loss']:.0%})")
+            passed(i, stats)
+        elif tested:
+            failed(i, stats)
+
+    try:
+        # 多次采样时第一轮结果作为首个样本，不直接判定
+        first_callback = on_delay if samples <= 1 else None
+        if groups:
+            results = test_proxies_group_delay(proxies, groups, api_url, test_url, timeout,
+                                               api_secret, concurrency, deadline, first_callback)
+        else:
+            results = test_proxies_delay(proxies, api_url, test_url, timeout, api_secret, concurrency,
+                                         deadline, first_callback)
+        if samples > 1:
+            # 多次采样: 结果不确定的节点继续测试，输出按综合评分排序
+            test_proxies_latency(proxies, results, api_url, test_url, timeout, api_secret,
+                                 concurrency, samples, max_delay, max_loss, deadline, on_stats)
+    finally:
+        # 等待已通过节点的额外目标测试完成
+        if target_executor is not None:
+            target_executor.shutdown(wait=True)
+            target_session.close()
+
+
 def filter_proxies(input_file: str, output_file: str, max_delay: int,
-                  api_url: str, timeout: int, test_url: str, api_secret: str = None) -> tuple[int, int]:
+                  api_url: str, timeout: int, test_url: str, api_secret: str = None,
+                  concurrency: int = DEFAULT_CONCURRENCY, group_test: bool = False,
+                  group_size: int = 0, prescreen_timeout: float = 0, prescreen_tls: bool = False,
+                  samples: int = 1,
+                  max_loss: float = DEFAULT_MAX_LOSS, deadline: float = None,
+                  negative_cache: NegativeCache = None, carry_forward: CarryForward = None,
+                  targets: List[str] = None, min_targets: int = 0,
+                  result_store: ResultStore = None, controller_alive: Callable[[], bool] = None,
+                  load_groups: Callable[[List[Dict[str, Any]]], bool] = None) -> tuple[int, int]:
     """
     筛选代理节点
+    通过的节点在测试过程中增量写入output_file，到达deadline或全局时间上限时停止测试并保留已有结果
+    negative_cache 不为空时跳过已知失效的服务端，并将本次测试结果写回缓存
+    result_store 不为空时把每个节点的延迟测量追加到历史记录
+    carry_forward 不为空时近期验证过的节点直接通过或只复测一次，其余节点完整测试
+    targets、min_targets、controller_alive 见 run_delay_tests
+    group_test 时 load_groups 不为空则用预筛通过的节点切分分组，经 load_groups 加载到mihomo后测试；
+    为空(外部运行的mihomo)时使用配置文件中已有的分组，没有可用分组时逐个测试
 
     返回: (通过的节点数, 总节点数)
     """
@@ -209,14 +804,8 @@ def filter_proxies(input_file: str, output_file: str, max_delay: int,
 
         # 验证并筛选代理
         valid_proxies = []
-        passed_proxies = []
 
         for proxy in proxies:
-            # 检查超时
-            if check_timeout():
-                print("\n⚠️  运行时间超过5小时，强制退出程序")
-                sys.exit(0)
-            
             if not validate_proxy_config(proxy):
                 print(f"  ✗ {proxy.get('name', 'Unknown')}: 配置无效")
                 continue
@@ -225,37 +814,74 @@ def filter_proxies(input_file: str, output_file: str, max_delay: int,
 
         print(f"有效代理: {len(valid_proxies)} 个")
 
-        # 测试每个代理的延迟
-        for proxy in valid_proxies:
-            # 检查超时
-            if check_timeout():
-                print("\n⚠️  运行时间超过5小时，强制退出程序")
-                sys.exit(0)
-                
-            proxy_name = proxy.get('name', 'Unknown')
-            print(f"测试 {proxy_name}...")
-
-            success, delay = test_proxy_delay(proxy_name, api_url, test_url, timeout, api_secret)
-
-            if success and delay > 0:
-                if delay <= max_delay:
-                    passed_proxies.append(proxy)
-                    print(f"  ✓ {proxy_name}: {delay}ms")
-
-        # 保存筛选后的配置
-        filtered_config = {
-            'proxies': passed_proxies,
-            'proxy-groups': [{
-                'name': 'Proxy',
-                'type': 'select',
-                'proxies': [p['name'] for p in passed_proxies]
-            }],
-            'rules': ['MATCH,Proxy']
-        }
-
-        with open(output_file, 'w', encoding='utf-8') as f:
-            yaml.safe_dump(filtered_config, f, allow_unicode=True, default_flow_style=False)
+        output = FilteredOutput(output_file)
+        order = {id(proxy): i for i, proxy in enumerate(valid_proxies)}
+        fresh_proxies, recheck_proxies = valid_proxies, []
+        if carry_forward is not None:
+            trusted, recheck, fresh = carry_forward.partition(valid_proxies)
+            for i in trusted:
+                output.add(i, valid_proxies[i])
+                carry_forward.mark_trusted(valid_proxies[i])
+            recheck_proxies = [valid_proxies[i] for i in recheck]
+            fresh_proxies = [valid_proxies[i] for i in fresh]
+            print(f"沿用已验证节点: {len(trusted)} 个, 复测: {len(recheck)} 个, 完整测试: {len(fresh)} 个")
+
+        alive_proxies = screen_proxies(skip_known_dead(fresh_proxies, negative_cache), prescreen_timeout,
+                                       concurrency, negative_cache, prescreen_tls)
+
+        groups = None
+        if group_test and alive_proxies:
+            if load_groups is not None:
+                # 分组只包含预筛通过的节点，group_size为0时全部放入一个分组
+                names = [p.get('name') for p in alive_proxies]
+                groups = build_batch_groups(names, group_size or len(names))
+                if not load_groups(groups):
+                    print("警告: 加载测试分组失败，改为逐个测试")
+                    groups = None
+            else:
+                # 分组需与mihomo加载的配置一致，只能使用配置文件中已有的 Proxy 或批量测试分组
+                groups = [group for group in config.get('proxy-groups') or []
+                          if group.get('name') == PROXY_GROUP_NAME
+                          or (group_size > 0 and str(group.get('name')).startswith(BATCH_GROUP_PREFIX))] or None
+                if groups is None:
+                    print(f"警告: {input_file} 中没有 {PROXY_GROUP_NAME} 分组，改为逐个测试")
+
+        def on_pass(tested: List[Dict[str, Any]]) -> Callable[[int, Dict[str, Any]], None]:
+            def callback(i: int, stats: Dict[str, Any]):
+                output.add(order[id(tested[i])], tested[i], stats)
+                if carry_forward is not None:
+                    carry_forward.mark_verified(tested[i])
+            return callback
+
+        def on_tested(tested: List[Dict[str, Any]]) -> Callable[[int, Dict[str, Any]], None]:
+            return lambda i, stats: output.add_tested(tested[i], stats)
 
+        try:
+            if recheck_proxies:
+                # 复测只做一次单独的延迟测试
+                run_delay_tests(recheck_proxies, api_url, test_url, timeout, api_secret, max_delay,
+                                on_pass(recheck_proxies), concurrency, deadline=deadline,
+                                negative_cache=negative_cache, targets=targets, min_targets=min_targets,
+                                result_store=result_store, controller_alive=controller_alive,
+                                on_tested=on_tested(recheck_proxies))
+            run_delay_tests(alive_proxies, api_url, test_url, timeout, api_secret, max_delay,
+                            on_pass(alive_proxies), concurrency, groups, samples, max_loss, deadline,
+                            negative_cache, targets, min_targets, result_store, controller_alive,
+                            on_tested(alive_proxies))
+        finally:
+            # 保存筛选后的配置，测试中途异常或超时时同样保留已通过的节点
+            output.flush()
+            if negative_cache is not None:
+                negative_cache.commit()
+            if result_store is not None:
+                result_store.commit()
+
+        if check_timeout(deadline):
+            print(f"\n⚠️  {input_file} 已到达截止时间，未完成的节点不再测试")
+        if output.stats:
+            print(f"延迟统计已保存到: {output.stats_file}")
+
+        passed_proxies = output.proxies()
         print(f"\n筛选完成: {len(passed_proxies)}/{len(valid_proxies)} 个代理通过测试")
         print(f"结果已保存到: {output_file}")
 
@@ -274,93 +900,257 @@ def filter_proxies(input_file: str, output_file: str, max_delay: int,
         sys.exit(1)
 
 
-def process_file(file_path: str, port: int) -> bool:
+def build_mihomo_config(file_path: str, port: int, groups: List[Dict[str, Any]] = None) -> str:
     """
-    处理单个YAML文件，使用指定端口运行mihomo实例
+    读取节点配置并添加API配置，groups 不为空时追加批量测试分组
     """
-    # 检查超时
-    if check_timeout():
-        return False
-        
-    filename = os.path.basename(file_path)
-    print(f'Processing {filename} on port {port}...')
+    with open(file_path, 'r', encoding='utf-8') as src:
+        config_content = src.read()
 
-    # 创建临时目录用于mihomo配置
-    temp_dir = f'/tmp/mihomo_{port}'
-    os.makedirs(temp_dir, exist_ok=True)
-    config_file = os.path.join(temp_dir, 'config.yaml')
+    if groups:
+        config = yaml.safe_load(config_content) or {}
+        config['proxy-groups'] = (config.get('proxy-groups') or []) + groups
+        config_content = yaml.safe_dump(config, allow_unicode=True, default_flow_style=False)
 
-    # 复制原配置文件并添加API配置
-    try:
-        with open(file_path, 'r', encoding='utf-8') as src:
-            config_content = src.read()
-    except Exception as e:
-        print(f'Error reading {file_path}: {e}')
-        return False
+    return config_content + mihomo_api_config(port)
 
-    try:
-        with open(config_file, 'w', encoding='utf-8') as dst:
-            dst.write(config_content)
-            dst.write(f'\n# API配置\nexternal-controller: 127.0.0.1:{port}\nexternal-ui: ui\nsecret: test123\n')
-    except Exception as e:
-        print(f'Error writing config file: {e}')
-        return False
 
-    # 启动mihomo
-    mihomo_log = os.path.join(temp_dir, 'mihomo.log')
-    mihomo_process = None
-    try:
-        with open(mihomo_log, 'w') as log_file:
-            mihomo_process = subprocess.Popen(
-                ['mihomo', '-f', config_file],
-                stdout=log_file,
-                stderr=log_file
-            )
-    except Exception as e:
-        print(f'Error starting mihomo: {e}')
-        return False
+def mihomo_api_config(port: int, secret: str = 'test123') -> str:
+    """追加到配置末尾的API配置"""
+    return f'\n# API配置\nexternal-controller: 127.0.0.1:{port}\nexternal-ui: ui\nsecret: {secret}\n'
 
-    # 等待mihomo启动
-    api_ready = False
-    for i in range(15):
-        # 检查超时
-        if check_timeout():
-            if mihomo_process:
-                mihomo_process.terminate()
-                try:
-                    mihomo_process.wait(timeout=5)
-                except:
-                    mihomo_process.kill()
-            try:
-                os.system(f'rm -rf {temp_dir}')
-            except:
-                pass
+
+class MihomoInstance:
+    """
+    在指定端口运行的mihomo实例，可通过 PUT /configs 热加载新的节点配置
+    """
+
+    def __init__(self, port: int, secret: str = 'test123'):
+        self.port = port
+        self.secret = secret
+        self.api_url = f'http://127.0.0.1:{port}'
+        self.temp_dir = f'/tmp/mihomo_{port}'
+        self.config_file = os.path.join(self.temp_dir, 'config.yaml')
+        self.process = None
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, config_content: str) -> bool:
+        """写入配置并启动mihomo，等待API可用"""
+        os.makedirs(self.temp_dir, exist_ok=True)
+        try:
+            with open(self.config_file, 'w', encoding='utf-8') as dst:
+                dst.write(config_content)
+        except Exception as e:
+            print(f'Error writing config file: {e}')
             return False
-            
+
+        # 启动mihomo
+        mihomo_log = os.path.join(self.temp_dir, 'mihomo.log')
         try:
-            result = subprocess.run([
-                'curl', '-s', '-H', 'Authorization: Bearer test123',
-                f'http://127.0.0.1:{port}/version'
-            ], capture_output=True, timeout=2)
-            if result.returncode == 0:
-                api_ready = True
-                break
-        except:
+            with open(mihomo_log, 'w') as log_file:
+                self.process = subprocess.Popen(
+                    mihomo_command + ['-f', self.config_file],
+                    stdout=log_file,
+                    stderr=log_file
+                )
+        except Exception as e:
+            print(f'Error starting mihomo: {e}')
+            return False
+
+        if not self.wait_ready():
+            print(f'::error::mihomo API not available on port {self.port}')
+            self.stop()
+            return False
+        return True
+
+    def crashed(self) -> bool:
+        """进程已启动但意外退出"""
+        return self.process is not None and self.process.poll() is not None
+
+    def ping(self) -> float:
+        """请求 /version，返回响应耗时(秒)，不可用时返回None"""
+        try:
+            start = time.perf_counter()
+            response = requests.get(f'{self.api_url}/version',
+                                    headers={'Authorization': f'Bearer {self.secret}'}, timeout=2)
+            if response.status_code == 200:
+                return time.perf_counter() - start
+        except Exception:
             pass
-        time.sleep(2)
+        return None
+
+    def wait_ready(self, max_wait: float = 30) -> bool:
+        """在进程内轮询mihomo API，从毫秒级间隔开始指数退避"""
+        deadline = time.time() + max_wait
+        interval = 0.01
+        while time.time() < deadline:
+            # 检查超时
+            if check_timeout():
+                return False
+            # 进程已退出(如端口被占用)时无需继续等待
+            if self.crashed():
+                return False
+            if self.ping() is not None:
+                return True
+            time.sleep(interval)
+            interval = min(interval * 2, 0.5)
+        return False
+
+    def reload(self, config_content: str) -> bool:
+        """
+        通过 PUT /configs 热加载配置，无需重启进程
+        配置以payload形式传递，其中需保留相同的 external-controller 和 secret
+        """
+        try:
+            with open(self.config_file, 'w', encoding='utf-8') as dst:
+                dst.write(config_content)
+            response = requests.put(
+                f'{self.api_url}/configs',
+                params={'force': 'true'},
+                json={'payload': config_content},
+                headers={'Authorization': f'Bearer {self.secret}'},
+                timeout=60
+            )
+            if response.status_code in [200, 204]:
+                return True
+            print(f'mihomo config reload failed on port {self.port}: {response.status_code} {response.text[:200]}')
+        except Exception as e:
+            print(f'mihomo config reload failed on port {self.port}: {e}')
+        return False
 
-    if not api_ready:
-        print(f'::error::mihomo API not available on port {port} after 30 seconds')
-        if mihomo_process:
-            mihomo_process.terminate()
+    def load(self, config_content: str) -> bool:
+        """运行中则热加载配置，否则启动新进程；热加载失败时重启"""
+        if self.is_running():
+            if self.reload(config_content):
+                return True
+            self.stop()
+        return self.start(config_content)
+
+    def stop(self):
+        """停止mihomo并清理临时目录"""
+        if self.process:
+            self.process.terminate()
             try:
-                mihomo_process.wait(timeout=5)
+                self.process.wait(timeout=5)
             except:
-                mihomo_process.kill()
+                self.process.kill()
+            self.process = None
+
+        # 清理临时目录
         try:
-            os.system(f'rm -rf {temp_dir}')
+            os.system(f'rm -rf {self.temp_dir}')
         except:
             pass
+
+
+def find_free_port() -> int:
+    """由操作系统分配一个空闲的本地端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def available_memory_mb() -> int:
+    """读取 /proc/meminfo 中的可用内存(MB)，无法读取时返回None"""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class MihomoPool:
+    """
+    mihomo实例池: 端口由操作系统分配，崩溃的实例会被替换，
+    池大小由可用内存决定，控制器响应持续变慢时逐步缩减
+    """
+
+    def __init__(self, jobs: int, reuse: bool = True, size: int = 0,
+                 instance_memory: int = DEFAULT_INSTANCE_MEMORY_MB, max_latency: float = DEFAULT_MAX_API_LATENCY):
+        self.reuse = reuse
+        self.max_latency = max_latency
+        self.size = size if size > 0 else self.auto_size(jobs, instance_memory)
+        self.size = max(1, min(self.size, jobs))
+        self.active = self.size
+        self.slow_pings = 0
+        self.lock = threading.Lock()
+        self.instances = queue.Queue()
+        for _ in range(self.size):
+            self.instances.put(MihomoInstance(find_free_port()))
+
+    @staticmethod
+    def auto_size(jobs: int, instance_memory: int) -> int:
+        """测速是I/O密集型任务，按可用内存而非CPU核数确定实例数"""
+        memory = available_memory_mb()
+        if memory is None:
+            return min(jobs, MAX_POOL_SIZE)
+        return max(1, min(jobs, MAX_POOL_SIZE, memory // max(1, instance_memory)))
+
+    def acquire(self) -> MihomoInstance:
+        instance = self.instances.get()
+        if instance.crashed():
+            # 上一次使用后进程已退出，换用新端口重新启动
+            print(f'mihomo on port {instance.port} exited unexpectedly, restarting')
+            instance.stop()
+            instance = MihomoInstance(find_free_port())
+        return instance
+
+    def release(self, instance: MihomoInstance):
+        latency = instance.ping() if instance.is_running() else None
+        with self.lock:
+            # 各实例的控制器连续多次响应过慢说明实例过多，在保留至少一个实例的前提下缩减池
+            if latency is not None:
+                self.slow_pings = self.slow_pings + 1 if latency > self.max_latency else 0
+            if self.slow_pings >= API_SLOW_PINGS and self.active > 1:
+                self.active -= 1
+                self.slow_pings = 0
+                print(f'mihomo on port {instance.port} responded in {latency * 1000:.0f}ms, '
+                      f'{API_SLOW_PINGS} slow responses in a row, shrinking pool to {self.active}')
+                instance.stop()
+                return
+        if not self.reuse:
+            instance.stop()
+        self.instances.put(instance)
+
+    def replace(self, instance: MihomoInstance) -> MihomoInstance:
+        """停止崩溃的实例并换用新端口的实例"""
+        instance.stop()
+        return MihomoInstance(find_free_port())
+
+    def close(self):
+        while not self.instances.empty():
+            self.instances.get().stop()
+
+
+def process_file(file_path: str, port: int, instance: MihomoInstance = None, **filter_options) -> bool:
+    """
+    处理单个YAML文件，使用指定端口运行mihomo实例
+    传入instance时复用该长期运行的实例，通过热加载切换到本文件的节点
+    filter_options 原样传给 filter_proxies (concurrency, group_test, samples, deadline 等)
+    """
+    # 检查超时
+    if check_timeout():
+        return False
+
+    filename = os.path.basename(file_path)
+    reuse = instance is not None
+    if not reuse:
+        instance = MihomoInstance(port)
+    print(f'Processing {filename} on port {instance.port}...')
+
+    # 复制原配置文件并添加API配置
+    try:
+        config_content = build_mihomo_config(file_path, instance.port)
+    except Exception as e:
+        print(f'Error reading {file_path}: {e}')
+        return False
+
+    if not instance.load(config_content):
         return False
 
     # 创建筛选后的配置文件
@@ -370,30 +1160,30 @@ def process_file(file_path: str, port: int) -> bool:
     try:
         passed, total = filter_proxies(
             file_path, output_file,
-            max_delay=1000,
-            api_url=f'http://127.0.0.1:{port}',
-            timeout=15,
-            test_url='https://www.gstatic.com/generate_204',
-            api_secret='test123'
+            max_delay=PARALLEL_MAX_DELAY,
+            api_url=instance.api_url,
+            timeout=PARALLEL_TIMEOUT,
+            test_url=DEFAULT_TEST_URL,
+            api_secret=instance.secret,
+            controller_alive=instance.is_running,
+            load_groups=lambda groups: instance.load(build_mihomo_config(file_path, instance.port, groups)),
+            **filter_options
         )
         success = passed > 0
     except Exception as e:
         print(f'Error filtering proxies: {e}')
         success = False
 
-    # 停止mihomo
-    if mihomo_process:
-        mihomo_process.terminate()
-        try:
-            mihomo_process.wait(timeout=5)
-        except:
-            mihomo_process.kill()
+    # 测试期间mihomo崩溃时保留原文件，由调用方重启实例后重试
+    if instance.crashed():
+        print(f'::warning::mihomo on port {instance.port} crashed while processing {filename}')
+        if not reuse:
+            instance.stop()
+        return False
 
-    # 清理临时目录
-    try:
-        os.system(f'rm -rf {temp_dir}')
-    except:
-        pass
+    # 停止mihomo，复用模式下由调用方负责
+    if not reuse:
+        instance.stop()
 
     # 删除原文件
     try:
@@ -406,9 +1196,249 @@ def process_file(file_path: str, port: int) -> bool:
     return success
 
 
-def parallel_filter_proxies(directory: str) -> int:
+class ShardScheduler:
+    """
+    按剩余运行时间为每个文件分配截止时间: 剩余时间平均分给每个实例还需处理的轮数，
+    提前完成的文件节省的时间自动留给后续文件
+    """
+
+    def __init__(self, shards: int, workers: int):
+        self.pending = shards
+        self.workers = max(1, workers)
+        self.lock = threading.Lock()
+
+    def next_deadline(self) -> 'ShardDeadline':
+        """开始处理下一个文件时调用，返回其截止时间，未设置运行时间上限时返回None"""
+        with self.lock:
+            remaining = remaining_time()
+            rounds = max(1, math.ceil(self.pending / self.workers))
+            self.pending = max(0, self.pending - 1)
+        if remaining is None:
+            return None
+        return ShardDeadline(self, time.time() + remaining / rounds)
+
+    def waiting(self) -> bool:
+        """是否还有文件未开始处理"""
+        with self.lock:
+            return self.pending > 0
+
+
+class ShardDeadline:
+    """
+    单个文件的截止时间: 到点后只有还有文件在等待实例时才停止，把时间让给它们；
+    没有文件等待时继续测试，只受全局运行时间上限约束
+    """
+
+    def __init__(self, scheduler: ShardScheduler, at: float):
+        self.scheduler = scheduler
+        self.at = at
+
+    def expired(self) -> bool:
+        return time.time() >= self.at and self.scheduler.waiting()
+
+
+def build_batch_config(batch: List[tuple[str, int, Dict[str, Any]]], port: int, secret: str,
+                       group_size: int = 0, listener_ports: List[int] = None) -> tuple[List[Dict[str, Any]], str]:
+    """
+    为一批来自不同文件的节点生成mihomo配置，跨文件重名的节点在副本中加后缀区分
+    listener_ports 不为空时为每个节点开设一个本地mixed端口，经该端口的流量固定走对应节点
+
+    返回: (加载到mihomo的节点副本列表, 配置内容)
+    """
+    proxies = []
+    names = set()
+    for _, _, proxy in batch:
+        proxy = dict(proxy)
+        name = proxy['name']
+        suffix = 1
+        while proxy['name'] in names:
+            proxy['name'] = f'{name} #{suffix}'
+            suffix += 1
+        names.add(proxy['name'])
+        proxies.append(proxy)
+
+    proxy_names = [p['name'] for p in proxies]
+    config = {
+        'proxies': proxies,
+        'proxy-groups': [{
+            'name': PROXY_GROUP_NAME,
+            'type': 'select',
+            'proxies': proxy_names
+        }] + build_batch_groups(proxy_names, group_size),
+        'rules': [f'MATCH,{PROXY_GROUP_NAME}']
+    }
+    if listener_ports:
+        config['listeners'] = [{
+            'name': f'listener-{listener_port}',
+            'type': 'mixed',
+            'listen': '127.0.0.1',
+            'port': listener_port,
+            'proxy': name
+        } for name, listener_port in zip(proxy_names, listener_ports)]
+    config_content = yaml.safe_dump(config, allow_unicode=True, default_flow_style=False)
+    return proxies, config_content + mihomo_api_config(port, secret)
+
+
+def queue_filter_proxies(directory: str, yaml_files: List[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                         pool_size: int = 0, instance_memory: int = DEFAULT_INSTANCE_MEMORY_MB,
+                         concurrency: int = DEFAULT_CONCURRENCY,
+                         group_test: bool = False, group_size: int = 0, prescreen_timeout: float = 0,
+                         prescreen_tls: bool = False, samples: int = 1, max_loss: float = DEFAULT_MAX_LOSS,
+                         negative_cache: NegativeCache = None, carry_forward: CarryForward = None,
+                         targets: List[str] = None, min_targets: int = 0,
+                         result_store: ResultStore = None) -> int:
+    """
+    节点级任务队列: 所有文件的有效节点放入同一队列，每个mihomo实例按批取出节点热加载并测试，
+    结果按来源文件汇总写入各自的 _filtered.yaml，避免单个大文件拖住一个实例
+    carry_forward 不为空时近期验证过的节点直接通过，需复测的节点单独成批只测一次
+    实例失败的批次拆小后重试，最终仍未测试的节点会列出，其文件不计入成功且保留原文件
+    返回有节点通过的文件数
+    """
+    outputs = {}
+    totals = {}
+    items = []
+    for filename in yaml_files:
+        file_path = os.path.join(directory, filename)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                proxies = (yaml.safe_load(f) or {}).get('proxies', []) or []
+        except Exception as e:
+            print(f'Error reading {file_path}: {e}')
+            continue
+        valid_proxies = [proxy for proxy in proxies if validate_proxy_config(proxy)]
+        print(f'{filename}: 有效代理 {len(valid_proxies)}/{len(proxies)} 个')
+        outputs[filename] = FilteredOutput(os.path.join(directory, f'{filename[:-5]}_filtered.yaml'))
+        totals[filename] = len(valid_proxies)
+        items.extend((filename, index, proxy) for index, proxy in enumerate(valid_proxies))
+
+    recheck_items = []
+    if carry_forward is not None:
+        trusted, recheck, fresh = carry_forward.partition([item[2] for item in items])
+        for i in trusted:
+            filename, index, proxy = items[i]
+            outputs[filename].add(index, proxy)
+            carry_forward.mark_trusted(proxy)
+        print(f'沿用已验证节点: {len(trusted)} 个, 复测: {len(recheck)} 个, 完整测试: {len(fresh)} 个')
+        recheck_items = [items[i] for i in recheck]
+        items = [items[i] for i in fresh]
+
+    # 所有文件的节点一起预筛，再按批放入队列
+    alive = screen_proxies(skip_known_dead([item[2] for item in items], negative_cache), prescreen_timeout,
+                           concurrency, negative_cache, prescreen_tls)
+    alive_ids = {id(proxy) for proxy in alive}
+    items = [item for item in items if id(item[2]) in alive_ids]
+    work = queue.Queue()
+    # 队列元素: (节点批次, 已重试次数, 是否只复测一次)
+    for i in range(0, len(recheck_items), batch_size):
+        work.put((recheck_items[i:i + batch_size], 0, True))
+    for i in range(0, len(items), batch_size):
+        work.put((items[i:i + batch_size], 0, False))
+    batches = work.qsize()
+    # 节点级任务总是复用实例
+    pool = MihomoPool(max(1, batches), True, pool_size, instance_memory)
+    print(f'共 {len(items) + len(recheck_items)} 个节点，分为 {batches} 批，由 {pool.size} 个mihomo实例并行测试')
+
+    progress = {'done': 0, 'total': batches}
+    dropped = {}
+    lock = threading.Lock()
+
+    def on_pass(item: tuple[str, int, Dict[str, Any]], stats: Dict[str, Any]):
+        filename, index, proxy = item
+        outputs[filename].add(index, proxy, stats)
+        if carry_forward is not None:
+            carry_forward.mark_verified(proxy)
+
+    def on_tested(item: tuple[str, int, Dict[str, Any]], stats: Dict[str, Any]):
+        filename, _, proxy = item
+        outputs[filename].add_tested(proxy, stats)
+
+    def worker():
+        instance = pool.acquire()
+        try:
+            while not check_timeout():
+                try:
+                    batch, attempts, recheck = work.get_nowait()
+                except queue.Empty:
+                    break
+                proxies, config_content = build_batch_config(batch, instance.port, instance.secret,
+                                                             group_size if group_test else 0)
+                if instance.load(config_content):
+                    groups = None
+                    if group_test and not recheck:
+                        names = [p['name'] for p in proxies]
+                        groups = build_batch_groups(names, group_size) or [{'name': PROXY_GROUP_NAME,
+                                                                            'proxies': names}]
+                    run_delay_tests(proxies, instance.api_url, DEFAULT_TEST_URL, PARALLEL_TIMEOUT, instance.secret,
+                                    PARALLEL_MAX_DELAY, lambda i, stats: on_pass(batch[i], stats),
+                                    concurrency, groups, 1 if recheck else samples, max_loss,
+                                    negative_cache=negative_cache, targets=targets, min_targets=min_targets,
+                                    result_store=result_store, controller_alive=instance.is_running,
+                                    on_tested=lambda i, stats: on_tested(batch[i], stats))
+                if not instance.is_running():
+                    # 实例启动失败或测试中崩溃: 换新实例，该批拆成两半重新入队，隔离导致崩溃的节点
+                    print(f'::warning::mihomo on port {instance.port} failed on a batch of {len(batch)} nodes')
+                    instance = pool.replace(instance)
+                    if attempts < BATCH_RETRIES:
+                        half = (len(batch) + 1) // 2
+                        parts = [part for part in (batch[:half], batch[half:]) if part]
+                        for part in parts:
+                            work.put((part, attempts + 1, recheck))
+                        with lock:
+                            progress['total'] += len(parts) - 1
+                        continue
+                    with lock:
+                        for filename, _, proxy in batch:
+                            dropped.setdefault(filename, []).append(proxy.get('name'))
+                with lock:
+                    progress['done'] += 1
+                    print(f'Progress: {progress["done"]}/{progress["total"]}')
+        finally:
+            pool.release(instance)
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            futures = [executor.submit(worker) for _ in range(pool.size)]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f'Worker failed: {e}')
+    finally:
+        pool.close()
+        for output in outputs.values():
+            output.flush()
+        if negative_cache is not None:
+            negative_cache.commit()
+        if result_store is not None:
+            result_store.commit()
+
+    success_count = 0
+    for filename, output in outputs.items():
+        passed = len(output.passed)
+        print(f'{filename}: {passed}/{totals[filename]} 个代理通过测试')
+        if filename in dropped:
+            # 有节点多次重试仍未测试: 不计入成功，保留原文件以便重新测试
+            names = dropped[filename]
+            print(f'::warning::{filename}: {len(names)} nodes not tested after {BATCH_RETRIES} retries: '
+                  f'{", ".join(names)}')
+            continue
+        if passed > 0:
+            success_count += 1
+        # 删除原文件
+        try:
+            os.remove(os.path.join(directory, filename))
+        except OSError:
+            pass
+    return success_count
+
+
+def parallel_filter_proxies(directory: str, reuse: bool = False, pool_size: int = 0,
+                            instance_memory: int = DEFAULT_INSTANCE_MEMORY_MB, node_queue: bool = False,
+                            batch_size: int = DEFAULT_BATCH_SIZE, **filter_options) -> int:
     """
     并行处理目录中的所有YAML文件
+    reuse为True时每个工作线程使用一个长期运行的mihomo实例，依次热加载各文件
+    node_queue为True时按节点而非文件分配任务，见 queue_filter_proxies
     返回处理的成功文件数
     """
     # 获取所有yaml文件
@@ -417,40 +1447,66 @@ def parallel_filter_proxies(directory: str) -> int:
         print('No YAML files found')
         return 0
 
-    cpu_count = multiprocessing.cpu_count()
-    max_processes = min(cpu_count, len(yaml_files))
+    if node_queue:
+        success_count = queue_filter_proxies(directory, yaml_files, batch_size, pool_size, instance_memory,
+                                             **filter_options)
+        print('All processing completed')
+        return success_count
+
+    pool = MihomoPool(len(yaml_files), reuse, pool_size, instance_memory)
+    max_processes = pool.size
 
     print(f'Starting {max_processes} parallel mihomo processes for {len(yaml_files)} files...')
 
-    # 分配端口 (9090 起始，避免与其他服务冲突)
-    base_port = 9090
     futures = []
     success_count = 0
+    scheduler = ShardScheduler(len(yaml_files), max_processes)
+    skipped = []
 
-    with ThreadPoolExecutor(max_workers=max_processes) as executor:
-        for i, filename in enumerate(yaml_files):
-            file_path = os.path.join(directory, filename)
-            port = base_port + i
-            future = executor.submit(process_file, file_path, port)
-            futures.append((future, filename))
-
-        # 等待所有任务完成
-        completed = 0
-        for future, filename in futures:
-            try:
-                if future.result():
-                    success_count += 1
-            except Exception as e:
-                print(f'Task failed for {filename}: {e}')
-            completed += 1
-            print(f'Progress: {completed}/{len(futures)}')
+    def run_with_instance(file_path: str) -> bool:
+        instance = pool.acquire()
+        deadline = scheduler.next_deadline()
+        try:
+            if check_timeout():
+                skipped.append(os.path.basename(file_path))
+                return False
+            success = process_file(file_path, instance.port, instance, deadline=deadline, **filter_options)
+            if not success and instance.crashed() and os.path.exists(file_path):
+                # 实例崩溃导致失败，换新实例重试一次
+                instance = pool.replace(instance)
+                success = process_file(file_path, instance.port, instance, deadline=deadline, **filter_options)
+            return success
+        finally:
+            pool.release(instance)
 
+    try:
+        with ThreadPoolExecutor(max_workers=max_processes) as executor:
+            for filename in yaml_files:
+                file_path = os.path.join(directory, filename)
+                future = executor.submit(run_with_instance, file_path)
+                futures.append((future, filename))
+
+            # 等待所有任务完成
+            completed = 0
+            for future, filename in futures:
+                try:
+                    if future.result():
+                        success_count += 1
+                except Exception as e:
+                    print(f'Task failed for {filename}: {e}')
+                completed += 1
+                print(f'Progress: {completed}/{len(futures)}')
+    finally:
+        pool.close()
+
+    if skipped:
+        print(f'::warning::{len(skipped)} files not tested before the time limit: {", ".join(sorted(skipped))}')
     print('All processing completed')
     return success_count
 
 
 def main():
-    global start_time
+    global start_time, time_limit, mihomo_command
     
     parser = argparse.ArgumentParser(
         description="使用mihomo API测试代理节点延迟并筛选可用节点",
@@ -475,40 +1531,121 @@ def main():
                        help='测试超时时间(秒), 默认10')
     parser.add_argument('--test-url', default='https://www.gstatic.com/generate_204',
                        help='测试URL, 默认https://www.gstatic.com/generate_204')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                       help=f'同一mihomo实例上并发测试的节点数, 默认{DEFAULT_CONCURRENCY}')
+    parser.add_argument('--group-test', action='store_true',
+                       help='通过 /group/{name}/delay 按分组批量测试，缺失结果的节点再逐个测试')
+    parser.add_argument('--group-size', type=int, default=0,
+                       help='批量测试的分组大小, 0 表示预筛通过的节点放入同一分组(单文件模式下使用 Proxy 分组), 默认0')
+    parser.add_argument('--reuse', action='store_true',
+                       help='并行模式下每个工作线程复用一个mihomo实例，通过 PUT /configs 热加载各文件')
+    parser.add_argument('--pool-size', type=int, default=0,
+                       help='并行模式下的mihomo实例数, 0 表示按可用内存自动确定, 默认0')
+    parser.add_argument('--instance-memory', type=int, default=DEFAULT_INSTANCE_MEMORY_MB,
+                       help=f'单个mihomo实例预估占用内存(MB), 默认{DEFAULT_INSTANCE_MEMORY_MB}')
+    parser.add_argument('--prescreen', action='store_true',
+                       help='先并发做DNS + TCP/UDP预筛，只有存活的节点才进行mihomo测试')
+    parser.add_argument('--prescreen-timeout', type=float, default=prescreen.DEFAULT_PRESCREEN_TIMEOUT,
+                       help=f'预筛超时(秒), 默认{prescreen.DEFAULT_PRESCREEN_TIMEOUT}')
+    parser.add_argument('--prescreen-tls', action='store_true',
+                       help='预筛时使用TLS的节点按其 sni/alpn/skip-cert-verify 完成TLS握手 (隐含 --prescreen)')
+    parser.add_argument('--samples', type=int, default=1,
+                       help='每个节点最多测试次数，大于1时记录延迟统计并按综合评分(延迟、抖动、丢失率、可达性)排序输出, 默认1')
+    parser.add_argument('--max-loss', type=float, default=DEFAULT_MAX_LOSS,
+                       help=f'多次测试时允许的最大丢失率, 默认{DEFAULT_MAX_LOSS}')
+    parser.add_argument('--node-queue', action='store_true',
+                       help='并行模式下所有文件的节点进入同一队列，各mihomo实例按批取出测试')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                       help=f'节点队列模式下每批加载的节点数, 默认{DEFAULT_BATCH_SIZE}')
+    parser.add_argument('--negative-cache', metavar='PATH', default=None,
+                       help='失效服务端缓存文件，退避期内的失效节点不再测试，测试结果写回缓存')
+    parser.add_argument('--previous', metavar='DIRECTORY', default=None,
+                       help=f'增量测试，读取该目录下上一次运行的 {VERIFIED_STATE_FILE}，本次验证状态写入输出目录')
+    parser.add_argument('--trust-ttl', type=int, default=DEFAULT_TRUST_TTL,
+                       help=f'验证后直接沿用的时长(秒), 默认{DEFAULT_TRUST_TTL}')
+    parser.add_argument('--recheck-ttl', type=int, default=DEFAULT_RECHECK_TTL,
+                       help=f'验证后只复测一次的时长(秒), 默认{DEFAULT_RECHECK_TTL}')
+    parser.add_argument('--test-urls', default='',
+                       help='额外的测试目标(逗号分隔)，完成测试的节点再并发测试各目标，可达性向量写入 .stats.json')
+    parser.add_argument('--min-targets', type=int, default=0,
+                       help='至少可达的额外目标数，不足的节点不保留, 默认0')
+    parser.add_argument('--results-db', metavar='PATH', default=None,
+                       help='测试结果历史记录文件 (SQLite)，每个节点的延迟测量追加写入')
+    parser.add_argument('--mihomo-bin', default=DEFAULT_MIHOMO_BIN,
+                       help='启动mihomo的命令, 可带参数, 默认取环境变量 MIHOMO_BIN, 未设置时为 mihomo')
+    parser.add_argument('--time-limit', type=int, default=DEFAULT_TIME_LIMIT,
+                       help=f'运行时间上限(秒)，到达后停止测试并保留已通过的节点, 默认{DEFAULT_TIME_LIMIT}')
 
     args = parser.parse_args()
+    filter_options = {
+        'concurrency': args.concurrency,
+        'group_test': args.group_test,
+        'group_size': args.group_size,
+        'prescreen_timeout': args.prescreen_timeout if args.prescreen or args.prescreen_tls else 0,
+        'prescreen_tls': args.prescreen_tls,
+        'samples': args.samples,
+        'max_loss': args.max_loss,
+        'negative_cache': NegativeCache(args.negative_cache) if args.negative_cache else None,
+        'result_store': ResultStore(args.results_db) if args.results_db else None,
+        'targets': [url.strip() for url in args.test_urls.split(',') if url.strip()],
+        'min_targets': args.min_targets,
+        'carry_forward': CarryForward.from_directory(args.previous, trust_ttl=args.trust_ttl,
+                                                     recheck_ttl=args.recheck_ttl) if args.previous else None,
+    }
 
     # 设置开始时间和超时控制
     start_time = time.time()
-    
-    # 设置5小时超时信号
+    time_limit = args.time_limit
+    mihomo_command = shlex.split(args.mihomo_bin)
+
+    # 设置超时信号，到时只设置标志，各任务保存已有结果后退出
     signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(5 * 3600)  # 5小时 = 5 * 3600 秒
-    
+    signal.alarm(time_limit)
+
     print(f"🕐 程序启动时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time))}")
-    print("⏰ 设置5小时运行超时限制")
-
-    if args.parallel:
-        # 并行处理模式
-        success_count = parallel_filter_proxies(args.parallel)
-        print(f"Processed {success_count} files successfully")
-        sys.exit(0 if success_count > 0 else 1)
-    elif args.input_yaml and args.output_yaml:
-        # 单文件处理模式
-        passed, total = filter_proxies(
-            args.input_yaml,
-            args.output_yaml,
-            args.max_delay,
-            args.api_url,
-            args.timeout,
-            args.test_url,
-            args.api_secret
-        )
-        # 返回退出码：如果有节点通过测试则为0，否则为1
-        sys.exit(0 if passed > 0 else 1)
-    else:
-        parser.print_help()
-        sys.exit(1)
+    print(f"⏰ 设置{time_limit / 3600:g}小时运行超时限制")
+
+    try:
+        if args.parallel:
+            # 并行处理模式
+            success_count = parallel_filter_proxies(args.parallel, args.reuse, args.pool_size,
+                                                    args.instance_memory, args.node_queue, args.batch_size,
+                                                    **filter_options)
+            print(f"Processed {success_count} files successfully")
+            # 到达运行时间上限属于正常结束，已通过的节点均已保存
+            sys.exit(0 if success_count > 0 or timeout_occurred else 1)
+        elif args.input_yaml and args.output_yaml:
+            # 单文件处理模式
+            passed, total = filter_proxies(
+                args.input_yaml,
+                args.output_yaml,
+                args.max_delay,
+                args.api_url,
+                args.timeout,
+                args.test_url,
+                args.api_secret,
+                **filter_options
+            )
+            # 返回退出码：如果有节点通过测试则为0，否则为1
+            sys.exit(0 if passed > 0 or timeout_occurred else 1)
+        else:
+            parser.print_help()
+            sys.exit(1)
+    finally:
+        carry_forward = filter_options['carry_forward']
+        if carry_forward is not None and (args.parallel or args.output_yaml):
+            state_file = os.path.join(args.parallel or os.path.dirname(args.output_yaml) or '.', VERIFIED_STATE_FILE)
+            carry_forward.save(state_file)
+            print(f"验证状态已保存到: {state_file}")
+        negative_cache = filter_options['negative_cache']
+        if negative_cache is not None:
+            stats = negative_cache.stats()
+            print(f"失效服务端缓存: 本次跳过 {stats['skipped']} 个节点, 缓存中退避的服务端 {stats['active']} 个")
+            negative_cache.close()
+        result_store = filter_options['result_store']
+        if result_store is not None:
+            result_store.close()
+            print(f"测试结果已追加到: {args.results_db}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+negative_cache.py - 失效服务端的持久化负缓存
+
+以 endpoint_fingerprint 为键记录失败次数和最近失败时间，失效节点在指数退避的
+过期时间内被跳过(按 sample_rate 小概率放行重测)。查询前先经过布隆过滤器，
+绝大多数从未失败过的节点无需访问数据库。
+
+用法:
+    python negative_cache.py [--db <path>] [--purge]
+"""
+
+import argparse
+import hashlib
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict
+
+from fingerprint import endpoint_fingerprint
+
+DEFAULT_CACHE_FILE = './negative_cache.db'
+# 第一次失败后的跳过时间(秒)，之后每次失败翻倍，直至上限
+DEFAULT_BASE_BACKOFF = 3600
+DEFAULT_MAX_BACKOFF = 7 * 24 * 3600
+# 处于退避期的节点仍以该概率被放行重测
+DEFAULT_SAMPLE_RATE = 0.05
+# 布隆过滤器容量与误判率
+DEFAULT_BLOOM_CAPACITY = 2_000_000
+DEFAULT_BLOOM_ERROR_RATE = 0.01
+
+
+class BloomFilter:
+    """基于 bytearray 的布隆过滤器，使用 blake2b 双重哈希生成 k 个位置"""
+
+    def __init__(self, capacity: int = DEFAULT_BLOOM_CAPACITY, error_rate: float = DEFAULT_BLOOM_ERROR_RATE,
+                 bits: bytes = None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class NegativeCache:
+    """
+    失效服务端缓存，可在多个线程间共享；记录先缓冲在内存中，commit() 时批量写入
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_FILE, base_backoff: int = DEFAULT_BASE_BACKOFF,
+                 max_backoff: int = DEFAULT_MAX_BACKOFF, sample_rate: float = DEFAULT_SAMPLE_RATE,
+                 bloom_capacity: int = DEFAULT_BLOOM_CAPACITY):
+        self.path = path
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.failures = set()
+        self.successes = set()
+        self.skipped = 0
+
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS dead_endpoints (
+                fingerprint TEXT PRIMARY KEY,
+                failures INTEGER NOT NULL,
+                last_failure REAL NOT NULL,
+                expires REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)')
+        self.conn.commit()
+        self.bloom = self._load_bloom(bloom_capacity)
+
+    def _load_bloom(self, capacity: int) -> BloomFilter:
+        """读取保存的布隆过滤器，参数不一致或记录数超出容量时按数据库重建"""
+        count = self.conn.execute('SELECT COUNT(*) FROM dead_endpoints').fetchone()[0]
+        capacity = max(capacity, count * 2)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'bloom'").fetchone()
+        saved = self.conn.execute("SELECT value FROM meta WHERE key = 'bloom_capacity'").fetchone()
+        if row and saved and int(saved[0]) >= count:
+            bloom = BloomFilter(int(saved[0]), bits=row[0])
+            if len(bloom.bits) == len(row[0]):
+                return bloom
+        bloom = BloomFilter(capacity)
+        for (fingerprint,) in self.conn.execute('SELECT fingerprint FROM dead_endpoints'):
+            bloom.add(fingerprint)
+        return bloom
+
+    def backoff(self, failures: int) -> float:
+        """连续失败 failures 次后的跳过时长"""
+        return min(self.max_backoff, self.base_backoff * 2 ** max(0, failures - 1))
+
+    def should_skip(self, proxy: Dict[str, Any]) -> bool:
+        """节点的服务端处于退避期时返回True (按 sample_rate 小概率放行)"""
+        fingerprint = endpoint_fingerprint(proxy)
+        with self.lock:
+            if fingerprint not in self.bloom:
+                return False
+            row = self.conn.execute('SELECT expires FROM dead_endpoints WHERE fingerprint = ?',
+                                    (fingerprint,)).fetchone()
+        if row is None or row[0] <= time.time() or random.random() < self.sample_rate:
+            return False
+        with self.lock:
+            self.skipped += 1
+        return True
+
+    def record_failure(self, proxy: Dict[str, Any]):
+        with self.lock:
+            self.failures.add(endpoint_fingerprint(proxy))
+
+    def record_success(self, proxy: Dict[str, Any]):
+        with self.lock:
+            self.successes.add(endpoint_fingerprint(proxy))
+
+    def commit(self):
+        """批量写入缓冲的结果: 成功的服务端移出缓存，失败的累加失败次数并延长退避"""
+        with self.lock:
+            if not self.failures and not self.successes:
+                return
+            now = time.time()
+            # 同一服务端既有成功又有失败时(如多个节点共用服务端)以成功为准
+            failures = self.failures - self.successes
+            # 多个进程可能共用同一缓存文件: 加写锁后再读取失败次数并合并布隆过滤器
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                stored = self.conn.execute("SELECT value FROM meta WHERE key = 'bloom'").fetchone()
+                if stored and len(stored[0]) == len(self.bloom.bits):
+                    merged = int.from_bytes(self.bloom.bits, 'little') | int.from_bytes(stored[0], 'little')
+                    self.bloom.bits = bytearray(merged.to_bytes(len(self.bloom.bits), 'little'))
+                for fingerprint in failures:
+                    self.bloom.add(fingerprint)
+                # 新记录的退避为 base_backoff，已有记录的失败次数加一、退避翻倍
+                self.conn.executemany('''
+                    INSERT INTO dead_endpoints VALUES (?, 1, ?, ?)
+                    ON CONFLICT(fingerprint) DO UPDATE SET
+                        failures = failures + 1,
+                        last_failure = excluded.last_failure,
+                        expires = excluded.last_failure + MIN(?, ? * (1 << MIN(failures, 30)))
+                ''', [(fingerprint, now, now + self.backoff(1), self.max_backoff, self.base_backoff)
+                      for fingerprint in failures])
+                self.conn.executemany('DELETE FROM dead_endpoints WHERE fingerprint = ?',
+                                      [(fingerprint,) for fingerprint in self.successes])
+                self.conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+                    ('bloom', bytes(self.bloom.bits)),
+                    ('bloom_capacity', self.bloom.capacity),
+                ])
+                self.conn.commit()
+            except Exception:
+                # 写入失败时回滚，缓冲的结果保留到下次 commit
+                self.conn.rollback()
+                raise
+            self.failures.clear()
+            self.successes.clear()
+
+    def purge(self, older_than: float = None):
+        """删除早已过期的记录，默认删除超过最大退避时长仍未再失败的服务端"""
+        older_than = older_than if older_than is not None else self.max_backoff * 2
+        with self.lock:
+            self.conn.execute('DELETE FROM dead_endpoints WHERE expires < ?', (time.time() - older_than,))
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            total, active = self.conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(expires > ?), 0) FROM dead_endpoints', (time.time(),)).fetchone()
+        return {'total': total, 'active': active, 'skipped': self.skipped}
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看或清理失效服务端缓存")
+    parser.add_argument('--db', default=DEFAULT_CACHE_FILE, help=f'缓存文件路径, 默认{DEFAULT_CACHE_FILE}')
+    parser.add_argument('--purge', action='store_true', help='删除早已过期的记录')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"缓存文件不存在: {args.db}")
+        return
+    cache = NegativeCache(args.db)
+    if args.purge:
+        cache.purge()
+    stats = cache.stats()
+    print(f"失效服务端: {stats['total']} 个, 退避中: {stats['active']} 个")
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
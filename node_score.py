@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+node_score.py - 节点综合评分
+
+一次运行的全部测量按列存放在 numpy 数组中 (每行一个节点，缺失值为 NaN)，各项指标归一化到 0~1 后
+按权重加权，一次向量化计算得到全部节点的 0~100 分。某个节点缺失的指标不计入该节点的权重，
+例如只有延迟测量的节点只按延迟类指标评分。
+
+列:
+    latency:      中位延迟(ms)
+    latency_p90:  90分位延迟(ms)
+    jitter:       抖动(ms)
+    loss:         丢失率, 0~1
+    download:     下载速度(Mbps)
+    upload:       上传速度(Mbps)
+    reachability: 额外测试目标的可达比例, 0~1
+    history:      历史通过率, 0~1
+
+用法:
+    python node_score.py <stats.json> [--weights latency=0.5,loss=0.2] [--top <n>]
+    对 mihomo_test 输出的 .stats.json 评分并列出得分最高的节点
+"""
+
+import argparse
+import json
+import math
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+DEFAULT_WEIGHTS = {
+    'latency': 0.3,
+    'latency_p90': 0.1,
+    'jitter': 0.1,
+    'loss': 0.15,
+    'download': 0.15,
+    'upload': 0.05,
+    'reachability': 0.05,
+    'history': 0.1,
+}
+# 延迟不超过 LATENCY_GOOD 得满分，达到 LATENCY_BAD 得0分，中间按对数插值
+LATENCY_GOOD = 100
+LATENCY_BAD = 3000
+# 抖动达到 JITTER_BAD 得0分
+JITTER_BAD = 500
+# 速度按 log(1 + Mbps) 归一化，达到该值得满分
+DOWNLOAD_GOOD = 100
+UPLOAD_GOOD = 50
+
+
+def parse_weights(text: str) -> Dict[str, float]:
+    """解析 "latency=0.5,loss=0.2" 形式的权重，未指定的指标沿用默认权重，设为0即不计入"""
+    weights = dict(DEFAULT_WEIGHTS)
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        name, _, value = item.partition('=')
+        if name not in DEFAULT_WEIGHTS:
+            raise ValueError(f'unknown score column: {name}')
+        weights[name] = float(value)
+    return weights
+
+
+def column(records: Iterable[Dict[str, Any]], key: str, scale: float = 1.0) -> np.ndarray:
+    """从字典列表中取出一列，缺失或为None的值记为NaN"""
+    return np.fromiter((value * scale if value is not None else np.nan
+                        for value in (record.get(key) for record in records)), dtype=float)
+
+
+def delay_percentile(delay_lists: List[List[float]], q: float) -> np.ndarray:
+    """
+    各节点延迟样本的q分位数(线性插值)，没有样本的节点为NaN
+    不等长的样本先补NaN成矩阵，按行排序后(NaN排在末尾)按各行样本数取插值位置
+    """
+    lengths = np.fromiter((len(delays) for delays in delay_lists), dtype=int, count=len(delay_lists))
+    matrix = np.full((len(delay_lists), max(1, lengths.max(initial=0))), np.nan)
+    if lengths.sum():
+        matrix[np.arange(matrix.shape[1]) < lengths[:, None]] = np.concatenate(
+            [delays for delays in delay_lists if len(delays)]).astype(float)
+    matrix.sort(axis=1)
+    position = q / 100 * np.maximum(lengths - 1, 0)
+    lower = np.floor(position).astype(int)[:, None]
+    upper = np.ceil(position).astype(int)[:, None]
+    fraction = position - lower[:, 0]
+    low = np.take_along_axis(matrix, lower, axis=1)[:, 0]
+    high = np.take_along_axis(matrix, upper, axis=1)[:, 0]
+    return np.where(lengths > 0, low + (high - low) * fraction, np.nan)
+
+
+def normalize(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """把各列归一化到 0~1 (越大越好)，NaN 保持为 NaN"""
+    def latency(values):
+        span = math.log(LATENCY_BAD / LATENCY_GOOD)
+        return 1 - np.clip(np.log(np.maximum(values, LATENCY_GOOD) / LATENCY_GOOD) / span, 0, 1)
+
+    normalizers = {
+        'latency': latency,
+        'latency_p90': latency,
+        'jitter': lambda values: 1 - np.clip(values / JITTER_BAD, 0, 1),
+        'loss': lambda values: 1 - np.clip(values, 0, 1),
+        'download': lambda values: np.clip(np.log1p(np.maximum(values, 0)) / math.log1p(DOWNLOAD_GOOD), 0, 1),
+        'upload': lambda values: np.clip(np.log1p(np.maximum(values, 0)) / math.log1p(UPLOAD_GOOD), 0, 1),
+        'reachability': lambda values: np.clip(values, 0, 1),
+        'history': lambda values: np.clip(values, 0, 1),
+    }
+    with np.errstate(invalid='ignore'):
+        return {name: normalizers[name](np.asarray(values, dtype=float))
+                for name, values in columns.items() if name in normalizers}
+
+
+def score_nodes(columns: Dict[str, np.ndarray], weights: Dict[str, float] = None) -> np.ndarray:
+    """
+    计算综合评分
+
+    columns: 列名 -> 长度相同的数组
+    返回: 0~100 的分数数组，没有任何可用指标的节点为 NaN
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    normalized = normalize(columns)
+    if not normalized:
+        return np.array([], dtype=float)
+    size = len(next(iter(normalized.values())))
+    total = np.zeros(size)
+    weight_sum = np.zeros(size)
+    for name, values in normalized.items():
+        weight = weights.get(name, 0)
+        if weight <= 0:
+            continue
+        present = ~np.isnan(values)
+        total += weight * np.where(present, values, 0)
+        weight_sum += weight * present
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.round(np.where(weight_sum > 0, 100 * total / weight_sum, np.nan), 1)
+
+
+def rank(scores: np.ndarray) -> np.ndarray:
+    """按分数从高到低排列的下标，同分保持原顺序，NaN 排在最后"""
+    return np.argsort(-np.nan_to_num(scores, nan=-np.inf), kind='stable')
+
+
+def cutoff(scores: np.ndarray, min_score: float = None, top: int = None, top_fraction: float = None) -> np.ndarray:
+    """
+    排名截断: 分数不低于 min_score，且位于前 top 个 / 前 top_fraction 比例内的节点
+    top_fraction 按符合条件(有分数且不低于 min_score)的节点数计算，失败节点不计入
+    返回保留节点的布尔掩码
+    """
+    candidate = np.nan_to_num(scores, nan=-np.inf)
+    keep = ~np.isnan(scores)
+    if min_score is not None:
+        keep &= candidate >= min_score
+    limits = [limit for limit in (top, math.ceil(top_fraction * keep.sum()) if top_fraction else None)
+              if limit is not None]
+    if limits and min(limits) < keep.sum():
+        # argpartition 只需找出前k个，不必完整排序
+        limit = max(0, min(limits))
+        best = np.zeros(len(scores), dtype=bool)
+        if limit:
+            best[np.argpartition(-np.where(keep, candidate, -np.inf), limit - 1)[:limit]] = True
+        keep &= best
+    return keep
+
+
+def latency_columns(stats_list: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """由 mihomo_test 的延迟统计 (median/jitter/loss/delays/reachability) 构造评分列"""
+    reachability = [stats.get('reachability') or {} for stats in stats_list]
+    return {
+        'latency': column(stats_list, 'median'),
+        'latency_p90': delay_percentile([stats.get('delays') or [] for stats in stats_list], 90),
+        'jitter': column(stats_list, 'jitter'),
+        'loss': column(stats_list, 'loss'),
+        'reachability': np.fromiter((len([d for d in r.values() if d]) / len(r) if r else np.nan
+                                     for r in reachability), dtype=float, count=len(reachability)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按延迟统计计算节点综合评分")
+    parser.add_argument('stats_file', help='mihomo_test 输出的 .stats.json')
+    parser.add_argument('--weights', default='', help='指标权重, 如 latency=0.5,loss=0.2')
+    parser.add_argument('--top', type=int, default=20, help='列出得分最高的节点数, 默认20')
+    args = parser.parse_args()
+
+    with open(args.stats_file, 'r', encoding='utf-8') as f:
+        stats = json.load(f)
+    # 统计文件中同时记录了未保留的节点 (passed 为 false)
+    names = [name for name in stats if stats[name].get('passed', True)]
+    scores = score_nodes(latency_columns([stats[name] for name in names]), parse_weights(args.weights))
+    for i in rank(scores)[:args.top]:
+        print(f"  {names[i]}: {scores[i]:g}")
+
+
+if __name__ == '__main__':
+    main()
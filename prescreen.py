@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+prescreen.py - 在mihomo测速前对节点做低成本的可达性预筛
+
+对每个节点并发执行 DNS 解析 + TCP 连接 (UDP协议节点改为UDP探测)，
+超时时间很短，解析失败或端口拒绝连接的节点可在毫秒级被丢弃。
+启用 TLS 探测时，使用TLS的节点按其 sni、alpn、skip-cert-verify 完成一次TLS握手。
+基于QUIC的节点发送一个未知版本号的QUIC长包头数据包，服务端按 RFC 9000 应回复版本协商包，
+无需实现QUIC加密即可确认服务存活；启用混淆(obfs)的节点无法这样探测，结果记为不确定。
+
+用法:
+    python prescreen.py <input_yaml> [--timeout <sec>] [--concurrency <n>] [--tls]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import yaml
+
+# 基于UDP/QUIC的协议，TCP连接对其没有意义
+UDP_PROXY_TYPES = {'hysteria', 'hysteria2', 'tuic', 'wireguard'}
+# 其中运行在QUIC上的协议
+QUIC_PROXY_TYPES = {'hysteria', 'hysteria2', 'tuic'}
+# 形如 0x?a?a?a?a 的版本号保留给版本协商使用，服务端不会支持
+QUIC_PROBE_VERSION = b'\x1a\x2a\x3a\x4a'
+# 服务端只对不小于1200字节的数据报回复版本协商
+QUIC_MIN_DATAGRAM = 1200
+QUIC_PROBE_ATTEMPTS = 2
+
+DEFAULT_PRESCREEN_TIMEOUT = 2.0
+DEFAULT_PRESCREEN_CONCURRENCY = 256
+# DNS解析线程数上限
+DNS_MAX_WORKERS = 256
+# DNS解析超时不能说明服务端失效(可能只是本地解析器繁忙)，不计入失效缓存
+DNS_TIMEOUT_REASON = 'DNS timeout'
+
+
+class DnsCache:
+    """
+    同一批节点中大量共享服务器域名，解析结果按域名缓存
+    解析在专用线程池中进行，线程数与探测并发数一致；超时从线程开始解析时计起，
+    排队等待线程的时间不计入，用完后调用 close()
+    """
+
+    def __init__(self, timeout: float, workers: int = DEFAULT_PRESCREEN_CONCURRENCY):
+        self.timeout = timeout
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, min(workers, DNS_MAX_WORKERS)),
+                                           thread_name_prefix='dns')
+
+    async def resolve(self, host: str, port: int) -> str:
+        """返回解析得到的IP，失败时抛出 socket.gaierror 或 asyncio.TimeoutError"""
+        if host not in self.pending:
+            self.pending[host] = asyncio.ensure_future(self._getaddrinfo(host, port))
+        infos = await asyncio.shield(self.pending[host])
+        return infos[0][4][0]
+
+    async def _getaddrinfo(self, host: str, port: int):
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+
+        def mark_started():
+            if not started.done():
+                started.set_result(None)
+
+        def lookup():
+            loop.call_soon_threadsafe(mark_started)
+            return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+
+        future = loop.run_in_executor(self.executor, lookup)
+        await started
+        return await asyncio.wait_for(future, self.timeout)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _UdpProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.done = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        if not self.done.done():
+            self.done.set_result(data)
+
+    def error_received(self, exc):
+        if not self.done.done():
+            self.done.set_exception(exc)
+
+
+def quic_probe_packet() -> tuple[bytes, bytes, bytes]:
+    """
+    构造引发版本协商的QUIC长包头数据包
+
+    返回: (数据包, 目标连接ID, 源连接ID)
+    """
+    dcid = os.urandom(8)
+    scid = os.urandom(8)
+    header = bytes([0xc0 | (os.urandom(1)[0] & 0x3f)]) + QUIC_PROBE_VERSION
+    header += bytes([len(dcid)]) + dcid + bytes([len(scid)]) + scid
+    return header + b'\0' * (QUIC_MIN_DATAGRAM - len(header)), dcid, scid
+
+
+def parse_version_negotiation(data: bytes, dcid: bytes, scid: bytes) -> List[str]:
+    """
+    解析版本协商包，连接ID需与探测包对应(目标ID为我们的源ID)，返回服务端支持的版本列表，
+    不是版本协商包时返回None
+    """
+    if len(data) < 7 or not data[0] & 0x80 or data[1:5] != b'\0\0\0\0':
+        return None
+    pos = 5
+    dcid_len = data[pos]
+    if data[pos + 1:pos + 1 + dcid_len] != scid:
+        return None
+    pos += 1 + dcid_len
+    if pos >= len(data):
+        return None
+    scid_len = data[pos]
+    if data[pos + 1:pos + 1 + scid_len] != dcid:
+        return None
+    pos += 1 + scid_len
+    return [data[i:i + 4].hex() for i in range(pos, len(data) - 3, 4)]
+
+
+async def probe_quic(ip: str, port: int, timeout: float) -> tuple[bool, str]:
+    """
+    发送未知版本号的QUIC数据包并等待版本协商响应，丢包时在超时内重发一次
+    收到任何响应判定为存活，ICMP端口不可达或无响应判定为失败
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.create_datagram_endpoint(_UdpProbeProtocol, remote_addr=(ip, port))
+    except OSError as e:
+        return False, f'udp error: {e.strerror or e}'
+    packet, dcid, scid = quic_probe_packet()
+    try:
+        for _ in range(QUIC_PROBE_ATTEMPTS):
+            transport.sendto(packet)
+            try:
+                data = await asyncio.wait_for(asyncio.shield(protocol.done), timeout / QUIC_PROBE_ATTEMPTS)
+            except asyncio.TimeoutError:
+                continue
+            versions = parse_version_negotiation(data, dcid, scid)
+            if versions is None:
+                return True, 'quic non-negotiation response'
+            return True, ''
+        return False, 'quic no response'
+    except ConnectionRefusedError:
+        return False, 'udp port unreachable'
+    except OSError as e:
+        return False, f'udp error: {e.strerror or e}'
+    finally:
+        transport.close()
+
+
+async def probe_udp_proxy(proxy: Dict[str, Any], ip: str, port: int, timeout: float) -> tuple[bool, str]:
+    """
+    UDP协议节点的探测: 未混淆的QUIC节点做版本协商探测，
+    混淆的QUIC节点只能检查端口不可达，无响应时记为不确定
+    """
+    if proxy.get('type') not in QUIC_PROXY_TYPES:
+        return await probe_udp(ip, port, timeout)
+    if proxy.get('obfs'):
+        alive, reason = await probe_udp(ip, port, timeout)
+        return alive, 'quic inconclusive: obfs' if alive else reason
+    return await probe_quic(ip, port, timeout)
+
+
+async def probe_tcp(ip: str, port: int, timeout: float) -> tuple[bool, str]:
+    """尝试建立TCP连接"""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        writer.close()
+        return True, ''
+    except asyncio.TimeoutError:
+        return False, 'tcp timeout'
+    except ConnectionRefusedError:
+        return False, 'tcp refused'
+    except OSError as e:
+        return False, f'tcp error: {e.strerror or e}'
+
+
+async def probe_udp(ip: str, port: int, timeout: float, payload: bytes = b'\0') -> tuple[bool, str]:
+    """
+    向UDP端口发送数据包: 收到 ICMP 端口不可达 (ConnectionRefusedError) 判定为失败，
+    收到响应或无响应均视为存活 (UDP服务通常不回应无效数据)
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.create_datagram_endpoint(_UdpProbeProtocol, remote_addr=(ip, port))
+    except OSError as e:
+        return False, f'udp error: {e.strerror or e}'
+    try:
+        transport.sendto(payload)
+        await asyncio.wait_for(protocol.done, timeout)
+        return True, ''
+    except asyncio.TimeoutError:
+        return True, 'udp no response'
+    except ConnectionRefusedError:
+        return False, 'udp port unreachable'
+    except OSError as e:
+        return False, f'udp error: {e.strerror or e}'
+    finally:
+        transport.close()
+
+
+class TlsHandshakeTimeout(Exception):
+    """TCP已连接但TLS握手超时"""
+
+
+def tls_params(proxy: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    节点在TCP上使用TLS (trojan、tls: true、REALITY) 时返回握手参数，否则返回None
+    REALITY 对未认证的握手转发到伪装站点，证书无需校验
+    """
+    if proxy.get('type') in UDP_PROXY_TYPES:
+        return None
+    if proxy.get('type') != 'trojan' and not proxy.get('tls') and not proxy.get('reality-opts'):
+        return None
+    alpn = proxy.get('alpn') or []
+    return {
+        'server_name': str(proxy.get('sni') or proxy.get('servername') or proxy.get('server', '')).strip(),
+        'alpn': [alpn] if isinstance(alpn, str) else list(alpn),
+        'verify': not proxy.get('skip-cert-verify') and not proxy.get('reality-opts'),
+    }
+
+
+async def tls_handshake(ip: str, port: int, server_name: str, alpn: List[str], verify: bool,
+                        timeout: float) -> tuple[asyncio.StreamWriter, float, float]:
+    """建立TCP连接并完成TLS握手，返回 (writer, 连接耗时ms, 握手耗时ms)"""
+    context = ssl.create_default_context()
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if alpn:
+        context.set_alpn_protocols(alpn)
+    start = time.perf_counter()
+    _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    connected = time.perf_counter()
+    try:
+        await asyncio.wait_for(writer.start_tls(context, server_hostname=server_name or None), timeout)
+    except asyncio.TimeoutError:
+        writer.close()
+        raise TlsHandshakeTimeout()
+    except BaseException:
+        writer.close()
+        raise
+    return writer, (connected - start) * 1000, (time.perf_counter() - connected) * 1000
+
+
+async def probe_tls(ip: str, port: int, server_name: str, alpn: List[str] = None, verify: bool = True,
+                    timeout: float = DEFAULT_PRESCREEN_TIMEOUT) -> Dict[str, Any]:
+    """
+    TLS握手探测，先按校验证书的方式握手以记录证书是否有效；
+    证书无效而节点跳过证书校验时，不校验证书重新握手
+
+    返回: {'alive', 'reason', 'connect_ms', 'handshake_ms', 'cert_valid', 'alpn'}
+    """
+    result = {'alive': False, 'reason': '', 'connect_ms': None, 'handshake_ms': None,
+              'cert_valid': None, 'alpn': None}
+    try:
+        try:
+            writer, connect_ms, handshake_ms = await tls_handshake(ip, port, server_name, alpn, True, timeout)
+            result['cert_valid'] = True
+        except ssl.SSLCertVerificationError as e:
+            result['cert_valid'] = False
+            if verify:
+                result['reason'] = f'tls cert invalid: {e.verify_message}'
+                return result
+            writer, connect_ms, handshake_ms = await tls_handshake(ip, port, server_name, alpn, False, timeout)
+    except TlsHandshakeTimeout:
+        result['reason'] = 'tls timeout'
+        return result
+    except asyncio.TimeoutError:
+        result['reason'] = 'tcp timeout'
+        return result
+    except ConnectionRefusedError:
+        result['reason'] = 'tcp refused'
+        return result
+    except ssl.SSLError as e:
+        result['reason'] = f'tls error: {e.reason or e}'
+        return result
+    except (OSError, EOFError) as e:
+        result['reason'] = f'tls error: {getattr(e, "strerror", None) or e or type(e).__name__}'
+        return result
+
+    ssl_object = writer.get_extra_info('ssl_object')
+    result.update(alive=True, connect_ms=round(connect_ms, 2), handshake_ms=round(handshake_ms, 2),
+                  alpn=ssl_object.selected_alpn_protocol() if ssl_object else None)
+    writer.close()
+    return result
+
+
+async def prescreen_proxy(proxy: Dict[str, Any], dns: DnsCache, timeout: float,
+                          tls: bool = False) -> Dict[str, Any]:
+    """
+    预筛单个节点，tls 为True时使用TLS的节点以TLS握手代替TCP连接
+
+    返回: {'alive': 是否存活, 'reason': 失败原因, 'elapsed_ms': 耗时}
+    """
+    start = time.perf_counter()
+    server = str(proxy.get('server', '')).strip()
+    try:
+        port = int(proxy.get('port', 0))
+    except (TypeError, ValueError):
+        port = 0
+    if not server or not 0 < port <= 65535:
+        return {'alive': False, 'reason': 'missing server or port', 'elapsed_ms': 0}
+
+    try:
+        ip = await dns.resolve(server, port)
+    except asyncio.TimeoutError:
+        return {'alive': False, 'reason': DNS_TIMEOUT_REASON,
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)}
+    except (socket.gaierror, OSError):
+        return {'alive': False, 'reason': 'DNS resolution failed',
+                'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)}
+
+    params = tls_params(proxy) if tls else None
+    if proxy.get('type') in UDP_PROXY_TYPES:
+        alive, reason = await probe_udp_proxy(proxy, ip, port, timeout)
+    elif params:
+        probe = await probe_tls(ip, port, params['server_name'], params['alpn'], params['verify'], timeout)
+        alive, reason = probe['alive'], probe['reason']
+    else:
+        alive, reason = await probe_tcp(ip, port, timeout)
+    return {'alive': alive, 'reason': reason, 'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)}
+
+
+async def prescreen_proxies_async(proxies: List[Dict[str, Any]], timeout: float = DEFAULT_PRESCREEN_TIMEOUT,
+                                  concurrency: int = DEFAULT_PRESCREEN_CONCURRENCY,
+                                  tls: bool = False) -> List[Dict[str, Any]]:
+    dns = DnsCache(timeout, concurrency)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def bounded(proxy):
+        async with semaphore:
+            return await prescreen_proxy(proxy, dns, timeout, tls)
+
+    try:
+        return await asyncio.gather(*(bounded(proxy) for proxy in proxies))
+    finally:
+        dns.close()
+
+
+def prescreen_proxies(proxies: List[Dict[str, Any]], timeout: float = DEFAULT_PRESCREEN_TIMEOUT,
+                      concurrency: int = DEFAULT_PRESCREEN_CONCURRENCY, tls: bool = False) -> List[Dict[str, Any]]:
+    """
+    并发预筛一组节点
+
+    返回: 与proxies顺序一致的预筛结果列表
+    """
+    if not proxies:
+        return []
+    return asyncio.run(prescreen_proxies_async(proxies, timeout, concurrency, tls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对节点做DNS + TCP/UDP可达性预筛")
+    parser.add_argument('input_yaml', help='输入的YAML配置文件路径')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_PRESCREEN_TIMEOUT,
+                        help=f'单个节点的探测超时(秒), 默认{DEFAULT_PRESCREEN_TIMEOUT}')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_PRESCREEN_CONCURRENCY,
+                        help=f'并发探测数, 默认{DEFAULT_PRESCREEN_CONCURRENCY}')
+    parser.add_argument('--tls', action='store_true', help='使用TLS的节点以TLS握手代替TCP连接')
+    args = parser.parse_args()
+
+    with open(args.input_yaml, 'r', encoding='utf-8') as f:
+        proxies = (yaml.safe_load(f) or {}).get('proxies', [])
+
+    start = time.time()
+    results = prescreen_proxies(proxies, args.timeout, args.concurrency, args.tls)
+    for proxy, result in zip(proxies, results):
+        mark = '✓' if result['alive'] else '✗'
+        print(f"  {mark} {proxy.get('name', 'Unknown')}: {result['elapsed_ms']}ms {result['reason']}")
+    alive = len([r for r in results if r['alive']])
+    print(f"\n预筛完成: {alive}/{len(proxies)} 个节点存活, 耗时 {time.time() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+result_store.py - 节点测试结果的历史记录
+
+以 node_fingerprint 为键保存节点配置，每次测量(mihomo延迟、速度测试)追加一行时间序列记录。
+记录先缓冲在内存中，commit() 时批量写入；可按近期中位延迟查询最好的N个节点。
+
+用法:
+    python result_store.py [--db <path>] [--best <n>] [--since <sec>] [--source mihomo|speed]
+                           [--output <yaml>] [--purge]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List
+
+import yaml
+
+from fingerprint import node_fingerprint
+
+DEFAULT_RESULT_DB = './results.db'
+# 计算近期中位延迟时使用的时间范围(秒)
+DEFAULT_RECENT_WINDOW = 7 * 24 * 3600
+# 超过该时长(秒)的测量记录在 purge 时删除
+DEFAULT_RETENTION = 30 * 24 * 3600
+MEASUREMENT_FIELDS = ('delay_ms', 'loss', 'download_mbps', 'upload_mbps', 'speed_score')
+
+
+class ResultStore:
+    """
+    测试结果存储，可在多个线程间共享
+    """
+
+    def __init__(self, path: str = DEFAULT_RESULT_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.measurements = []
+
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS nodes (
+                fingerprint TEXT PRIMARY KEY,
+                name TEXT,
+                type TEXT,
+                config TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS measurements (
+                fingerprint TEXT NOT NULL,
+                ts REAL NOT NULL,
+                source TEXT NOT NULL,
+                status TEXT NOT NULL,
+                delay_ms REAL,
+                loss REAL,
+                download_mbps REAL,
+                upload_mbps REAL,
+                speed_score REAL
+            );
+            CREATE INDEX IF NOT EXISTS measurements_by_node ON measurements (fingerprint, ts);
+            CREATE INDEX IF NOT EXISTS measurements_by_time ON measurements (ts, source);
+        ''')
+        self.conn.commit()
+
+    def record(self, proxy: Dict[str, Any], source: str, passed: bool, ts: float = None, **metrics):
+        """
+        记录一次测量，metrics 取 MEASUREMENT_FIELDS 中的字段
+        source: 'mihomo' 或 'speed'
+        """
+        ts = ts if ts is not None else time.time()
+        fingerprint = node_fingerprint(proxy)
+        row = (fingerprint, ts, source, 'pass' if passed else 'fail') + tuple(
+            metrics.get(field) for field in MEASUREMENT_FIELDS)
+        with self.lock:
+            self.nodes[fingerprint] = (proxy, ts)
+            self.measurements.append(row)
+
+    def commit(self):
+        """批量写入缓冲的记录: 节点配置按指纹更新，测量记录追加"""
+        with self.lock:
+            if not self.measurements:
+                return
+            nodes = [(fingerprint, proxy.get('name'), proxy.get('type'),
+                      json.dumps(proxy, ensure_ascii=False, default=str), ts, ts)
+                     for fingerprint, (proxy, ts) in self.nodes.items()]
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.executemany('''
+                    INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(fingerprint) DO UPDATE SET
+                        name = excluded.name,
+                        config = excluded.config,
+                        last_seen = MAX(last_seen, excluded.last_seen)
+                ''', nodes)
+                self.conn.executemany('INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                      self.measurements)
+                self.conn.commit()
+            except Exception:
+                # 写入失败时回滚，缓冲的记录保留到下次 commit
+                self.conn.rollback()
+                raise
+            self.nodes.clear()
+            self.measurements.clear()
+
+    def best(self, limit: int, since: float = DEFAULT_RECENT_WINDOW, source: str = None) -> List[Dict[str, Any]]:
+        """
+        近 since 秒内按中位延迟排序最好的 limit 个节点，只统计通过的测量
+
+        返回: [{'fingerprint', 'median', 'samples', 'pass_rate', 'proxy'}]
+        """
+        params = [time.time() - since]
+        source_filter = ''
+        if source:
+            source_filter = 'AND source = ?'
+            params.append(source)
+        params.append(limit)
+        # 窗口函数按延迟排名后取中间的一个或两个值求中位数
+        with self.lock:
+            rows = self.conn.execute(f'''
+                WITH recent AS (
+                    SELECT fingerprint, status, delay_ms FROM measurements
+                    WHERE ts >= ? {source_filter}
+                ),
+                rates AS (
+                    SELECT fingerprint, AVG(status = 'pass') AS pass_rate FROM recent GROUP BY fingerprint
+                ),
+                ranked AS (
+                    SELECT fingerprint, delay_ms,
+                           ROW_NUMBER() OVER (PARTITION BY fingerprint ORDER BY delay_ms) AS position,
+                           COUNT(*) OVER (PARTITION BY fingerprint) AS samples
+                    FROM recent WHERE status = 'pass' AND delay_ms > 0
+                ),
+                medians AS (
+                    SELECT fingerprint, AVG(delay_ms) AS median, MAX(samples) AS samples FROM ranked
+                    WHERE position IN ((samples + 1) / 2, (samples + 2) / 2)
+                    GROUP BY fingerprint
+                )
+                SELECT m.fingerprint, m.median, m.samples, r.pass_rate, n.config
+                FROM medians m JOIN rates r USING (fingerprint) JOIN nodes n USING (fingerprint)
+                ORDER BY m.median, r.pass_rate DESC
+                LIMIT ?
+            ''', params).fetchall()
+        return [{'fingerprint': fingerprint, 'median': round(median, 1), 'samples': samples,
+                 'pass_rate': round(pass_rate, 3), 'proxy': json.loads(config)}
+                for fingerprint, median, samples, pass_rate, config in rows]
+
+    def pass_rates(self, since: float = DEFAULT_RECENT_WINDOW, source: str = None) -> Dict[str, float]:
+        """近 since 秒内各节点的通过率，按 node_fingerprint 索引"""
+        params = [time.time() - since]
+        source_filter = ''
+        if source:
+            source_filter = 'AND source = ?'
+            params.append(source)
+        with self.lock:
+            return dict(self.conn.execute(f'''
+                SELECT fingerprint, AVG(status = 'pass') FROM measurements
+                WHERE ts >= ? {source_filter} GROUP BY fingerprint
+            ''', params).fetchall())
+
+    def history(self, proxy: Dict[str, Any], limit: int = 50) -> List[Dict[str, Any]]:
+        """节点最近的测量记录，按时间倒序"""
+        with self.lock:
+            rows = self.conn.execute(f'''
+                SELECT ts, source, status, {', '.join(MEASUREMENT_FIELDS)} FROM measurements
+                WHERE fingerprint = ? ORDER BY ts DESC LIMIT ?
+            ''', (node_fingerprint(proxy), limit)).fetchall()
+        columns = ('ts', 'source', 'status') + MEASUREMENT_FIELDS
+        return [dict(zip(columns, row)) for row in rows]
+
+    def purge(self, older_than: float = DEFAULT_RETENTION):
+        """删除过旧的测量记录，以及已没有测量记录的节点"""
+        with self.lock:
+            self.conn.execute('DELETE FROM measurements WHERE ts < ?', (time.time() - older_than,))
+            self.conn.execute('DELETE FROM nodes WHERE fingerprint NOT IN (SELECT fingerprint FROM measurements)')
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            nodes = self.conn.execute('SELECT COUNT(*) FROM nodes').fetchone()[0]
+            measurements = self.conn.execute('SELECT COUNT(*) FROM measurements').fetchone()[0]
+        return {'nodes': nodes, 'measurements': measurements}
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看节点测试结果的历史记录")
+    parser.add_argument('--db', default=DEFAULT_RESULT_DB, help=f'结果文件路径, 默认{DEFAULT_RESULT_DB}')
+    parser.add_argument('--best', type=int, default=20, help='列出近期中位延迟最低的节点数, 默认20')
+    parser.add_argument('--since', type=int, default=DEFAULT_RECENT_WINDOW,
+                        help=f'统计最近多少秒内的测量, 默认{DEFAULT_RECENT_WINDOW}')
+    parser.add_argument('--source', choices=['mihomo', 'speed'], default=None, help='只统计该来源的测量')
+    parser.add_argument('--output', default=None, help='把这些节点写入YAML文件')
+    parser.add_argument('--purge', action='store_true', help=f'删除超过{DEFAULT_RETENTION}秒的测量记录')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"结果文件不存在: {args.db}")
+        return
+    store = ResultStore(args.db)
+    if args.purge:
+        store.purge()
+    stats = store.stats()
+    print(f"节点: {stats['nodes']} 个, 测量记录: {stats['measurements']} 条")
+    best = store.best(args.best, args.since, args.source)
+    for entry in best:
+        print(f"  {entry['proxy'].get('name', 'Unknown')}: 中位延迟 {entry['median']}ms, "
+              f"样本 {entry['samples']}, 通过率 {entry['pass_rate']:.0%}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            yaml.safe_dump({'proxies': [entry['proxy'] for entry in best]}, f, allow_unicode=True)
+        print(f"已写入: {args.output}")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,219 @@
+import argparse
+import asyncio
 import concurrent.futures
+import contextlib
 import logging
 import os
 import socket
+import ssl
 import time
+import urllib.parse
 from multiprocessing import cpu_count
 
+import numpy as np
 import requests
 import yaml
 from requests.exceptions import RequestException, Timeout
 from tqdm import tqdm
 
+import bandwidth_server
+from fingerprint import node_fingerprint
+import mihomo_test
+import node_score
+import prescreen
+from negative_cache import NegativeCache
+from result_store import ResultStore
+
 # 配置日志记录器 (保留用于代理测试时的警告信息)
 logging.basicConfig(level=logging.WARNING, format='%(message)s')
 
-def test_single_proxy_process(proxy_config, timeout=10, test_url='http://speed.cloudflare.com/__down?bytes=10485760', retry_count=3):
+# 失效服务端缓存的建议路径，与 mihomo_test 共用；默认不启用，需以 --negative-cache 指定
+NEGATIVE_CACHE_FILE = './negative_cache.db'
+# 表示服务端不可达的失败原因，其余失败(如下载测试失败)不计入失效缓存
+UNREACHABLE_REASONS = ('missing server or port', 'DNS resolution failed', 'connection refused', 'socket timeout',
+                       'tcp ', 'tls timeout', 'quic no response', 'udp port unreachable')
+# 异步测试器同时测试的节点数
+DEFAULT_ASYNC_CONCURRENCY = 512
+# 混淆的QUIC节点无法确认存活，给中间分数以保留
+INCONCLUSIVE_SPEED_SCORE = 50
+# 吞吐量模式: 每个mihomo实例加载的节点数，以及同时传输的节点数(并发过高会互相争用本地带宽)
+THROUGHPUT_BATCH_SIZE = 100
+THROUGHPUT_CONCURRENCY = 4
+# 自适应测速: 单次测量的时间窗口(秒)和字节上限，排除慢启动的预热时长(秒)，
+# 以及按 MEASURE_INTERVAL 采样、最近 CONVERGENCE_SAMPLES 个速率偏差均在 CONVERGENCE_TOLERANCE 内即提前结束
+MEASURE_WINDOW = 5
+MEASURE_MAX_BYTES = 10 * 1024 * 1024
+MEASURE_WARMUP = 0.5
+MEASURE_INTERVAL = 0.25
+CONVERGENCE_SAMPLES = 4
+CONVERGENCE_TOLERANCE = 0.05
+DEFAULT_TEST_URL = 'http://speed.cloudflare.com/__down?bytes=10485760'
+UPLOAD_URL = 'http://httpbin.org/post'
+UPLOAD_CHUNK_SIZE = 65536
+# 预分配的上传数据，所有上传测试共用同一块内存
+UPLOAD_PAYLOAD = memoryview(bytes(UPLOAD_CHUNK_SIZE))
+# 带宽调度: 全部测速传输的总带宽预算(Mbps)和同时进行的传输数上限，延迟探测不受限制
+DEFAULT_BANDWIDTH_BUDGET = 400
+DEFAULT_MAX_TRANSFERS = 8
+SCHEDULER_POLL_INTERVAL = 0.05
+
+
+class RateMeter:
+    """
+    按时间窗口和字节上限测量传输速率: 预热阶段(TCP慢启动)的流量不计入速率，
+    每 interval 秒记录一次区间速率，最近几次区间速率收敛后即可提前结束
+    """
+
+    def __init__(self, window=MEASURE_WINDOW, max_bytes=MEASURE_MAX_BYTES, warmup=MEASURE_WARMUP,
+                 interval=MEASURE_INTERVAL, samples=CONVERGENCE_SAMPLES, tolerance=CONVERGENCE_TOLERANCE):
+        self.window = window
+        self.max_bytes = max_bytes
+        self.warmup = warmup
+        self.interval = interval
+        self.samples = samples
+        self.tolerance = tolerance
+        self.start = time.monotonic()
+        self.now = self.start
+        self.total = 0
+        self.base_time = None
+        self.base_bytes = 0
+        self.last_time = None
+        self.last_bytes = 0
+        self.rates = []
+
+    def update(self, size):
+        """记录新传输的 size 字节"""
+        self.now = time.monotonic()
+        self.total += size
+        if self.base_time is None:
+            if self.now - self.start >= self.warmup:
+                self.base_time = self.last_time = self.now
+                self.base_bytes = self.last_bytes = self.total
+            return
+        if self.now - self.last_time >= self.interval:
+            self.rates.append((self.total - self.last_bytes) / (self.now - self.last_time))
+            self.last_time = self.now
+            self.last_bytes = self.total
+
+    def converged(self):
+        recent = self.rates[-self.samples:]
+        if len(recent) < self.samples:
+            return False
+        mean = sum(recent) / len(recent)
+        return mean > 0 and max(abs(rate - mean) for rate in recent) <= self.tolerance * mean
+
+    def done(self):
+        """达到时间窗口、字节上限或速率已收敛时返回True"""
+        return (time.monotonic() - self.start >= self.window or self.total >= self.max_bytes
+                or self.converged())
+
+    def finish(self):
+        """
+        上传收到响应时调用: 预热期内就已写完的数据可能都还在发送缓冲区中，
+        此时按收到响应的时间计算全程速率
+        """
+        if self.base_time is None:
+            self.now = time.monotonic()
+
+    def elapsed(self):
+        return self.now - self.start
+
+    def mbps(self):
+        """预热结束后的平均速率(Mbps)；传输在预热结束前就完成时按全程计算"""
+        if self.base_time is not None and self.now > self.base_time:
+            return (self.total - self.base_bytes) * 8 / ((self.now - self.base_time) * 1000000)
+        return self.total * 8 / (self.elapsed() * 1000000) if self.elapsed() > 0 else 0
+
+
+class Transfer:
+    """
+    调度器中正在进行的一次传输，统计已传输字节以估算实时速率；
+    meter 不为空时同时更新该测量，done() 与其一致
+    """
+
+    def __init__(self, reserve_mbps):
+        self.reserve_mbps = reserve_mbps
+        self.start = time.monotonic()
+        self.bytes = 0
+        self.meter = None
+
+    def update(self, size):
+        self.bytes += size
+        if self.meter is not None:
+            self.meter.update(size)
+
+    def done(self):
+        return self.meter.done() if self.meter is not None else False
+
+    def mbps(self):
+        """实时速率；预热期内速率尚未上升，按预留带宽计算，避免同时放行过多传输"""
+        elapsed = time.monotonic() - self.start
+        rate = self.bytes * 8 / (elapsed * 1000000) if elapsed > 0 else 0
+        return max(rate, self.reserve_mbps) if elapsed < MEASURE_WARMUP else rate
+
+
+class BandwidthScheduler:
+    """
+    测速传输的全局调度: 同时进行的传输不超过 max_transfers 个，
+    正在进行的传输实时速率之和达到 budget_mbps 时新传输等待，避免测速流量占满本机带宽导致结果失真
+    """
+
+    def __init__(self, budget_mbps=DEFAULT_BANDWIDTH_BUDGET, max_transfers=DEFAULT_MAX_TRANSFERS):
+        self.budget_mbps = budget_mbps
+        self.max_transfers = max(1, max_transfers)
+        self.active = set()
+        # 已完成传输速率的指数移动平均，作为新传输预热期内的预留带宽
+        self.typical_mbps = budget_mbps / self.max_transfers
+
+    def in_flight_mbps(self):
+        return sum(transfer.mbps() for transfer in self.active)
+
+    @contextlib.asynccontextmanager
+    async def transfer(self):
+        """等待带宽和传输数都有空余后开始一次传输"""
+        while (len(self.active) >= self.max_transfers
+               or (self.active and self.in_flight_mbps() >= self.budget_mbps)):
+            await asyncio.sleep(SCHEDULER_POLL_INTERVAL)
+        transfer = Transfer(self.typical_mbps)
+        self.active.add(transfer)
+        try:
+            yield transfer
+        finally:
+            self.active.discard(transfer)
+            if transfer.bytes:
+                self.typical_mbps = 0.7 * self.typical_mbps + 0.3 * transfer.mbps()
+
+
+def upload_chunks(meter):
+    """按 UPLOAD_PAYLOAD 分块产生上传数据，直到 meter 结束测量"""
+    while not meter.done():
+        yield UPLOAD_PAYLOAD
+        meter.update(len(UPLOAD_PAYLOAD))
+
+def test_single_proxy_process(proxy_config, timeout=10, test_url=DEFAULT_TEST_URL, retry_count=3,
+                              adaptive=False, upload_url=UPLOAD_URL):
     """
     为多进程执行准备的独立测试函数
     """
-    tester = ProxySpeedTester(timeout, test_url, retry_count)
+    tester = ProxySpeedTester(timeout, test_url, retry_count, adaptive, upload_url)
     return tester.test_single_proxy(proxy_config)
 
 class ProxySpeedTester:
-    def __init__(self, timeout=10, test_url='http://speed.cloudflare.com/__down?bytes=10485760', retry_count=3):
+    def __init__(self, timeout=10, test_url=DEFAULT_TEST_URL, retry_count=3,
+                 adaptive=False, upload_url=UPLOAD_URL):
         """
         初始化速度测试器
         :param timeout: 超时时间(秒)
         :param test_url: 用于测试的URL，使用10MB下载测试真实速度
         :param retry_count: 重试次数
+        :param adaptive: 自适应测速，每个方向只测一次，按时间窗口/字节上限/速率收敛结束
+        :param upload_url: 上传测试的接收地址
         """
         self.timeout = timeout
         self.test_url = test_url
         self.retry_count = retry_count
+        self.adaptive = adaptive
+        self.upload_url = upload_url
 
     def create_proxy_dict(self, proxy_config):
         """
@@ -80,6 +263,8 @@ class ProxySpeedTester:
         """
         测试下载速度，返回下载时间和速度(Mbps)
         """
+        if self.adaptive:
+            return self.measure_download(proxies)
         speeds = []
         response_times = []
 
@@ -123,6 +308,8 @@ class ProxySpeedTester:
         """
         测试上传速度，返回上传时间和速度(Mbps)
         """
+        if self.adaptive:
+            return self.measure_upload(proxies)
         speeds = []
         response_times = []
 
@@ -133,7 +320,7 @@ class ProxySpeedTester:
 
                 start_time = time.time()
                 response = requests.post(
-                    'http://httpbin.org/post',  # 使用httpbin.org作为上传测试端点
+                    self.upload_url,  # 默认使用httpbin.org作为上传测试端点
                     data=upload_data,
                     timeout=self.timeout,
                     proxies=proxies,
@@ -164,6 +351,43 @@ class ProxySpeedTester:
 
         return avg_speed, avg_response_time, None
 
+    def measure_download(self, proxies=None):
+        """
+        自适应下载测速: 读到 RateMeter 结束测量为止，不必下载完整个测试文件
+        返回值与 test_download_speed 一致，只在出错时重试
+        """
+        for i in range(self.retry_count):
+            meter = RateMeter()
+            try:
+                with requests.get(self.test_url, timeout=self.timeout, proxies=proxies, stream=True) as response:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        meter.update(len(chunk))
+                        if meter.done():
+                            break
+                return meter.mbps(), meter.elapsed(), None
+            except (Timeout, RequestException) as e:
+                if i == self.retry_count - 1:
+                    return None, None, str(e)
+        return None, None, "所有重试都失败"
+
+    def measure_upload(self, proxies=None):
+        """
+        自适应上传测速: 以分块编码发送预分配的 UPLOAD_PAYLOAD，直到 RateMeter 结束测量
+        返回值与 test_upload_speed 一致，只在出错时重试
+        """
+        for i in range(self.retry_count):
+            meter = RateMeter()
+            try:
+                response = requests.post(self.upload_url, data=upload_chunks(meter), timeout=self.timeout,
+                                         proxies=proxies, headers={'Content-Type': 'application/octet-stream'})
+                meter.finish()
+                if response.status_code == 200:
+                    return meter.mbps(), meter.elapsed(), None
+            except (Timeout, RequestException) as e:
+                if i == self.retry_count - 1:
+                    return None, None, str(e)
+        return None, None, "所有重试都失败"
+
     def test_single_proxy(self, proxy_config):
         """
         测试单个代理的上传下载速度和可连接性
@@ -375,7 +599,8 @@ class ProxySpeedTester:
 
         with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
             future_to_proxy = {
-                executor.submit(test_single_proxy_process, proxy, self.timeout, self.test_url, self.retry_count): proxy
+                executor.submit(test_single_proxy_process, proxy, self.timeout, self.test_url, self.retry_count,
+                                self.adaptive, self.upload_url): proxy
                 for proxy in proxies_list
             }
 
@@ -402,43 +627,675 @@ class ProxySpeedTester:
 
         return results, failed_proxies
 
-def filter_and_save_proxies(input_yaml, output_yaml, min_speed_score=10, max_failures=None):
+def allocate_ports(count):
     """
-    过滤代理并保存结果
+    一次分配count个互不相同的空闲本地端口 (全部绑定后再释放，避免重复)
     """
-    # 下载测试需要更长的超时时间
-    tester = ProxySpeedTester(timeout=30, retry_count=3)
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('127.0.0.1', 0))
+            sockets.append(sock)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
 
-    # 读取原始代理
-    with open(input_yaml, 'r', encoding='utf-8') as f:
-        data = yaml.safe_load(f)
-        proxies = data.get('proxies', [])
+class AsyncProxySpeedTester(ProxySpeedTester):
+    """
+    基于asyncio的速度测试器，单进程内并发执行所有节点的socket探测和HTTP传输，
+    测试流程和结果字典与 ProxySpeedTester 一致
+    """
+
+    def __init__(self, timeout=10, test_url=DEFAULT_TEST_URL, retry_count=3,
+                 concurrency=DEFAULT_ASYNC_CONCURRENCY, adaptive=False, upload_url=UPLOAD_URL,
+                 scheduler=None):
+        super().__init__(timeout, test_url, retry_count, adaptive, upload_url)
+        self.concurrency = concurrency
+        self.scheduler = scheduler or BandwidthScheduler()
+        self.dns = None
+
+    async def open_stream(self, host, port, proxies=None):
+        """
+        建立到 host:port 的连接，proxies 中有代理时经 SOCKS5 或 HTTP CONNECT 隧道
+        """
+        proxy_url = (proxies or {}).get('http')
+        if not proxy_url:
+            return await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+
+        proxy = urllib.parse.urlsplit(proxy_url)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(proxy.hostname, proxy.port), self.timeout)
+        try:
+            if proxy.scheme.startswith('socks5'):
+                await self.socks5_connect(reader, writer, host, port, proxy.username, proxy.password)
+            else:
+                writer.write(f'CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n'.encode())
+                status, _ = await self.read_headers(reader)
+                if status != 200:
+                    raise ConnectionError(f'proxy CONNECT failed: {status}')
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def socks5_connect(self, reader, writer, host, port, username=None, password=None):
+        """
+        SOCKS5 握手并请求连接 host:port (RFC 1928/1929)
+        """
+        methods = b'\x00\x02' if username else b'\x00'
+        writer.write(b'\x05' + bytes([len(methods)]) + methods)
+        version, method = await asyncio.wait_for(reader.readexactly(2), self.timeout)
+        if version != 5 or method == 0xff:
+            raise ConnectionError('socks5: no acceptable auth method')
+        if method == 2:
+            user = urllib.parse.unquote(username or '').encode()
+            pwd = urllib.parse.unquote(password or '').encode()
+            writer.write(b'\x01' + bytes([len(user)]) + user + bytes([len(pwd)]) + pwd)
+            _, status = await asyncio.wait_for(reader.readexactly(2), self.timeout)
+            if status != 0:
+                raise ConnectionError('socks5: authentication failed')
+
+        address = host.encode('idna')
+        writer.write(b'\x05\x01\x00\x03' + bytes([len(address)]) + address + int(port).to_bytes(2, 'big'))
+        _, reply, _, address_type = await asyncio.wait_for(reader.readexactly(4), self.timeout)
+        if reply != 0:
+            raise ConnectionError(f'socks5: connect failed (reply {reply})')
+        if address_type == 1:
+            skip = 4
+        elif address_type == 4:
+            skip = 16
+        else:
+            skip = (await asyncio.wait_for(reader.readexactly(1), self.timeout))[0]
+        await asyncio.wait_for(reader.readexactly(skip + 2), self.timeout)
+
+    async def read_headers(self, reader):
+        """
+        读取状态行和响应头，返回 (状态码, 小写键的响应头字典)
+        """
+        line = await asyncio.wait_for(reader.readline(), self.timeout)
+        parts = line.split()
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise ConnectionError(f'invalid HTTP response: {line[:64]!r}')
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        return int(parts[1]), headers
+
+    @contextlib.asynccontextmanager
+    async def connect(self, url, proxies=None):
+        """
+        建立到 url 所在服务器的连接(经代理隧道，https 时完成TLS握手)，产生 (reader, writer, 解析后的url)
+        测速时先建立连接再向调度器申请传输名额，无响应的代理不占用名额
+        """
+        parsed = urllib.parse.urlsplit(url)
+        https = parsed.scheme == 'https'
+        host = parsed.hostname
+        port = parsed.port or (443 if https else 80)
+        reader, writer = await self.open_stream(host, port, proxies)
+        try:
+            if https:
+                await asyncio.wait_for(writer.start_tls(ssl.create_default_context(), server_hostname=host),
+                                       self.timeout)
+            yield reader, writer, parsed
+        finally:
+            writer.close()
+
+    async def exchange(self, stream, method, body=b'', meter=None):
+        """
+        在 connect 建立的连接上发送一个HTTP/1.1请求并读完响应体(只计数不保存)，每次读写的超时为 self.timeout
+        指定 meter 时: 有 body 照常发送并按 meter 计量响应体，读到 meter 结束测量即返回；
+        无 body 时以分块编码上传 UPLOAD_PAYLOAD 直到 meter 结束测量
+
+        :return: (状态码, 响应体字节数)
+        """
+        reader, writer, parsed = stream
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        request = (f'{method} {path} HTTP/1.1\r\nHost: {parsed.netloc}\r\nConnection: close\r\n'
+                   f'User-Agent: speed_test\r\nAccept-Encoding: identity\r\n')
+        upload = meter is not None and method == 'POST' and not body
+        if body:
+            request += f'Content-Type: application/octet-stream\r\nContent-Length: {len(body)}\r\n'
+        elif upload:
+            request += 'Content-Type: application/octet-stream\r\nTransfer-Encoding: chunked\r\n'
+        writer.write(request.encode() + b'\r\n')
+        if body:
+            writer.write(body)
+        await asyncio.wait_for(writer.drain(), self.timeout)
+        if body and meter is not None:
+            meter.update(len(body))
+        if upload:
+            chunk_header = b'%x\r\n' % len(UPLOAD_PAYLOAD)
+            while not meter.done():
+                writer.write(chunk_header)
+                writer.write(UPLOAD_PAYLOAD)
+                writer.write(b'\r\n')
+                await asyncio.wait_for(writer.drain(), self.timeout)
+                meter.update(len(UPLOAD_PAYLOAD))
+            writer.write(b'0\r\n\r\n')
+            await asyncio.wait_for(writer.drain(), self.timeout)
+            meter = None
+
+        status, headers = await self.read_headers(reader)
+        total_size = 0
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            while True:
+                size = int((await asyncio.wait_for(reader.readline(), self.timeout)).split(b';')[0], 16)
+                if size == 0:
+                    break
+                while size > 0:
+                    chunk = await asyncio.wait_for(reader.read(min(size, 65536)), self.timeout)
+                    if not chunk:
+                        raise ConnectionError('connection closed in chunked body')
+                    size -= len(chunk)
+                    total_size += len(chunk)
+                    if meter is not None:
+                        meter.update(len(chunk))
+                        if meter.done():
+                            return status, total_size
+                await asyncio.wait_for(reader.readline(), self.timeout)
+        else:
+            remaining = int(headers.get('content-length', -1))
+            while remaining != 0:
+                chunk = await asyncio.wait_for(reader.read(65536 if remaining < 0 else min(remaining, 65536)),
+                                               self.timeout)
+                if not chunk:
+                    if remaining > 0:
+                        raise ConnectionError('connection closed before end of body')
+                    break
+                total_size += len(chunk)
+                remaining -= len(chunk) if remaining > 0 else 0
+                if meter is not None:
+                    meter.update(len(chunk))
+                    if meter.done():
+                        break
+        return status, total_size
+
+    async def test_download_speed_async(self, proxies=None):
+        """
+        测试下载速度，返回 (平均速度Mbps, 平均耗时, 错误信息)
+        """
+        if self.adaptive:
+            return await self.measure_transfer_async('GET', self.test_url, proxies)
+        speeds = []
+        response_times = []
+
+        for i in range(self.retry_count):
+            try:
+                async with self.connect(self.test_url, proxies) as stream, \
+                        self.scheduler.transfer() as transfer:
+                    start_time = time.time()
+                    _, total_size = await self.exchange(stream, 'GET', meter=transfer)
+                    download_time = time.time() - start_time
+                response_times.append(download_time)
+                speeds.append((total_size * 8) / (download_time * 1000000) if download_time > 0 else 0)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                if i == self.retry_count - 1:
+                    return None, None, str(e) or type(e).__name__
+                continue
+
+        if not speeds:
+            return None, None, "所有重试都失败"
+        return sum(speeds) / len(speeds), sum(response_times) / len(response_times), None
+
+    async def test_upload_speed_async(self, proxies=None, upload_size=1048576):
+        """
+        测试上传速度，返回 (平均速度Mbps, 平均耗时, 错误信息)
+        """
+        if self.adaptive:
+            return await self.measure_transfer_async('POST', self.upload_url, proxies)
+        speeds = []
+        response_times = []
+        upload_data = b'0' * upload_size
 
-    print(f"读取到 {len(proxies)} 个代理")
+        for i in range(self.retry_count):
+            try:
+                async with self.connect(self.upload_url, proxies) as stream, \
+                        self.scheduler.transfer() as transfer:
+                    start_time = time.time()
+                    status, _ = await self.exchange(stream, 'POST', upload_data, transfer)
+                    upload_time = time.time() - start_time
+                response_times.append(upload_time)
+                if status == 200:
+                    speeds.append((upload_size * 8) / (upload_time * 1000000) if upload_time > 0 else 0)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                if i == self.retry_count - 1:
+                    return None, None, str(e) or type(e).__name__
+                continue
 
-    # 测试代理速度
-    test_results, failed_proxies = tester.test_proxies_batch(proxies)
+        if not speeds:
+            return None, None, "所有重试都失败"
+        return sum(speeds) / len(speeds), sum(response_times) / len(response_times), None
+
+    async def measure_transfer_async(self, method, url, proxies=None):
+        """
+        自适应测速(GET下载/POST上传)，返回值与 test_download_speed_async 一致，只在出错时重试
+        """
+        for i in range(self.retry_count):
+            try:
+                async with self.connect(url, proxies) as stream, self.scheduler.transfer() as transfer:
+                    meter = transfer.meter = RateMeter()
+                    status, _ = await self.exchange(stream, method, meter=transfer)
+                if method == 'POST':
+                    meter.finish()
+                if status == 200:
+                    return meter.mbps(), meter.elapsed(), None
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                if i == self.retry_count - 1:
+                    return None, None, str(e) or type(e).__name__
+        return None, None, "所有重试都失败"
+
+    async def test_socket_connection_async(self, proxy_config):
+        """
+        使用TCP连接测试代理服务器的可达性，失败原因与 test_socket_connection 一致
+        """
+        name = proxy_config.get('name', 'Unknown')
+        server = proxy_config.get('server', '')
+        port = proxy_config.get('port', '')
+
+        def fail(reason):
+            return {'name': name, 'server': server, 'port': port, 'response_time': None,
+                    'speed_score': 0, 'status': 'fail', 'reason': reason}
+
+        if not server or not port:
+            return fail('missing server or port')
+
+        try:
+            start_time = time.time()
+            try:
+                ip_address = await self.dns.resolve(server, int(port))
+            except asyncio.TimeoutError:
+                return fail(prescreen.DNS_TIMEOUT_REASON)
+            except socket.gaierror:
+                return fail('DNS resolution failed')
+
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, int(port)), self.timeout)
+            connect_time = time.time() - start_time
+            writer.close()
+
+            return {
+                'name': name,
+                'server': server,
+                'port': port,
+                'response_time': round(connect_time, 2),
+                'speed_score': round(max(0, 100 - (connect_time * 20)), 1),
+                'status': 'pass'
+            }
+        except asyncio.TimeoutError:
+            return fail('socket timeout')
+        except OSError as e:
+            if e.errno:
+                return fail(f'connection refused (error code: {e.errno})')
+            return fail(f'socket error: {str(e)}')
+        except Exception as e:
+            return fail(f'socket error: {str(e)}')
+
+    async def test_tls_connection_async(self, proxy_config, params):
+        """
+        对使用TLS的节点做一次TLS握手，按节点的 sni、alpn、skip-cert-verify 判断前端是否可用，
+        以连接+握手时间评分，并记录握手耗时和证书是否有效
+        """
+        name = proxy_config.get('name', 'Unknown')
+        server = proxy_config.get('server', '')
+        port = proxy_config.get('port', '')
+        result = {'name': name, 'server': server, 'port': port, 'response_time': None,
+                  'speed_score': 0, 'status': 'fail'}
+
+        if not server or not port:
+            result['reason'] = 'missing server or port'
+            return result
+        try:
+            ip_address = await self.dns.resolve(server, int(port))
+        except asyncio.TimeoutError:
+            result['reason'] = prescreen.DNS_TIMEOUT_REASON
+            return result
+        except (socket.gaierror, OSError):
+            result['reason'] = 'DNS resolution failed'
+            return result
+
+        probe = await prescreen.probe_tls(ip_address, int(port), params['server_name'], params['alpn'],
+                                          params['verify'], self.timeout)
+        result['cert_valid'] = probe['cert_valid']
+        if not probe['alive']:
+            result['reason'] = probe['reason']
+            return result
+
+        elapsed = (probe['connect_ms'] + probe['handshake_ms']) / 1000
+        result.update({
+            'response_time': round(elapsed, 2),
+            'download_mbps': 0,
+            'upload_mbps': 0,
+            'speed_score': round(max(0, 100 - (elapsed * 25)), 1),
+            'status': 'pass',
+            'tls_handshake_ms': probe['handshake_ms'],
+            'alpn': probe['alpn'],
+        })
+        return result
+
+    async def test_udp_connection_async(self, proxy_config):
+        """
+        UDP/QUIC节点的存活探测 (见 prescreen.probe_udp_proxy)，以响应时间评分；
+        混淆节点结果不确定时记为通过并给中间分数
+        """
+        name = proxy_config.get('name', 'Unknown')
+        server = proxy_config.get('server', '')
+        port = proxy_config.get('port', '')
+        result = {'name': name, 'server': server, 'port': port, 'response_time': None,
+                  'speed_score': 0, 'status': 'fail'}
+
+        if not server or not port:
+            result['reason'] = 'missing server or port'
+            return result
+        try:
+            ip_address = await self.dns.resolve(server, int(port))
+        except asyncio.TimeoutError:
+            result['reason'] = prescreen.DNS_TIMEOUT_REASON
+            return result
+        except (socket.gaierror, OSError):
+            result['reason'] = 'DNS resolution failed'
+            return result
+
+        start_time = time.time()
+        alive, reason = await prescreen.probe_udp_proxy(proxy_config, ip_address, int(port), self.timeout)
+        elapsed = time.time() - start_time
+        if not alive:
+            result['reason'] = reason
+            return result
+
+        inconclusive = reason.startswith('quic inconclusive')
+        result.update({
+            'response_time': None if inconclusive else round(elapsed, 2),
+            'download_mbps': 0,
+            'upload_mbps': 0,
+            'speed_score': INCONCLUSIVE_SPEED_SCORE if inconclusive else round(max(0, 100 - (elapsed * 25)), 1),
+            'status': 'pass',
+        })
+        if reason:
+            result['reason'] = reason
+        return result
+
+    async def test_transfer_async(self, proxy_config, proxies):
+        """
+        经代理依次测试下载和上传速度，按下载70%、上传30%的权重评分
+        """
+        name = proxy_config.get('name', 'Unknown')
+        server = proxy_config.get('server', '')
+        port = proxy_config.get('port', '')
+
+        # 下载和上传依次进行，避免互相争用带宽
+        download_speed, download_time, download_error = await self.test_download_speed_async(proxies)
+        upload_speed, upload_time, upload_error = await self.test_upload_speed_async(proxies)
+        if download_speed is None or upload_speed is None:
+            return {
+                'name': name,
+                'server': server,
+                'port': port,
+                'response_time': None,
+                'download_mbps': 0,
+                'upload_mbps': 0,
+                'speed_score': 0,
+                'status': 'fail',
+                'reason': download_error or upload_error or "下载或上传测试失败"
+            }
+
+        # 计算综合速度评分（下载权重70%，上传权重30%）
+        combined_score = (download_speed * 0.7 + upload_speed * 0.3) * 10
+        return {
+            'name': name,
+            'server': server,
+            'port': port,
+            'response_time': round(max(download_time, upload_time), 2),
+            'download_mbps': round(download_speed, 2),
+            'upload_mbps': round(upload_speed, 2),
+            'speed_score': min(100, max(0, round(combined_score, 1))),
+            'status': 'pass'
+        }
+
+    async def test_throughput_batch_async(self, proxies_list, listener_ports, concurrency):
+        """
+        经本地mihomo为每个节点开设的mixed端口测试真实吞吐量，proxies_list 与 listener_ports 一一对应
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def bounded(proxy, listener_port):
+            local_proxy = f'socks5://127.0.0.1:{listener_port}'
+            async with semaphore:
+                return await self.test_transfer_async(proxy, {'http': local_proxy, 'https': local_proxy})
+
+        with tqdm(total=len(proxies_list), desc="吞吐量测试", unit="个") as pbar:
+            async def tracked(proxy, listener_port):
+                result = await bounded(proxy, listener_port)
+                pbar.update(1)
+                return result
+            # 结果与 proxies_list 一一对应
+            return list(await asyncio.gather(*[tracked(p, port) for p, port in zip(proxies_list, listener_ports)]))
+
+    def test_proxies_throughput(self, proxies_list, batch_size=THROUGHPUT_BATCH_SIZE,
+                                concurrency=THROUGHPUT_CONCURRENCY):
+        """
+        吞吐量模式: 节点按批加载到本地mihomo，每个节点一个mixed监听端口，
+        测试流量经该端口转发，所有协议的节点都能得到下载/上传速度
+        返回值与 test_proxies_batch 一致
+        """
+        return summarize_results(self.run_throughput(proxies_list, batch_size, concurrency))
+
+    def run_throughput(self, proxies_list, batch_size=THROUGHPUT_BATCH_SIZE, concurrency=THROUGHPUT_CONCURRENCY):
+        """吞吐量模式测试，返回与 proxies_list 一一对应的结果"""
+        print(f"开始吞吐量测试 {len(proxies_list)} 个代理... (每批 {batch_size} 个, 并发 {concurrency})")
+        results = []
+        for start in range(0, len(proxies_list), batch_size):
+            batch = proxies_list[start:start + batch_size]
+            instance = mihomo_test.MihomoInstance(mihomo_test.find_free_port())
+            listener_ports = allocate_ports(len(batch))
+            _, config_content = mihomo_test.build_batch_config([('', i, p) for i, p in enumerate(batch)],
+                                                               instance.port, instance.secret,
+                                                               listener_ports=listener_ports)
+            try:
+                if not instance.load(config_content):
+                    results.extend({
+                        'name': p.get('name', 'Unknown'), 'server': p.get('server', ''), 'port': p.get('port', ''),
+                        'response_time': None, 'download_mbps': 0, 'upload_mbps': 0, 'speed_score': 0,
+                        'status': 'fail', 'reason': 'mihomo failed to load batch'
+                    } for p in batch)
+                    continue
+                results.extend(asyncio.run(self.test_throughput_batch_async(batch, listener_ports, concurrency)))
+            finally:
+                instance.stop()
+        return results
+
+    async def test_single_proxy_async(self, proxy_config):
+        """
+        测试单个代理，流程与 test_single_proxy 一致
+        """
+        name = proxy_config.get('name', 'Unknown')
+        server = proxy_config.get('server', '')
+        port = proxy_config.get('port', '')
+        proxy_type = proxy_config.get('type', '')
+
+        def socket_summary(socket_result):
+            return {
+                'name': name,
+                'server': server,
+                'port': port,
+                'response_time': socket_result.get('response_time'),
+                'download_mbps': 0,
+                'upload_mbps': 0,
+                'speed_score': socket_result.get('speed_score', 0),
+                'status': socket_result.get('status', 'fail'),
+                'reason': socket_result.get('reason')
+            }
+
+        if proxy_type in prescreen.UDP_PROXY_TYPES:
+            # 基于UDP/QUIC的协议，TCP连接没有意义
+            return await self.test_udp_connection_async(proxy_config)
+
+        if proxy_type in ['ss', 'ssr']:
+            proxies = self.create_proxy_dict(proxy_config)
+            if not proxies:
+                return socket_summary(await self.test_socket_connection_async(proxy_config))
+
+            return await self.test_transfer_async(proxy_config, proxies)
+
+        if proxy_type in ['vmess', 'vless', 'trojan', 'hysteria2']:
+            # TLS前端只需一次握手即可判断，代替多次TCP连接
+            params = prescreen.tls_params(proxy_config)
+            if params:
+                return await self.test_tls_connection_async(proxy_config, params)
+
+            socket_result = await self.test_socket_connection_async(proxy_config)
+            if socket_result['status'] == 'pass':
+                # 不支持HTTP代理的类型，以多次连接时间作为评分
+                retries = await asyncio.gather(*(self.test_socket_connection_async(proxy_config)
+                                                 for _ in range(min(self.retry_count, 3))))
+                connect_times = [r['response_time'] for r in retries if r['status'] == 'pass' and r['response_time']]
+                if connect_times:
+                    avg_connect_time = sum(connect_times) / len(connect_times)
+                    return {
+                        'name': name,
+                        'server': server,
+                        'port': port,
+                        'response_time': round(avg_connect_time, 2),
+                        'download_mbps': 0,
+                        'upload_mbps': 0,
+                        'speed_score': round(max(0, 100 - (avg_connect_time * 25)), 1),
+                        'status': 'pass'
+                    }
+            return socket_result
+
+        return socket_summary(await self.test_socket_connection_async(proxy_config))
+
+    async def test_proxies_batch_async(self, proxies_list):
+        self.dns = prescreen.DnsCache(self.timeout, self.concurrency)
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def bounded(proxy):
+            async with semaphore:
+                try:
+                    return await self.test_single_proxy_async(proxy)
+                except Exception as e:
+                    return {'name': proxy.get('name', 'Unknown'), 'server': proxy.get('server', ''),
+                            'port': proxy.get('port', ''), 'response_time': None, 'speed_score': 0,
+                            'status': 'fail', 'reason': f'error: {str(e)}'}
+
+        with tqdm(total=len(proxies_list), desc="测试进度", unit="个") as pbar:
+            async def tracked(proxy):
+                result = await bounded(proxy)
+                pbar.update(1)
+                return result
+            # 结果与 proxies_list 一一对应
+            try:
+                return list(await asyncio.gather(*[tracked(proxy) for proxy in proxies_list]))
+            finally:
+                self.dns.close()
+
+    def test_proxies_batch(self, proxies_list, max_workers=None):
+        """
+        批量测试代理，返回值与 ProxySpeedTester.test_proxies_batch 一致
+        :param max_workers: 并发测试的节点数，默认 self.concurrency
+        """
+        if max_workers is not None:
+            self.concurrency = max_workers
+        print(f"开始测试 {len(proxies_list)} 个代理... (并发 {self.concurrency})")
+
+        results = asyncio.run(self.test_proxies_batch_async(proxies_list)) if proxies_list else []
+        return summarize_results(results)
+
+def summarize_results(results):
+    """
+    按速度评分排序结果并整理失败列表，返回值与 test_proxies_batch 一致
+    """
+    failed_proxies = [{
+        'name': result['name'],
+        'server': result['server'],
+        'port': result['port'],
+        'reason': result.get('reason', 'unknown')
+    } for result in results if result['status'] == 'fail']
+
+    # 按速度评分排序
+    results = sorted(results, key=lambda x: x['speed_score'] if x['speed_score'] else 0, reverse=True)
+
+    passed_count = len([r for r in results if r['status'] == 'pass'])
+    print(f"测试完成: 总共 {len(results)}, 通过 {passed_count}, 失败 {len(failed_proxies)}")
+
+    return results, failed_proxies
+
+def load_proxies(input_yaml):
+    """读取YAML文件中的节点列表"""
+    with open(input_yaml, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f) or {}
+    return data.get('proxies', []) or []
+
+def score_results(tasks, results, weights=None, store=None):
+    """
+    一次计算整个运行全部结果的综合评分，写入 result['score']，未通过的节点为 None
+    只有连接测试的结果以 response_time 作为延迟，有吞吐量的结果按下载/上传速度评分，
+    store 不为空时计入历史通过率(须在记录本次结果之前调用)
+    :return: 与 results 对应的评分数组，未通过的节点为 NaN
+    """
+    passed = [result['status'] == 'pass' for result in results]
+    probe_only = [not result.get('download_mbps') for result in results]
+    rates = store.pass_rates(source='speed') if store is not None else {}
+    columns = {
+        'latency': node_score.column([result if probe else {} for result, probe in zip(results, probe_only)],
+                                     'response_time', 1000),
+        'download': node_score.column(results, 'download_mbps'),
+        'upload': node_score.column(results, 'upload_mbps'),
+        'history': node_score.column([{'rate': rates.get(node_fingerprint(proxy))} for proxy in tasks], 'rate'),
+    }
+    for name in ('download', 'upload'):
+        columns[name][probe_only] = np.nan
+    scores = node_score.score_nodes(columns, weights) if results else np.array([], dtype=float)
+    scores[~np.array(passed, dtype=bool)] = np.nan
+    for result, score in zip(results, scores):
+        result['score'] = None if np.isnan(score) else float(score)
+    return scores
+
+def save_filtered(output_yaml, proxies, tested, min_speed_score=10, negative_cache=None, store=None, keep=None):
+    """
+    记录并筛选一个文件的测试结果，通过的节点按综合评分从高到低写入 output_yaml
+    :param proxies: 文件中的全部节点
+    :param tested: (节点, 测试结果) 列表，跳过的节点不在其中
+    :param keep: 与 tested 对应的排名截断掩码，为 None 时不截断
+    :return: (保留数, 过滤数)
+    """
+    for proxy, result in tested:
+        if negative_cache is not None:
+            if result['status'] == 'pass':
+                negative_cache.record_success(proxy)
+            elif str(result.get('reason', '')).startswith(UNREACHABLE_REASONS):
+                negative_cache.record_failure(proxy)
+        if store is not None:
+            store.record(proxy, 'speed', result['status'] == 'pass',
+                         download_mbps=result.get('download_mbps'), upload_mbps=result.get('upload_mbps'),
+                         speed_score=result.get('speed_score'))
 
     # 过滤通过的代理
     passed_proxies = []
     speed_stats = []
 
-    for result in test_results:
-        if result['status'] == 'pass' and result['speed_score'] >= min_speed_score:
-            # 找到原始代理配置
-            original_proxy = next((p for p in proxies if p['name'] == result['name']), None)
-            if original_proxy:
-                passed_proxies.append(original_proxy)
-                speed_stats.append({
-                    'name': result['name'],
-                    'download_mbps': result.get('download_mbps', 0),
-                    'upload_mbps': result.get('upload_mbps', 0),
-                    'speed_score': result['speed_score'],
-                    'response_time': result['response_time']
-                })
+    keep = keep if keep is not None else [True] * len(tested)
+    ranked = sorted(zip(tested, keep), reverse=True,
+                    key=lambda item: (item[0][1].get('score') or 0, item[0][1]['speed_score'] or 0))
+    for (proxy, result), kept in ranked:
+        if kept and result['status'] == 'pass' and result['speed_score'] >= min_speed_score:
+            passed_proxies.append(proxy)
+            speed_stats.append({
+                'name': result['name'],
+                'download_mbps': result.get('download_mbps', 0),
+                'upload_mbps': result.get('upload_mbps', 0),
+                'speed_score': result['speed_score'],
+                'score': result.get('score'),
+                'response_time': result['response_time']
+            })
 
     # 保存过滤后的代理
-    os.makedirs(os.path.dirname(output_yaml), exist_ok=True)
+    os.makedirs(os.path.dirname(output_yaml) or '.', exist_ok=True)
     with open(output_yaml, 'w', encoding='utf-8') as f:
         yaml.safe_dump({'proxies': passed_proxies}, f, allow_unicode=True)
 
@@ -454,6 +1311,9 @@ def filter_and_save_proxies(input_yaml, output_yaml, min_speed_score=10, max_fai
         upload_stats = [s['upload_mbps'] for s in speed_stats if s['upload_mbps'] > 0]
 
         stats_info = f"平均速度评分: {avg_speed_score:.1f}, 平均响应: {avg_response:.2f}s"
+        scores = [s['score'] for s in speed_stats if s['score'] is not None]
+        if scores:
+            stats_info += f", 平均综合评分: {sum(scores) / len(scores):.1f}"
 
         if download_stats and upload_stats:
             avg_download = sum(download_stats) / len(download_stats)
@@ -467,45 +1327,136 @@ def filter_and_save_proxies(input_yaml, output_yaml, min_speed_score=10, max_fai
 
     return len(passed_proxies), len(proxies) - len(passed_proxies)
 
-def process_single_file(file_info, min_speed_score=10):
+def filter_and_save_files(file_list, min_speed_score=10, negative_cache_file=None,
+                          throughput=False, adaptive=False, result_db=None, test_url=DEFAULT_TEST_URL,
+                          upload_url=UPLOAD_URL, bandwidth_budget=DEFAULT_BANDWIDTH_BUDGET,
+                          max_transfers=DEFAULT_MAX_TRANSFERS, score_weights=None, min_score=None,
+                          top_fraction=None):
     """
-    处理单个文件，用于多进程执行
-    :param file_info: 包含输入输出路径的字典
-    :param min_speed_score: 最低速度评分
+    整个运行共用一个测试器、带宽调度器、失效缓存和结果存储: 所有文件的节点在同一事件循环中
+    作为一组任务测试，文件只是节点的分组，结果按文件重新组装后写入各自的 output_path
+    :param file_list: [{'filename', 'input_path', 'output_path'}]
+    其余参数见 filter_and_save_proxies
+    :return: 每个文件的处理结果 {'filename', 'success', 'passed', 'filtered'[, 'error']}
     """
-    input_path = file_info['input_path']
-    output_path = file_info['output_path']
-    filename = file_info['filename']
+    # 下载测试需要更长的超时时间
+    tester = AsyncProxySpeedTester(timeout=30, test_url=test_url, retry_count=3, adaptive=adaptive,
+                                   upload_url=upload_url,
+                                   scheduler=BandwidthScheduler(bandwidth_budget, max_transfers))
+    negative_cache = NegativeCache(negative_cache_file) if negative_cache_file else None
+    store = ResultStore(result_db) if result_db else None
 
+    processed_results = []
+    groups = []
     try:
-        print(f"开始处理文件: {filename}")
-        passed, filtered = filter_and_save_proxies(
-            input_path, output_path,
-            min_speed_score=min_speed_score
-        )
-        print(f"完成处理文件: {filename} (保留 {passed}, 过滤 {filtered})")
-        return {
-            'filename': filename,
-            'success': True,
-            'passed': passed,
-            'filtered': filtered
-        }
-    except Exception as e:
-        print(f"错误处理文件 {filename}: {str(e)}")
-        return {
-            'filename': filename,
-            'success': False,
-            'passed': 0,
-            'filtered': 0,
-            'error': str(e)
-        }
+        for file_info in file_list:
+            try:
+                proxies = load_proxies(file_info['input_path'])
+            except (OSError, yaml.YAMLError) as e:
+                print(f"错误处理文件 {file_info['filename']}: {str(e)}")
+                processed_results.append({'filename': file_info['filename'], 'success': False,
+                                          'passed': 0, 'filtered': 0, 'error': str(e)})
+                continue
+            candidates = proxies
+            if negative_cache is not None:
+                candidates = [p for p in proxies if not negative_cache.should_skip(p)]
+            print(f"{file_info['filename']}: 读取到 {len(proxies)} 个代理, 跳过已知失效节点 "
+                  f"{len(proxies) - len(candidates)} 个")
+            groups.append((file_info, proxies, candidates))
+
+        # 测试代理速度，结果与 tasks 一一对应
+        tasks = [proxy for _, _, candidates in groups for proxy in candidates]
+        if throughput:
+            results = tester.run_throughput(tasks)
+        else:
+            print(f"开始测试 {len(tasks)} 个代理... (并发 {tester.concurrency})")
+            results = asyncio.run(tester.test_proxies_batch_async(tasks)) if tasks else []
+        summarize_results(results)
+
+        # 综合评分和排名截断在整个运行的结果上一次计算，各文件共用同一标准
+        scores = score_results(tasks, results, score_weights, store)
+        keep = node_score.cutoff(scores, min_score, top_fraction=top_fraction)
+        if min_score is not None or top_fraction:
+            print(f"综合评分截断: 通过 {int((~np.isnan(scores)).sum())} 个 → 保留 {int(keep.sum())} 个")
+
+        position = 0
+        for file_info, proxies, candidates in groups:
+            tested = list(zip(candidates, results[position:position + len(candidates)]))
+            file_keep = keep[position:position + len(candidates)]
+            position += len(candidates)
+            print(f"\n{file_info['filename']}:")
+            passed, filtered = save_filtered(file_info['output_path'], proxies, tested, min_speed_score,
+                                             negative_cache, store, file_keep)
+            processed_results.append({'filename': file_info['filename'], 'success': True,
+                                      'passed': passed, 'filtered': filtered})
+    finally:
+        if negative_cache is not None:
+            negative_cache.close()
+        if store is not None:
+            store.close()
+
+    return processed_results
+
+def filter_and_save_proxies(input_yaml, output_yaml, min_speed_score=10, max_failures=None,
+                            negative_cache_file=None, throughput=False, adaptive=False,
+                            result_db=None, test_url=DEFAULT_TEST_URL, upload_url=UPLOAD_URL,
+                            bandwidth_budget=DEFAULT_BANDWIDTH_BUDGET, max_transfers=DEFAULT_MAX_TRANSFERS,
+                            score_weights=None, min_score=None, top_fraction=None):
+    """
+    过滤代理并保存结果
+    negative_cache_file 不为空时跳过已知失效的服务端，并记录本次不可达的服务端
+    result_db 不为空时把每个节点的测试结果追加到历史记录
+    throughput 为True时所有节点经本地mihomo测试真实吞吐量
+    adaptive 为True时按时间窗口/字节上限自适应测速
+    test_url、upload_url 为下载和上传测试的地址
+    bandwidth_budget、max_transfers 为测速传输的总带宽(Mbps)和同时传输数上限
+    score_weights 为综合评分的指标权重，min_score、top_fraction 为按综合评分截断的最低分和保留比例
+    """
+    file_info = {'filename': os.path.basename(input_yaml), 'input_path': input_yaml, 'output_path': output_yaml}
+    result = filter_and_save_files([file_info], min_speed_score, negative_cache_file, throughput, adaptive,
+                                   result_db, test_url, upload_url, bandwidth_budget, max_transfers,
+                                   score_weights, min_score, top_fraction)[0]
+    if not result['success']:
+        raise RuntimeError(result['error'])
+    return result['passed'], result['filtered']
 
 def main():
     """
-    主函数，使用多进程并行处理所有 merged_proxies 文件
+    主函数，所有 merged_proxies 文件的节点在同一进程中统一测试
     """
-    proxy_dir = 'sub'
-    min_speed_score = 10
+    parser = argparse.ArgumentParser(description="测试代理速度并筛选节点")
+    parser.add_argument('--dir', default='sub', help='节点文件所在目录, 默认sub')
+    parser.add_argument('--min-speed-score', type=float, default=10, help='最低速度评分, 默认10')
+    parser.add_argument('--throughput', action='store_true',
+                        help='所有节点经本地mihomo的mixed端口测试真实下载/上传速度')
+    parser.add_argument('--adaptive', action='store_true',
+                        help=f'自适应测速: 每个方向最多{MEASURE_WINDOW}秒, 速率收敛后提前结束, 不计入慢启动阶段')
+    parser.add_argument('--negative-cache', metavar='PATH', default=None,
+                        help=f'失效服务端缓存文件 (如 {NEGATIVE_CACHE_FILE})，跳过退避期内的失效节点并写回本次结果, 默认不启用')
+    parser.add_argument('--results-db', metavar='PATH', default=None,
+                        help='测试结果历史记录文件 (SQLite)，每个节点的结果追加写入')
+    parser.add_argument('--offline', action='store_true',
+                        help='启动本地带宽测试服务代替 speed.cloudflare.com 和 httpbin.org, '
+                             '用于基准测试或经 fake_mihomo 的吞吐量测试')
+    parser.add_argument('--offline-mbps', type=float, default=0,
+                        help='本地带宽测试服务每个连接的上下行限速(Mbps), 默认0不限速')
+    parser.add_argument('--bandwidth-budget', type=float, default=DEFAULT_BANDWIDTH_BUDGET,
+                        help=f'所有测速传输合计的带宽上限(Mbps), 默认{DEFAULT_BANDWIDTH_BUDGET}')
+    parser.add_argument('--max-transfers', type=int, default=DEFAULT_MAX_TRANSFERS,
+                        help=f'同时进行的测速传输数上限, 默认{DEFAULT_MAX_TRANSFERS}')
+    parser.add_argument('--score-weights', default='',
+                        help='综合评分的指标权重, 如 latency=0.5,download=0.3, 未指定的指标使用默认权重')
+    parser.add_argument('--min-score', type=float, default=None, help='最低综合评分(0~100), 默认不限制')
+    parser.add_argument('--top-fraction', type=float, default=None,
+                        help='只保留综合评分排名前该比例(0~1)的节点, 默认全部保留')
+    args = parser.parse_args()
+    try:
+        score_weights = node_score.parse_weights(args.score_weights)
+    except ValueError as e:
+        parser.error(str(e))
+    proxy_dir = args.dir
+    min_speed_score = args.min_speed_score
+    test_url, upload_url = DEFAULT_TEST_URL, UPLOAD_URL
 
     # 查找所有 merged_proxies_*.yaml 文件
     file_list = []
@@ -523,24 +1474,35 @@ def main():
         print("没有找到需要处理的YAML文件")
         return
 
-    # 使用多进程并行处理文件
-    max_workers = min(len(file_list), cpu_count() * 2)  # 根据文件数量和CPU核心数设置进程数
+    print(f"发现 {len(file_list)} 个YAML文件，所有节点统一测试")
+    print(f"测速传输: 总带宽 {args.bandwidth_budget:g}Mbps, 同时 {args.max_transfers} 个")
 
-    print(f"发现 {len(file_list)} 个YAML文件，开始并行处理... (使用 {max_workers} 个进程)")
+    server = None
+    if args.offline:
+        # 节点经本机代理访问，测速目标为本机的带宽测试服务
+        server = bandwidth_server.start_server(download_mbps=args.offline_mbps, upload_mbps=args.offline_mbps)
+        test_url, upload_url = server.download_url(), server.upload_url()
+        print(f"使用本地带宽测试服务: {server.url('')}")
 
-    processed_results = []
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_to_file = {
-            executor.submit(process_single_file, file_info, min_speed_score): file_info
-            for file_info in file_list
-        }
-
-        with tqdm(total=len(file_list), desc="文件处理进度", unit="个") as pbar:
-            for future in concurrent.futures.as_completed(future_to_file):
-                result = future.result()
-                processed_results.append(result)
-                pbar.update(1)
+    try:
+        processed_results = filter_and_save_files(
+            file_list, min_speed_score,
+            negative_cache_file=args.negative_cache,
+            throughput=args.throughput,
+            adaptive=args.adaptive,
+            result_db=args.results_db,
+            test_url=test_url,
+            upload_url=upload_url,
+            bandwidth_budget=args.bandwidth_budget,
+            max_transfers=args.max_transfers,
+            score_weights=score_weights,
+            min_score=args.min_score,
+            top_fraction=args.top_fraction
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
 
     # 统计结果
     processed_count = len([r for r in processed_results if r['success']])
@@ -548,7 +1510,7 @@ def main():
     total_filtered = sum(r['filtered'] for r in processed_results if r['success'])
     error_count = len([r for r in processed_results if not r['success']])
 
-    print(f"\n并行处理完成: {processed_count} 个文件成功, {error_count} 个失败")
+    print(f"\n处理完成: {processed_count} 个文件成功, {error_count} 个失败")
     print(f"总计: 保留 {total_passed} 个代理, 过滤 {total_filtered} 个代理")
 
     if error_count > 0:
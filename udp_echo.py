@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+udp_echo.py - 本地UDP服务，用于离线测试 prescreen 的 UDP/QUIC 探测
+
+模式:
+    echo:   原样返回收到的数据报
+    quic:   像QUIC服务端一样，对未知版本号的长包头数据包回复版本协商包
+    silent: 只接收不回复，模拟丢弃探测包的服务端或混淆节点
+
+用法:
+    python udp_echo.py [--host <ip>] [--port <n>] [--mode echo|quic|silent]
+"""
+
+import argparse
+import asyncio
+import os
+
+# 版本协商包中宣告支持的版本: QUIC v1、v2
+SUPPORTED_VERSIONS = [0x00000001, 0x6b3343cf]
+
+
+def version_negotiation(data: bytes) -> bytes:
+    """对未知版本号的QUIC长包头数据包构造版本协商包，其余数据返回None"""
+    if len(data) < 7 or not data[0] & 0x80:
+        return None
+    if int.from_bytes(data[1:5], 'big') in SUPPORTED_VERSIONS + [0]:
+        return None
+    dcid_len = data[5]
+    dcid = data[6:6 + dcid_len]
+    pos = 6 + dcid_len
+    if pos >= len(data):
+        return None
+    scid = data[pos + 1:pos + 1 + data[pos]]
+    packet = bytes([0x80 | (os.urandom(1)[0] & 0x7f)]) + b'\0\0\0\0'
+    packet += bytes([len(scid)]) + scid + bytes([len(dcid)]) + dcid
+    return packet + b''.join(v.to_bytes(4, 'big') for v in SUPPORTED_VERSIONS)
+
+
+class UdpEchoProtocol(asyncio.DatagramProtocol):
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.mode == 'echo':
+            self.transport.sendto(data, addr)
+        elif self.mode == 'quic':
+            reply = version_negotiation(data)
+            if reply:
+                self.transport.sendto(reply, addr)
+
+
+async def serve(host: str, port: int, mode: str):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: UdpEchoProtocol(mode), local_addr=(host, port))
+    print(f'udp {mode} server listening at {host}:{transport.get_extra_info("sockname")[1]}', flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地UDP echo / QUIC版本协商服务")
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址, 默认127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443, help='监听端口, 默认8443')
+    parser.add_argument('--mode', choices=['echo', 'quic', 'silent'], default='quic', help='响应模式, 默认quic')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.mode))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()